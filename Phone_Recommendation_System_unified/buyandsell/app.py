@@ -1,36 +1,67 @@
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Blueprint, Flask, jsonify, request, send_from_directory
 from pathlib import Path
-import json, time
+import sys
 from datetime import datetime
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 DATA_DIR = BASE_DIR / "data"
 LISTINGS_FILE = DATA_DIR / "listings.json"
+sys.path.insert(0, str(BASE_DIR.parent))  # shared helpers live in ../smartshop
 
-app = Flask(__name__, static_folder=str(STATIC_DIR), static_url_path="")
+from smartshop.httpcache import cached_get
+from smartshop.ids import new_id
+from smartshop.logstore import Conflict
+from smartshop.metrics import instrument
+from smartshop.paging import find_page, page_args, project
+from smartshop.prices import price_index, suggest
+from smartshop.storage import open_store
 
-def read_listings():
+bp = Blueprint("buyandsell", __name__, static_folder=str(STATIC_DIR), static_url_path="")
+
+# JSON snapshot + append log by default, SQLite with SMARTSHOP_STORAGE=sqlite (see smartshop/storage.py)
+STORE = open_store("listings", LISTINGS_FILE)
+
+# Sold prices per (brand, model, condition), see smartshop/prices.py
+PRICES = price_index(STORE)
+
+# sort param -> (order_by, desc)
+SORTS = {"newest": ("posted_at", True), "relevance": (None, True),
+         "price": ("price", False), "price_desc": ("price", True)}
+
+def price_arg(args, name):
+    """Non-negative float query param, or None; raises ValueError."""
+    raw = (args.get(name) or "").strip()
+    if not raw:
+        return None
     try:
-        with open(LISTINGS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+        value = float(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+    if value < 0:
+        raise ValueError(f"{name} must not be negative")
+    return value
+
+def read_listings():
+    return STORE.all()
+
+def add_listing(listing):
+    return STORE.insert(listing)
 
-def write_listings(lst):
-    with open(LISTINGS_FILE, "w", encoding="utf-8") as f:
-        json.dump(lst, f, indent=2, ensure_ascii=False)
+def update_listing(lid, fields, unless=None):
+    return STORE.update(lid, fields, unless=unless)
 
-@app.route("/")
+@bp.route("/")
 def home():
-    return app.send_static_file("used.html")
+    return bp.send_static_file("used.html")
 
-@app.route("/used.html")
+@bp.route("/used.html")
 def used_page():
-    return app.send_static_file("used.html")
+    return bp.send_static_file("used.html")
 
-@app.route("/api/listings", methods=["GET"])
+@bp.route("/api/listings", methods=["GET"])
+@cached_get(lambda: STORE.version())
 def api_listings():
     """
     Query params:
@@ -38,35 +69,53 @@ def api_listings():
       - city, state
       - type: sell|buy
       - status: available|sold (default available)
+      - min_price, max_price: price range (inclusive)
+      - sort: newest | relevance | price (cheapest first) | price_desc
+        (default: relevance when q is given, else newest)
+      - limit, cursor, fields: pagination / projection (see smartshop/paging.py)
     """
+    try:
+        page = page_args(request.args)
+        min_price, max_price = price_arg(request.args, "min_price"), price_arg(request.args, "max_price")
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
     q = (request.args.get("q") or "").strip().lower()
     city = (request.args.get("city") or "").strip().lower()
     state = (request.args.get("state") or "").strip().lower()
     ltype = (request.args.get("type") or "").strip().lower()
     status = (request.args.get("status") or "available").strip().lower()
+    sort = (request.args.get("sort") or ("relevance" if q else "newest")).strip().lower()
 
-    all_listings = read_listings()
-    def matches(item):
-        if status and item.get("status","") != status:
-            return False
-        if ltype and item.get("type","") != ltype:
-            return False
-        if city and item.get("city","").strip().lower() != city:
-            return False
-        if state and item.get("state","").strip().lower() != state:
-            return False
-        if q:
-            txt = " ".join([str(item.get(k,"")).lower() for k in ("brand","model","description")])
-            if q not in txt:
-                return False
-        return True
-
-    results = [i for i in all_listings if matches(i)]
-    # newest first
-    results.sort(key=lambda x: x.get("posted_at",""), reverse=True)
-    return jsonify({"total": len(results), "results": results})
-
-@app.route("/api/listings", methods=["POST"])
+    query = {"eq": {"status": status, "type": ltype, "city": city, "state": state}, "text": q,
+             "ge": {"price": min_price}, "le": {"price": max_price}}
+    order_by, desc = SORTS.get(sort, SORTS["newest"])
+    try:
+        results, next_cursor = find_page(STORE, page, order_by=order_by, desc=desc, **query)
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"invalid cursor"}), 400
+    total = len(results) if page.limit is None else STORE.stats(**query)[0]
+    return jsonify({"total": total, "results": project(results, page.fields), "next_cursor": next_cursor})
+
+@bp.route("/api/listings/price_suggestion", methods=["GET"])
+@cached_get(lambda: STORE.version())
+def api_price_suggestion():
+    """
+    What similar phones sold for.
+    Query params:
+      - brand, model (model required)
+      - condition: optional; used when that condition has enough sales
+    Returns suggested_price (median), low/high (25th/75th percentile), the
+    `basis` used (model_condition | model | null) and its sale stats.
+    """
+    brand = (request.args.get("brand") or "").strip()
+    model = (request.args.get("model") or "").strip()
+    condition = (request.args.get("condition") or "").strip()
+    if not model:
+        return jsonify({"status":"error","message":"model required"}), 400
+    return jsonify({"status":"ok","brand":brand,"model":model,"condition":condition,
+                    **suggest(PRICES, brand, model, condition)})
+
+@bp.route("/api/listings", methods=["POST"])
 def api_post_listing():
     """
     Accepts JSON or form data for a new listing.
@@ -86,17 +135,22 @@ def api_post_listing():
         missing = [f for f in required if not data.get(f)]
         if missing:
             return jsonify({"status":"error","message":"missing fields for sell: "+", ".join(missing)}), 400
+    try:
+        price = float(data.get("price") or 0)
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"price must be a number"}), 400
+    if price < 0:
+        return jsonify({"status":"error","message":"price must not be negative"}), 400
 
     # build listing object
-    listings = read_listings()
-    lid = f"L{int(time.time()*1000)}"
+    lid = new_id("L")
     listing = {
         "id": lid,
         "type": ltype,
         "brand": data.get("brand","").strip(),
         "model": data.get("model","").strip(),
         "condition": data.get("condition","").strip(),
-        "price": float(data.get("price") or 0),
+        "price": price,
         "description": data.get("description","").strip(),
         "city": data.get("city","").strip(),
         "state": data.get("state","").strip(),
@@ -106,31 +160,42 @@ def api_post_listing():
         "status": "available",
         "posted_at": datetime.utcnow().isoformat() + "Z"
     }
-    listings.append(listing)
-    write_listings(listings)
-    return jsonify({"status":"ok","listing":listing})
+    add_listing(listing)
+    # market context for the asking price
+    market = suggest(PRICES, listing["brand"], listing["model"], listing["condition"]) if listing["model"] else None
+    return jsonify({"status":"ok","listing":listing,"price_suggestion":market})
 
-@app.route("/api/mark_sold", methods=["POST"])
+@bp.route("/api/mark_sold", methods=["POST"])
 def api_mark_sold():
     """
-    JSON body: { "id": "<listing id>" }
-    Marks listing as sold (status='sold')
+    JSON body: { "id": "<listing id>", "sold_price": <optional, defaults to the asking price> }
+    Marks listing as sold (status='sold') and adds its price to the price index
     """
     data = request.get_json(silent=True) or {}
     lid = data.get("id")
     if not lid:
         return jsonify({"status":"error","message":"missing id"}), 400
-    listings = read_listings()
-    found = False
-    for l in listings:
-        if l.get("id") == lid:
-            l["status"] = "sold"
-            found = True
-            break
-    if not found:
+    fields = {"status": "sold", "sold_at": datetime.utcnow().isoformat() + "Z"}
+    if data.get("sold_price") not in (None, ""):
+        try:
+            fields["sold_price"] = float(data["sold_price"])
+        except (TypeError, ValueError):
+            return jsonify({"status":"error","message":"sold_price must be a number"}), 400
+        if fields["sold_price"] <= 0:
+            return jsonify({"status":"error","message":"sold_price must be positive"}), 400
+    try:
+        # checked and written in one store step, so concurrent calls cannot both sell it
+        listing = update_listing(lid, fields, unless={"status": "sold"})
+    except Conflict:
+        return jsonify({"status":"ok","message":"already sold"})  # already counted in the price index
+    if listing is None:
         return jsonify({"status":"error","message":"id not found"}), 404
-    write_listings(listings)
     return jsonify({"status":"ok"})
 
+# Standalone server for this module; gateway.py mounts `bp` under /buyandsell instead
+app = Flask(__name__, static_folder=None)
+app.register_blueprint(bp)
+instrument(app)
+
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5002, debug=True)
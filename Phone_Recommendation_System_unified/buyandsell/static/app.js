@@ -1,8 +1,11 @@
 
 const $ = (s) => document.querySelector(s);
+const PAGE_SIZE = 20;
+let nextCursor = null;
+let lastParams = {};
 
 async function fetchListings(params={}) {
-  const url = new URL(location.origin + "/api/listings");
+  const url = new URL("api/listings", location.href);
   Object.entries(params).forEach(([k,v]) => { if (v) url.searchParams.set(k, v); });
   const res = await fetch(url);
   return res.json();
@@ -41,7 +44,7 @@ function listingCard(l) {
   if (markBtn) {
     markBtn.addEventListener("click", async () => {
       if (!confirm("Mark this listing as SOLD? (This cannot be undone)")) return;
-      const res = await fetch("/api/mark_sold", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify({id: l.id})});
+      const res = await fetch("api/mark_sold", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify({id: l.id})});
       const data = await res.json();
       if (data.status === "ok") {
         alert("Marked as sold.");
@@ -57,20 +60,50 @@ async function loadListings() {
   const city = $("#filterCity").value.trim();
   const state = $("#filterState").value.trim();
   const type = $("#filterType").value;
+  const minPrice = $("#minPrice").value.trim();
+  const maxPrice = $("#maxPrice").value.trim();
+  const sort = $("#sortBy").value;
   const params = {};
   if (q) params.q = q;
   if (city) params.city = city;
   if (state) params.state = state;
   if (type) params.type = type;
+  if (minPrice) params.min_price = minPrice;
+  if (maxPrice) params.max_price = maxPrice;
+  if (sort) params.sort = sort;
   params.status = "available";
-  const res = await fetchListings(params);
+  lastParams = params;
+  const res = await fetchListings({ ...params, limit: PAGE_SIZE });
   const wrap = $("#listingsWrap");
   wrap.innerHTML = "";
   if (res.total === 0) {
     wrap.innerHTML = `<div class="muted">No listings found. Try clearing filters or post a new listing.</div>`;
+    setNextCursor(null);
     return;
   }
   res.results.forEach(l => wrap.appendChild(listingCard(l)));
+  setNextCursor(res.next_cursor);
+}
+
+async function loadMoreListings() {
+  const res = await fetchListings({ ...lastParams, limit: PAGE_SIZE, cursor: nextCursor });
+  res.results.forEach(l => $("#listingsWrap").appendChild(listingCard(l)));
+  setNextCursor(res.next_cursor);
+}
+
+function setNextCursor(cursor) {
+  nextCursor = cursor;
+  let btn = $("#loadMore");
+  if (!btn) {
+    btn = document.createElement("button");
+    btn.id = "loadMore";
+    btn.type = "button";
+    btn.className = "btn";
+    btn.textContent = "Load more";
+    btn.addEventListener("click", loadMoreListings);
+    $("#listingsWrap").after(btn);
+  }
+  btn.style.display = cursor ? "" : "none";
 }
 
 /* Form toggles */
@@ -97,6 +130,22 @@ $("#cancelForm").addEventListener("click", () => {
   $("#listingForm").reset();
 });
 
+/* Price suggestion from recent sales of the same model */
+async function updatePriceHint() {
+  const model = $("#model").value.trim();
+  const hint = $("#priceHint");
+  if ($("#type").value !== "sell" || !model) { hint.textContent = ""; return; }
+  const url = new URL("api/listings/price_suggestion", location.href);
+  url.searchParams.set("brand", $("#brand").value.trim());
+  url.searchParams.set("model", model);
+  url.searchParams.set("condition", $("#condition").value);
+  const data = await (await fetch(url)).json();
+  if (data.suggested_price == null) { hint.textContent = ""; return; }
+  const rs = (v) => "₹" + Math.round(v).toLocaleString();
+  hint.textContent = `Similar phones sold for ${rs(data.low)} – ${rs(data.high)} (median ${rs(data.suggested_price)}, ${data.sold.count} sales)`;
+}
+["#brand", "#model", "#condition"].forEach(s => $(s).addEventListener("change", updatePriceHint));
+
 /* Submit listing */
 $("#listingForm").addEventListener("submit", async (e) => {
   e.preventDefault();
@@ -105,7 +154,7 @@ $("#listingForm").addEventListener("submit", async (e) => {
   for (const [k,v] of form.entries()) payload[k]=v;
   // convert price
   if (payload.price) payload.price = Number(payload.price || 0);
-  const res = await fetch("/api/listings", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify(payload) });
+  const res = await fetch("api/listings", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify(payload) });
   const data = await res.json();
   if (data.status === "ok") {
     alert("Listing posted successfully.");
@@ -119,7 +168,7 @@ $("#listingForm").addEventListener("submit", async (e) => {
 
 /* Search form */
 $("#searchForm").addEventListener("submit", (e) => { e.preventDefault(); loadListings(); });
-$("#clearSearch").addEventListener("click", () => { $("#q").value=""; $("#filterCity").value=""; $("#filterState").value=""; $("#filterType").value=""; loadListings(); });
+$("#clearSearch").addEventListener("click", () => { $("#q").value=""; $("#filterCity").value=""; $("#filterState").value=""; $("#filterType").value=""; $("#minPrice").value=""; $("#maxPrice").value=""; $("#sortBy").value=""; loadListings(); });
 
 /* initial load */
 document.addEventListener("DOMContentLoaded", () => {
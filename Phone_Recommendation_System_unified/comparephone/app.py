@@ -1,139 +1,182 @@
 
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, Response, jsonify, request
 from pathlib import Path
-import json
+import hashlib, os, sys
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
+sys.path.insert(0, str(BASE_DIR.parent))  # shared helpers live in ../smartshop
 
-app = Flask(__name__, static_folder=str(STATIC_DIR), static_url_path="")
+from smartshop.httpcache import cached_get
+from smartshop.lru import LRUCache
+from smartshop.metrics import instrument, register_cache
+from smartshop.paging import MAX_LIMIT, page_args, paginate, project
+from smartshop.rank import RankedCatalog, parse_weights, swap_compare
+from smartshop.ratings import LiveRatings, rating_source
+from smartshop.storage import open_store
+from smartshop.text import normalize, tokenize
 
-PHONES_FILE = STATIC_DIR / "phones.json"
-
-def load_phones():
-    with open(PHONES_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+bp = Blueprint("comparephone", __name__, static_folder=str(STATIC_DIR), static_url_path="")
 
-@app.route("/")
+PHONES_FILE = STATIC_DIR / "phones.json"
+# Parsed once, with the spec matrix used for scoring (see smartshop/rank.py)
+CATALOG = RankedCatalog.shared(PHONES_FILE)
+# The same catalog rated by live review averages (rating_source=reviews, see smartshop/ratings.py),
+# from the store the reviews module writes to (shared with it when both are mounted in gateway.py)
+LIVE = LiveRatings(CATALOG, open_store("reviews", BASE_DIR.parent / "reviews" / "data" / "reviews.json"))
+
+# Memoized compare responses; sized/aged by SMARTSHOP_COMPARE_CACHE_SIZE / _TTL (seconds)
+COMPARE_CACHE = LRUCache(maxsize=int(os.environ.get("SMARTSHOP_COMPARE_CACHE_SIZE") or 1024),
+                         ttl=float(os.environ.get("SMARTSHOP_COMPARE_CACHE_TTL") or 3600))
+register_cache("compare", COMPARE_CACHE)
+COMPARE_VERSION = None
+
+def catalog_for(source):
+    """Catalog snapshot for a rating_source value; raises ValueError for unknown sources."""
+    return LIVE.get() if rating_source(source) == "reviews" else CATALOG.get()
+
+@bp.route("/")
 def index():
-    return app.send_static_file("index.html")
+    return bp.send_static_file("index.html")
 
-@app.route("/api/phones", methods=["GET"])
-def api_phones():
-    phones = load_phones()
-    return jsonify({"total": len(phones), "results": phones})
+def catalog_version():
+    return catalog_for(request.args.get("rating_source")).version
 
-@app.route("/api/phone/<pid>", methods=["GET"])
+@bp.route("/api/phones", methods=["GET"])
+@cached_get(catalog_version)
+def api_phones():
+    """
+    Query params:
+      - q (optional): search text (word prefixes in brand/model), ranked by relevance
+      - rating_source (optional): catalog | reviews (live review averages as `rating`)
+      - limit, cursor, fields: pagination / projection (see smartshop/paging.py)
+    """
+    try:
+        page = page_args(request.args)
+        catalog = catalog_for(request.args.get("rating_source"))
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    q = request.args.get("q")
+    phones = catalog.query(q=q)
+    try:
+        rows, next_cursor = paginate(phones, page, key=catalog.sort_key(ranked=bool(tokenize(q))))
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"invalid cursor"}), 400
+    return jsonify({"total": len(phones), "results": project(rows, page.fields), "next_cursor": next_cursor})
+
+@bp.route("/api/phone/<pid>", methods=["GET"])
+@cached_get(catalog_version)
 def api_phone(pid):
-    phones = load_phones()
-    for p in phones:
-        if p["id"] == pid:
-            return jsonify({"status":"ok","phone":p})
+    try:
+        p = catalog_for(request.args.get("rating_source")).get(pid)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    if p:
+        return jsonify({"status":"ok","phone":p})
     return jsonify({"status":"error","message":"not found"}), 404
 
-@app.route("/api/compare", methods=["POST"])
-def api_compare():
-    data = request.get_json(silent=True) or {}
-    id1 = data.get("id1")
-    id2 = data.get("id2")
+def compare_response(id1, id2, raw_weights, source=None):
+    """
+    Flask response for comparing id1 with id2. Bodies are memoized per
+    (catalog version, sorted id pair, weights): both orientations are
+    serialized once, each with a strong ETag, and the whole cache is
+    dropped when phones.json changes. With live review ratings the
+    version also moves with the reviews, so older entries just age out.
+    """
     if not id1 or not id2:
         return jsonify({"status":"error","message":"provide id1 and id2"}), 400
-    phones = load_phones()
-    p1 = next((p for p in phones if p["id"]==id1), None)
-    p2 = next((p for p in phones if p["id"]==id2), None)
-    if not p1 or not p2:
+    try:
+        catalog = catalog_for(source)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    if catalog.get(id1) is None or catalog.get(id2) is None:
         return jsonify({"status":"error","message":"one or both ids not found"}), 404
-
-    # Specs to consider and weights
-    specs = {
-        "rating": {"higher_is_better": True, "weight": 0.30, "label":"Rating (out of 5)"},
-        "price": {"higher_is_better": False, "weight": 0.25, "label":"Price (INR)"},
-        "ram_gb": {"higher_is_better": True, "weight": 0.15, "label":"RAM (GB)"},
-        "storage_gb": {"higher_is_better": True, "weight": 0.10, "label":"Storage (GB)"},
-        "battery_mah": {"higher_is_better": True, "weight": 0.12, "label":"Battery (mAh)"},
-        "camera_mp": {"higher_is_better": True, "weight": 0.08, "label":"Camera (MP)"}
-    }
-
-    # gather values
-    values = {}
-    for key in specs:
-        v1 = float(p1.get(key) or 0)
-        v2 = float(p2.get(key) or 0)
-        values[key] = (v1, v2)
-
-    # normalize and score
-    total1 = 0.0
-    total2 = 0.0
-    per_spec = []
-    for key, info in specs.items():
-        v1, v2 = values[key]
-        higher_better = info["higher_is_better"]
-        weight = info["weight"]
-        # normalization between the two values
-        mx = max(v1, v2)
-        mn = min(v1, v2)
-        if mx == mn:
-            s1 = s2 = 0.5
-        else:
-            if higher_better:
-                s1 = (v1 - mn) / (mx - mn)
-                s2 = (v2 - mn) / (mx - mn)
-            else:
-                # lower is better (price)
-                s1 = (mx - v1) / (mx - mn)
-                s2 = (mx - v2) / (mx - mn)
-        total1 += weight * s1
-        total2 += weight * s2
-        # decide winner for this spec
-        if abs(s1 - s2) < 1e-9:
-            winner = "tie"
-        elif s1 > s2:
-            winner = "left"
-        else:
-            winner = "right"
-        per_spec.append({
-            "spec": key,
-            "label": info.get("label", key),
-            "left_value": v1,
-            "right_value": v2,
-            "left_score": round(s1, 3),
-            "right_score": round(s2, 3),
-            "winner": winner
-        })
-
-    score1 = round(total1 * 100, 2)
-    score2 = round(total2 * 100, 2)
-
-    # generate textual explanation
-    reasons = []
-    for ps in per_spec:
-        if ps["winner"] == "left":
-            reasons.append(f"{p1['brand']} {p1['model']} has better {ps['label']} ({ps['left_value']} vs {ps['right_value']}).")
-        elif ps["winner"] == "right":
-            reasons.append(f"{p2['brand']} {p2['model']} has better {ps['label']} ({ps['right_value']} vs {ps['left_value']}).")
-
-    # pick recommendation
-    if score1 == score2:
-        recommended = None
-        summary = "Both phones score equally based on the selected specs and weights."
-    elif score1 > score2:
-        recommended = {"id": p1["id"], "brand": p1["brand"], "model": p1["model"], "score": score1}
-        summary = f"Recommendation: {p1['brand']} {p1['model']} (score {score1} vs {score2}) because: " + " ".join(reasons[:3])
-    else:
-        recommended = {"id": p2["id"], "brand": p2["brand"], "model": p2["model"], "score": score2}
-        summary = f"Recommendation: {p2['brand']} {p2['model']} (score {score2} vs {score1}) because: " + " ".join(reasons[:3])
-
-    return jsonify({
-        "status":"ok",
-        "left": p1,
-        "right": p2,
-        "per_spec": per_spec,
-        "score_left": score1,
-        "score_right": score2,
-        "recommended": recommended,
-        "summary": summary,
-        "explanations": reasons
-    })
+    try:
+        weights = parse_weights(raw_weights)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+
+    global COMPARE_VERSION
+    base_version = CATALOG.get().version
+    if COMPARE_VERSION != base_version:
+        COMPARE_CACHE.clear()
+        COMPARE_VERSION = base_version
+    a, b = sorted((id1, id2))
+    key = (catalog.version, a, b, tuple(weights.round(6)))
+    entry = COMPARE_CACHE.get(key)
+    if entry is None:
+        body = {"status":"ok", **catalog.engine.compare(catalog.by_id[a], catalog.by_id[b], weights)}
+        entry = {}
+        for side, data in (("ab", body), ("ba", swap_compare(body))):
+            raw = jsonify(data).get_data()
+            entry[side] = (raw, hashlib.sha1(raw).hexdigest())
+        COMPARE_CACHE.put(key, entry)
+    raw, etag = entry["ab" if id1 == a else "ba"]
+    resp = Response(raw, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@bp.route("/api/compare", methods=["GET"])
+def api_compare_get():
+    """
+    Cacheable form of POST /api/compare; answers If-None-Match with 304.
+    Query params:
+      - id1, id2: phone ids
+      - weights (optional): e.g. rating:3,price:2
+      - rating_source (optional): catalog | reviews (score live review averages)
+    """
+    resp = compare_response(request.args.get("id1"), request.args.get("id2"), request.args.get("weights"),
+                            request.args.get("rating_source"))
+    if isinstance(resp, Response):
+        resp.make_conditional(request)
+    return resp
+
+@bp.route("/api/compare", methods=["POST"])
+def api_compare():
+    data = request.get_json(silent=True) or {}
+    return compare_response(data.get("id1"), data.get("id2"), data.get("weights"), data.get("rating_source"))
+
+@bp.route("/api/compare/cache", methods=["GET"])
+def api_compare_cache():
+    """Hit/miss counters and size of the compare cache."""
+    return jsonify({"status":"ok", **COMPARE_CACHE.stats()})
+
+@bp.route("/api/rank", methods=["GET"])
+@cached_get(catalog_version)
+def api_rank():
+    """
+    Top-k phones for a set of preferences, scored against each other.
+    Query params:
+      - weights (optional): e.g. rating:3,price:2 (specs: rating, price, ram_gb,
+        storage_gb, battery_mah, camera_mp; unlisted specs get 0; default weights otherwise)
+      - k (optional): number of results (default 10)
+      - ids (optional): comma-separated phone ids to rank among
+      - q, brand, min_price, max_price, ram_min, storage_min (optional): candidate filters
+      - rating_source (optional): catalog | reviews (score live review averages)
+    """
+    try:
+        weights = parse_weights(request.args.get("weights"))
+        catalog = catalog_for(request.args.get("rating_source"))
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    k = max(1, min(request.args.get("k", 10, type=int), MAX_LIMIT))
+    positions = catalog.positions(
+        q=request.args.get("q"), brand=normalize(request.args.get("brand")),
+        min_price=request.args.get("min_price", type=int), max_price=request.args.get("max_price", type=int),
+        ram_min=request.args.get("ram_min", type=int), storage_min=request.args.get("storage_min", type=int),
+    )
+    ids = [x.strip() for x in (request.args.get("ids") or "").split(",") if x.strip()]
+    if ids:
+        wanted = {catalog.by_id[x] for x in ids if x in catalog.by_id}
+        positions = [i for i in positions if i in wanted]
+    ranked = catalog.engine.rank(positions, weights, k)
+    return jsonify({"status":"ok", "total": len(positions), **ranked})
+
+# Standalone server for this module; gateway.py mounts `bp` under /comparephone instead
+app = Flask(__name__, static_folder=None)
+app.register_blueprint(bp)
+instrument(app)
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5003, debug=True)
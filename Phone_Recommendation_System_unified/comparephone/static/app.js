@@ -5,7 +5,7 @@ const rightSelect = $("#rightSelect");
 let phones = [];
 
 async function loadPhones() {
-  const res = await fetch("/api/phones");
+  const res = await fetch("api/phones");
   const data = await res.json();
   phones = data.results;
   leftSelect.innerHTML = `<option value="">-- Select phone A --</option>` + phones.map(p=>`<option value="${p.id}">${p.brand} ${p.model}</option>`).join("");
@@ -42,7 +42,8 @@ function renderSpecsTable(per_spec, left, right) {
 }
 
 async function doCompare(id1, id2) {
-  const res = await fetch("/api/compare", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify({id1, id2}) });
+  // GET so the browser can revalidate repeat comparisons with If-None-Match
+  const res = await fetch(`api/compare?${new URLSearchParams({id1, id2})}`);
   const data = await res.json();
   if (data.status !== "ok") { alert("Compare failed: "+(data.message||"")); return; }
   // show compare card
@@ -0,0 +1,67 @@
+"""
+Single-process Smart Shop: all six modules mounted as blueprints in one app.
+
+    python gateway.py                                 dev server on http://127.0.0.1:8000/
+    gunicorn -c gunicorn.conf.py gateway:app          production (see gunicorn.conf.py)
+
+Each module is served under its own prefix (/phonefinder/, /reviews/, ...)
+and main/ is served at /, with request metrics at /metrics (see
+smartshop/metrics.py). The modules share one process, so phone data,
+indexes and record stores are loaded once (see JsonFileIndex.shared() and
+smartshop.storage.open_store()) instead of once per module server.
+"""
+from flask import Flask, jsonify, send_from_directory
+from werkzeug.serving import is_running_from_reloader
+from pathlib import Path
+import importlib, sys
+
+BASE_DIR = Path(__file__).resolve().parent
+MAIN_DIR = BASE_DIR / "main"
+sys.path.insert(0, str(BASE_DIR))
+
+from smartshop.metrics import instrument
+
+# module package -> standalone port (run_all.sh); the gateway mounts it at /<module>
+MODULES = {
+    "phonefinder": 5000,
+    "salesprediction": 5001,
+    "buyandsell": 5002,
+    "comparephone": 5003,
+    "upcomingphone": 5004,
+    "reviews": 5005,
+}
+
+
+def create_app(modules=None):
+    """App with the given modules (default: all of MODULES) mounted under /<module>."""
+    app = Flask(__name__, static_folder=None)
+    mounted = list(modules or MODULES)
+    for name in mounted:
+        bp = importlib.import_module(f"{name}.app").bp
+        app.register_blueprint(bp, url_prefix=f"/{name}")
+
+    instrument(app)
+
+    @app.route("/")
+    def home():
+        return send_from_directory(MAIN_DIR, "index.html")
+
+    @app.route("/modules.json")
+    def modules_json():
+        # main/script.js points the icons here instead of at the standalone ports
+        return jsonify({name: f"/{name}/" for name in mounted})
+
+    @app.route("/<path:filename>")
+    def main_static(filename):
+        return send_from_directory(MAIN_DIR, filename)
+
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    upcoming = sys.modules.get("upcomingphone.app")
+    if upcoming is not None and is_running_from_reloader():  # the serving child, not the debug reloader
+        upcoming.LAUNCHES.start()
+    app.run(host="127.0.0.1", port=8000, debug=True)
@@ -0,0 +1,56 @@
+# gunicorn -c gunicorn.conf.py gateway:app
+#
+#   SMARTSHOP_BIND     address to listen on (default 127.0.0.1:8000)
+#   SMARTSHOP_WORKERS  worker processes (default: number of CPUs)
+#   SMARTSHOP_THREADS  threads per worker (default 4)
+#   SMARTSHOP_METRICS_DIR  where workers leave their /metrics numbers (default: a
+#                      temporary directory, removed on shutdown)
+#   SMARTSHOP_JOBS     background job store (default sqlite with more than one worker)
+#
+# The app is imported once in the master (preload_app) and workers are
+# forked from it, so phone data and indexes are shared copy-on-write
+# (compiled catalog snapshots, see smartshop/columnar.py, are shared as
+# read-only mapped pages, which stay shared however they are used).
+# Record stores stay consistent across workers through their append log
+# and file locks (JSON backend) or SQLite WAL (SMARTSHOP_STORAGE=sqlite).
+import multiprocessing, os, shutil, sys, tempfile
+
+bind = os.environ.get("SMARTSHOP_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("SMARTSHOP_WORKERS") or multiprocessing.cpu_count())
+threads = int(os.environ.get("SMARTSHOP_THREADS") or 4)
+worker_class = "gthread"
+preload_app = True
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+# A forecast job's status poll can land on any worker, so jobs must live in SQLite, not
+# in one worker's memory (see smartshop/jobs.py); set before the app is preloaded
+if workers > 1:
+    os.environ.setdefault("SMARTSHOP_JOBS", "sqlite")
+
+# Each worker writes its counters here so /metrics on any worker reports all of them
+# (see smartshop/metrics.py); set before the app is preloaded, which reads it
+_own_metrics_dir = not os.environ.get("SMARTSHOP_METRICS_DIR")
+if _own_metrics_dir:
+    os.environ["SMARTSHOP_METRICS_DIR"] = tempfile.mkdtemp(prefix="smartshop-metrics-")
+
+
+def on_starting(server):
+    # numbers left by the workers of a previous run are not ours
+    folder = os.environ["SMARTSHOP_METRICS_DIR"]
+    os.makedirs(folder, exist_ok=True)
+    for name in os.listdir(folder):
+        if name.endswith(".json"):
+            os.remove(os.path.join(folder, name))
+
+
+def post_fork(server, worker):
+    # the launch scheduler runs in the workers, never in the master that preloaded the app
+    # (a thread there would hold store locks across forks and run for the server's lifetime)
+    upcoming = sys.modules.get("upcomingphone.app")
+    if upcoming is not None:
+        upcoming.LAUNCHES.start()
+
+
+def on_exit(server):
+    if _own_metrics_dir:
+        shutil.rmtree(os.environ["SMARTSHOP_METRICS_DIR"], ignore_errors=True)
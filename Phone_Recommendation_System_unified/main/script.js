@@ -12,3 +12,17 @@ document.querySelectorAll(".icon-box").forEach(icon => {
         window.open(url, "_blank");
     });
 });
+
+// When served by gateway.py every module lives on this server under /<module>/;
+// modules.json lists them. Opened as a plain file, the data-url ports are kept.
+if (location.protocol.startsWith("http")) {
+    fetch("modules.json")
+        .then(res => res.ok ? res.json() : {})
+        .then(modules => {
+            document.querySelectorAll(".icon-box[data-module]").forEach(icon => {
+                const url = modules[icon.getAttribute("data-module")];
+                if (url) icon.setAttribute("data-url", url);
+            });
+        })
+        .catch(() => {});
+}
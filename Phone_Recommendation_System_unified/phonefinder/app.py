@@ -1,44 +1,74 @@
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Blueprint, Flask, jsonify, request, send_from_directory
 from pathlib import Path
-import json
+import sys
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
-
-app = Flask(__name__, static_folder=str(STATIC_DIR), static_url_path="")
-
-def load_json(filename):
-    with open(STATIC_DIR / filename, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def normalize(s):
-    return (s or "").strip().lower()
-
-@app.route("/")
+sys.path.insert(0, str(BASE_DIR.parent))  # shared helpers live in ../smartshop
+
+from smartshop.catalog import PhoneCatalog
+from smartshop.geo import PincodeTable, parse_latlon
+from smartshop.httpcache import cached_get
+from smartshop.metrics import instrument
+from smartshop.paging import page_args, paginate, project
+from smartshop.ratings import LiveRatings, rating_source
+from smartshop.shops import ShopIndex
+from smartshop.storage import open_store
+from smartshop.text import normalize, tokenize
+
+bp = Blueprint("phonefinder", __name__, static_folder=str(STATIC_DIR), static_url_path="")
+
+# Parsed and indexed once; re-read only when phones.json changes on disk
+CATALOG = PhoneCatalog.shared(STATIC_DIR / "phones.json")
+CATALOG.get()
+# The same catalog rated by live review averages (rating_source=reviews, see smartshop/ratings.py),
+# from the store the reviews module writes to (shared with it when both are mounted in gateway.py)
+LIVE = LiveRatings(CATALOG, open_store("reviews", BASE_DIR.parent / "reviews" / "data" / "reviews.json"))
+SHOPS = ShopIndex.shared(STATIC_DIR / "shops.json")
+SHOPS.get()
+# Offline pincode -> centroid table for `pincode=` searches and shops without lat/lon
+PINCODES = PincodeTable.shared(STATIC_DIR / "pincodes.json")
+
+# Distance search defaults / cap (km)
+DEFAULT_RADIUS_KM = 25
+MAX_RADIUS_KM = 2000
+
+@bp.route("/")
 def home():
     # Serve the Phone Finder page
-    return app.send_static_file("index.html")
+    return bp.send_static_file("index.html")
 
-@app.route("/shops.html")
+@bp.route("/shops.html")
 def shops_page():
     # Serve the Shop Locator page
-    return app.send_static_file("shops.html")
+    return bp.send_static_file("shops.html")
 
-@app.route("/api/phones", methods=["GET"])
+def catalog_version():
+    source = rating_source(request.args.get("rating_source"))
+    return LIVE.get().version if source == "reviews" else CATALOG.get().version
+
+@bp.route("/api/phones", methods=["GET"])
+@cached_get(catalog_version)
 def api_phones():
     """
     Query params supported:
-      - q: search text (brand or model contains)
+      - q: search text (word prefixes in brand/model; ranked by relevance unless sort is given)
       - brand: exact brand match (case-insensitive)
       - min_price, max_price: integers
       - ram_min: integer (GB)
       - storage_min: integer (GB)
       - sort: price_asc | price_desc | rating_desc
       - model_id: exact id to fetch a single phone
+      - rating_source: catalog (phones.json ratings) | reviews (live review averages);
+        default SMARTSHOP_RATING_SOURCE, else catalog
+      - limit, cursor, fields: pagination / projection (see smartshop/paging.py)
     """
-    phones = load_json("phones.json")
-
+    try:
+        page = page_args(request.args)
+        source = rating_source(request.args.get("rating_source"))
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
     q = normalize(request.args.get("q"))
     brand = normalize(request.args.get("brand"))
     model_id = request.args.get("model_id")
@@ -48,35 +78,21 @@ def api_phones():
     storage_min = request.args.get("storage_min", type=int)
     sort = request.args.get("sort")
 
-    def matches(p):
-        if model_id and p.get("id") != model_id:
-            return False
-        if brand and normalize(p.get("brand")) != brand:
-            return False
-        if q and (q not in normalize(p.get("brand")) and q not in normalize(p.get("model"))):
-            return False
-        if min_price is not None and p.get("price", 0) < min_price:
-            return False
-        if max_price is not None and p.get("price", 0) > max_price:
-            return False
-        if ram_min is not None and p.get("ram_gb", 0) < ram_min:
-            return False
-        if storage_min is not None and p.get("storage_gb", 0) < storage_min:
-            return False
-        return True
-
-    results = [p for p in phones if matches(p)]
-
-    if sort == "price_asc":
-        results.sort(key=lambda x: x.get("price", 0))
-    elif sort == "price_desc":
-        results.sort(key=lambda x: x.get("price", 0), reverse=True)
-    elif sort == "rating_desc":
-        results.sort(key=lambda x: x.get("rating", 0), reverse=True)
-
-    return jsonify({"total": len(results), "results": results})
-
-@app.route("/api/shops", methods=["GET"])
+    catalog = LIVE.get() if source == "reviews" else CATALOG.get()
+    results = catalog.query(
+        q=q, brand=brand, model_id=model_id,
+        min_price=min_price, max_price=max_price,
+        ram_min=ram_min, storage_min=storage_min, sort=sort,
+    )
+    try:
+        rows, next_cursor = paginate(results, page, key=catalog.sort_key(sort, ranked=bool(tokenize(q))))
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"invalid cursor"}), 400
+
+    return jsonify({"total": len(results), "results": project(rows, page.fields), "next_cursor": next_cursor})
+
+@bp.route("/api/shops", methods=["GET"])
+@cached_get(lambda: (SHOPS.version(), PINCODES.version()))
 def api_shops():
     """
     Query params:
@@ -84,27 +100,45 @@ def api_shops():
       - state: string
       - model_id (optional): filter shops that have this phone in inventory
       - brand (optional): fallback filter by brand support if model not provided
+      - near (optional): lat,lon to search around, nearest first (adds distance_km)
+      - pincode (optional): search around this pincode's centroid instead of `near`
+      - radius_km (optional): search radius for near/pincode (default 25)
+      - limit (optional): at most this many shops for near/pincode
     """
-    shops = load_json("shops.json")
     city = normalize(request.args.get("city"))
     state = normalize(request.args.get("state"))
     model_id = request.args.get("model_id")
     brand = normalize(request.args.get("brand"))
-
-    def matches(shop):
-        if city and normalize(shop.get("city")) != city:
-            return False
-        if state and normalize(shop.get("state")) != state:
-            return False
-        if model_id:
-            inv = set(shop.get("inventory", []))
-            return model_id in inv
-        if brand:
-            return brand in [normalize(b) for b in shop.get("phone_brands", [])]
-        return True
-
-    results = [s for s in shops if matches(s)]
-    return jsonify({"total": len(results), "results": results})
+    near = request.args.get("near")
+    pincode = (request.args.get("pincode") or "").strip()
+
+    shops = SHOPS.get()
+    if not near and not pincode:
+        results = shops.query(city=city, state=state, model_id=model_id, brand=brand)
+        return jsonify({"total": len(results), "results": results})
+
+    pincodes = PINCODES.get()
+    try:
+        if near:
+            lat, lon = parse_latlon(near)
+        elif pincode in pincodes:
+            lat, lon = pincodes[pincode]
+        else:
+            raise ValueError(f"unknown pincode: {pincode}")
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    radius_km = request.args.get("radius_km", DEFAULT_RADIUS_KM, type=float)
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        return jsonify({"status":"error","message":f"radius_km must be between 0 and {MAX_RADIUS_KM}"}), 400
+    limit = request.args.get("limit", type=int)
+    results = shops.near(lat, lon, radius_km, pincodes, city=city, state=state, model_id=model_id, brand=brand,
+                         limit=max(1, limit) if limit is not None else None)
+    return jsonify({"total": len(results), "results": results, "center": {"lat": lat, "lon": lon}, "radius_km": radius_km})
+
+# Standalone server for this module; gateway.py mounts `bp` under /phonefinder instead
+app = Flask(__name__, static_folder=None)
+app.register_blueprint(bp)
+instrument(app)
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5000, debug=True)
@@ -3,10 +3,23 @@
 const $ = (sel) => document.querySelector(sel);
 const $all = (sel) => Array.from(document.querySelectorAll(sel));
 const fmtINR = (n) => new Intl.NumberFormat("en-IN", { style: "currency", currency: "INR", maximumFractionDigits: 0 }).format(n);
+const PAGE_SIZE = 24;
+
+/* "Load more" button placed after a results container; calls onClick(cursor) */
+function loadMoreButton(afterEl, onClick) {
+  const btn = document.createElement("button");
+  btn.type = "button";
+  btn.className = "btn";
+  btn.textContent = "Load more";
+  btn.style.display = "none";
+  afterEl.after(btn);
+  btn.addEventListener("click", () => onClick(btn.dataset.cursor));
+  return btn;
+}
 
 /* ====== Phone Finder page logic ====== */
 async function fetchPhones(params = {}) {
-  const url = new URL(location.origin + "/api/phones");
+  const url = new URL("api/phones", location.href);
   Object.entries(params).forEach(([k, v]) => {
     if (v !== undefined && v !== null && String(v).trim() !== "") url.searchParams.set(k, v);
   });
@@ -37,7 +50,7 @@ function phoneCard(p) {
   div.querySelector(".buy-btn").addEventListener("click", () => {
     const id = p.id;
     const brand = encodeURIComponent(p.brand);
-    window.location.href = `/shops.html?model_id=${encodeURIComponent(id)}&brand=${brand}`;
+    window.location.href = `shops.html?model_id=${encodeURIComponent(id)}&brand=${brand}`;
   });
 
   return div;
@@ -49,9 +62,9 @@ async function initFinder() {
   const resultsEl = document.getElementById("results");
   const countEl = document.getElementById("resultsCount");
 
-  // Load initial to populate brands
-  const initial = await fetchPhones();
-  const brands = Array.from(new Set(initial.results.map(p => p.brand))).sort();
+  // Brands only need one field of every phone
+  const brandData = await fetchPhones({ fields: "brand" });
+  const brands = Array.from(new Set(brandData.results.map(p => p.brand))).sort();
   brands.forEach(b => {
     const opt = document.createElement("option");
     opt.value = b;
@@ -59,13 +72,19 @@ async function initFinder() {
     brandSelect.appendChild(opt);
   });
 
-  const render = (data) => {
-    resultsEl.innerHTML = "";
+  let lastParams = {};
+  const render = (data, append = false) => {
+    if (!append) resultsEl.innerHTML = "";
     data.results.forEach(p => resultsEl.appendChild(phoneCard(p)));
     countEl.textContent = `${data.total} phone(s) found`;
+    moreBtn.dataset.cursor = data.next_cursor || "";
+    moreBtn.style.display = data.next_cursor ? "" : "none";
   };
+  const moreBtn = loadMoreButton(resultsEl, async (cursor) => {
+    render(await fetchPhones({ ...lastParams, limit: PAGE_SIZE, cursor }), true);
+  });
 
-  render(initial);
+  render(await fetchPhones({ limit: PAGE_SIZE }));
 
   document.getElementById("filterForm").addEventListener("submit", async (e) => {
     e.preventDefault();
@@ -78,7 +97,8 @@ async function initFinder() {
       storage_min: document.getElementById("storage_min").value,
       sort: document.getElementById("sort").value
     };
-    const data = await fetchPhones(params);
+    lastParams = params;
+    const data = await fetchPhones({ ...params, limit: PAGE_SIZE });
     render(data);
   });
 
@@ -87,7 +107,8 @@ async function initFinder() {
       const el = document.getElementById(id);
       if (el.tagName === "SELECT") el.selectedIndex = 0; else el.value = "";
     });
-    const data = await fetchPhones();
+    lastParams = {};
+    const data = await fetchPhones({ limit: PAGE_SIZE });
     render(data);
   });
 }
@@ -123,7 +144,7 @@ async function initShops() {
       const div = document.createElement("div");
       div.className = "shop-item";
       div.innerHTML = `
-        <strong>${s.name}</strong><br/>
+        <strong>${s.name}</strong>${s.distance_km != null ? ` — ${s.distance_km} km away` : ""}<br/>
         ${s.address}, ${s.city}, ${s.state} - ${s.pincode}<br/>
         Brands: ${s.phone_brands.join(", ")}<br/>
         Phone: ${s.phone}<br/>
@@ -134,17 +155,36 @@ async function initShops() {
     countEl.textContent = `${data.total} shop(s) found`;
   };
 
-  document.getElementById("shopForm").addEventListener("submit", async (e) => {
-    e.preventDefault();
+  const searchShops = async (near) => {
     const city = document.getElementById("city").value;
     const state = document.getElementById("state").value;
-    const url = new URL(location.origin + "/api/shops");
-    if (city) url.searchParams.set("city", city);
-    if (state) url.searchParams.set("state", state);
+    const pincode = document.getElementById("pincode").value.trim();
+    const url = new URL("api/shops", location.href);
+    if (near) url.searchParams.set("near", near);
+    else if (pincode) url.searchParams.set("pincode", pincode);
+    if (near || pincode) url.searchParams.set("radius_km", document.getElementById("radius").value || 25);
+    else {
+      if (city) url.searchParams.set("city", city);
+      if (state) url.searchParams.set("state", state);
+    }
     if (modelId) url.searchParams.set("model_id", modelId); else if (brand) url.searchParams.set("brand", brand);
     const res = await fetch(url);
     const data = await res.json();
+    if (data.status === "error") { alert(data.message); return; }
     renderShops(data);
+  };
+
+  document.getElementById("shopForm").addEventListener("submit", async (e) => {
+    e.preventDefault();
+    searchShops();
+  });
+
+  document.getElementById("nearMe").addEventListener("click", () => {
+    if (!navigator.geolocation) { alert("Location is not available in this browser."); return; }
+    navigator.geolocation.getCurrentPosition(
+      pos => searchShops(`${pos.coords.latitude},${pos.coords.longitude}`),
+      () => alert("Could not get your location. Try a pincode instead.")
+    );
   });
 }
 
@@ -1,30 +1,46 @@
 
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, request, jsonify
 from pathlib import Path
-import json, datetime, time
+import datetime, sys
 
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "data"
 REV_FILE = DATA_DIR / "reviews.json"
+sys.path.insert(0, str(BASE_DIR.parent))  # shared helpers live in ../smartshop
 
-app = Flask(__name__, static_folder=str(BASE_DIR / "static"), static_url_path="")
+from smartshop.httpcache import cached_get
+from smartshop.ids import new_id
+from smartshop.metrics import instrument
+from smartshop.paging import find_page, page_args, project
+from smartshop.ratings import SCOPES, count_sum, lookup, rating_stats, summary
+from smartshop.storage import open_store
+from smartshop.text import normalize
+
+bp = Blueprint("reviews", __name__, static_folder=str(BASE_DIR / "static"), static_url_path="")
+
+# JSON snapshot + append log by default, SQLite with SMARTSHOP_STORAGE=sqlite (see smartshop/storage.py)
+STORE = open_store("reviews", REV_FILE)
+# Rating count/sum/histogram per model, city and (model, city), kept current on every write
+STATS = rating_stats(STORE)
 
 def read_reviews():
-    try:
-        with open(REV_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+    return STORE.all()
+
+def add_review(entry):
+    return STORE.insert(entry)
+
+def update_review(rid, fields):
+    return STORE.update(rid, fields)
 
-def write_reviews(lst):
-    with open(REV_FILE, "w", encoding="utf-8") as f:
-        json.dump(lst, f, ensure_ascii=False, indent=2)
+def update_reviews(rids, fields):
+    return STORE.update_many(rids, fields)
 
-@app.route("/")
+@bp.route("/")
 def index():
-    return app.send_static_file("index.html")
+    return bp.send_static_file("index.html")
 
-@app.route("/api/reviews", methods=["GET"])
+@bp.route("/api/reviews", methods=["GET"])
+@cached_get(lambda: STORE.version())
 def api_get_reviews():
     """
     Query params:
@@ -32,41 +48,71 @@ def api_get_reviews():
       - model: filter by phone model
       - min_rating: integer 1-5
       - city: filter by city
-      - sort: newest | highest (default newest)
+      - sort: newest | highest | relevance (default: relevance when q is given, else newest)
+      - include_hidden: 1 to include reviews hidden by moderation (default: visible only)
+      - limit, cursor, fields: pagination / projection (see smartshop/paging.py)
     """
+    try:
+        page = page_args(request.args)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
     q = (request.args.get("q") or "").strip().lower()
     model = (request.args.get("model") or "").strip().lower()
     city = (request.args.get("city") or "").strip().lower()
     min_rating = request.args.get("min_rating", type=int)
-    sort = (request.args.get("sort") or "newest").strip().lower()
-
-    reviews = read_reviews()
-    def matches(r):
-        if model and r.get("model","").strip().lower() != model:
-            return False
-        if city and r.get("city","").strip().lower() != city:
-            return False
-        if min_rating and int(r.get("rating",0)) < min_rating:
-            return False
-        if q:
-            txt = " ".join([str(r.get(k,"")).lower() for k in ("title","body","reviewer_name","model")])
-            if q not in txt:
-                return False
-        return True
-
-    filtered = [r for r in reviews if matches(r)]
-    if sort == "highest":
-        filtered.sort(key=lambda x: int(x.get("rating",0)), reverse=True)
-    else:
-        filtered.sort(key=lambda x: x.get("created_at"), reverse=True)
+    sort = (request.args.get("sort") or ("relevance" if q else "newest")).strip().lower()
+    include_hidden = request.args.get("include_hidden", "").strip().lower() in ("1", "true", "yes")
+
+    eq = {"model": model, "city": city}
+    if not include_hidden:
+        eq["visible"] = 1
+    query = {"eq": eq, "ge": {"rating": min_rating}, "text": q}
+    order_by = {"highest": "rating", "relevance": None}.get(sort, "created_at")
+    try:
+        rows, next_cursor = find_page(STORE, page, order_by=order_by, desc=True, **query)
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"invalid cursor"}), 400
 
     # compute average rating for convenience
-    avg = None
-    if filtered:
-        avg = sum(int(r.get("rating",0)) for r in filtered) / len(filtered)
-    return jsonify({"total": len(filtered), "avg_rating": round(avg,2) if avg is not None else None, "results": filtered})
+    if page.limit is None:
+        total, rating_sum = len(rows), sum(int(r.get("rating",0)) for r in rows)
+    elif not q and not include_hidden:
+        # visible reviews by model/city/rating: read off the maintained aggregates
+        scope = "model_city" if model and city else "model" if model else "city" if city else "all"
+        total, rating_sum = count_sum(STATS.cell(scope, model, city), min_rating)
+    else:
+        total, rating_sum = STORE.stats(col="rating", **query)
+    avg = rating_sum / total if total else None
+    return jsonify({"total": total, "avg_rating": round(avg,2) if avg is not None else None,
+                    "results": project(rows, page.fields), "next_cursor": next_cursor})
+
+@bp.route("/api/reviews/stats", methods=["GET"])
+@cached_get(lambda: STORE.version())
+def api_review_stats():
+    """
+    Rating aggregates over visible reviews, without scanning them.
+    Query params:
+      - model, city (optional): the aggregate for that model, city or (model, city)
+      - group_by (optional): model | city | model_city to list every group instead
+    Models and cities are matched (and listed) lowercased.
+    """
+    group_by = normalize(request.args.get("group_by"))
+    if group_by:
+        if group_by not in SCOPES[1:]:
+            return jsonify({"status":"error","message":"group_by must be model, city or model_city"}), 400
+        groups = sorted(STATS.group(group_by).items(), key=lambda kv: (-kv[1][0], kv[0]))
+        results = []
+        for (m, c), cell in groups:
+            row = {"model": m} if group_by != "city" else {}
+            if group_by != "model":
+                row["city"] = c
+            results.append({**row, **summary(cell)})
+        return jsonify({"status":"ok","group_by":group_by,"results":results})
+    model = normalize(request.args.get("model"))
+    city = normalize(request.args.get("city"))
+    return jsonify({"status":"ok","model":model or None,"city":city or None,**lookup(STATS, model, city)})
 
-@app.route("/api/reviews", methods=["POST"])
+@bp.route("/api/reviews", methods=["POST"])
 def api_post_review():
     """
     Accepts JSON or form data:
@@ -88,8 +134,7 @@ def api_post_review():
     if not body:
         return jsonify({"status":"error","message":"body is required"}), 400
 
-    reviews = read_reviews()
-    rid = f"R{int(time.time()*1000)}"
+    rid = new_id("R")
     entry = {
         "id": rid,
         "reviewer_name": (data.get("reviewer_name") or "").strip(),
@@ -101,27 +146,45 @@ def api_post_review():
         "created_at": datetime.datetime.utcnow().isoformat() + "Z",
         "visible": True
     }
-    reviews.append(entry)
-    write_reviews(reviews)
+    add_review(entry)
     return jsonify({"status":"ok","review":entry})
 
-@app.route("/api/reviews/<rid>/hide", methods=["POST"])
+@bp.route("/api/reviews/<rid>/hide", methods=["POST"])
 def api_hide_review(rid):
     """
     Simple moderation endpoint to hide a review (no auth in starter).
     POSTing marks visible=False.
     """
-    reviews = read_reviews()
-    found = False
-    for r in reviews:
-        if r.get("id") == rid:
-            r["visible"] = False
-            found = True
-            break
-    if not found:
+    if update_review(rid, {"visible": False}) is None:
         return jsonify({"status":"error","message":"not found"}), 404
-    write_reviews(reviews)
     return jsonify({"status":"ok"})
 
+def moderate(visible):
+    """Set `visible` on every id in the request (JSON {"ids": [...]} or form ids=a,b) with one write."""
+    data = request.get_json(silent=True)
+    ids = data.get("ids") if isinstance(data, dict) else request.form.get("ids", "").split(",")
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        return jsonify({"status":"error","message":"ids must be a list of review ids"}), 400
+    ids = [i.strip() for i in ids if i.strip()]
+    if not ids:
+        return jsonify({"status":"error","message":"provide ids"}), 400
+    updated = {r["id"] for r in update_reviews(ids, {"visible": visible})}
+    return jsonify({"status":"ok","updated":len(updated),"not_found":[i for i in ids if i not in updated]})
+
+@bp.route("/api/reviews/hide", methods=["POST"])
+def api_hide_reviews():
+    """Hide many reviews at once: JSON {"ids": ["R1001", ...]} or form ids=R1001,R1002."""
+    return moderate(False)
+
+@bp.route("/api/reviews/unhide", methods=["POST"])
+def api_unhide_reviews():
+    """Make many hidden reviews visible again; same body as /api/reviews/hide."""
+    return moderate(True)
+
+# Standalone server for this module; gateway.py mounts `bp` under /reviews instead
+app = Flask(__name__, static_folder=None)
+app.register_blueprint(bp)
+instrument(app)
+
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5005, debug=True)
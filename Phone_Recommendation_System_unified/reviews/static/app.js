@@ -1,8 +1,11 @@
 
 const $ = s => document.querySelector(s);
+const PAGE_SIZE = 20;
+let nextCursor = null;
+let lastParams = {};
 
 async function fetchReviews(params={}){
-  const url = new URL(location.origin + "/api/reviews");
+  const url = new URL("api/reviews", location.href);
   Object.entries(params).forEach(([k,v])=>{ if (v !== undefined && v !== null && String(v).trim() !== "") url.searchParams.set(k, v); });
   const res = await fetch(url);
   return res.json();
@@ -34,14 +37,38 @@ function reviewCard(r){
 }
 
 async function renderReviews(params={}){
-  const data = await fetchReviews(params);
+  lastParams = params;
+  const data = await fetchReviews({ ...params, limit: PAGE_SIZE });
   $("#reviewsWrap").innerHTML = "";
   $("#stats").textContent = data.total ? `(${data.total} reviews • avg ${data.avg_rating || "-"})` : "(no reviews yet)";
   if (data.total === 0) {
     $("#reviewsWrap").innerHTML = `<div class="muted">No reviews yet — be the first to write one!</div>`;
+    setNextCursor(null);
     return;
   }
   data.results.forEach(r => $("#reviewsWrap").appendChild(reviewCard(r)));
+  setNextCursor(data.next_cursor);
+}
+
+async function loadMoreReviews(){
+  const data = await fetchReviews({ ...lastParams, limit: PAGE_SIZE, cursor: nextCursor });
+  data.results.forEach(r => $("#reviewsWrap").appendChild(reviewCard(r)));
+  setNextCursor(data.next_cursor);
+}
+
+function setNextCursor(cursor){
+  nextCursor = cursor;
+  let btn = $("#loadMore");
+  if (!btn) {
+    btn = document.createElement("button");
+    btn.id = "loadMore";
+    btn.type = "button";
+    btn.className = "btn";
+    btn.textContent = "Load more";
+    btn.addEventListener("click", loadMoreReviews);
+    $("#reviewsWrap").after(btn);
+  }
+  btn.style.display = cursor ? "" : "none";
 }
 
 document.addEventListener("DOMContentLoaded", ()=>{
@@ -54,7 +81,7 @@ document.addEventListener("DOMContentLoaded", ()=>{
     for (const [k,v] of form.entries()) payload[k]=v;
     if (!payload.rating) return alert("Please choose a rating 1-5.");
     if (!payload.body || payload.body.trim().length < 5) return alert("Please write a short review (min 5 characters).");
-    const res = await fetch("/api/reviews", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify(payload) });
+    const res = await fetch("api/reviews", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify(payload) });
     const data = await res.json();
     if (data.status === "ok") {
       alert("Thanks! Your review was posted.");
@@ -1,5 +1,7 @@
 
 @echo off
+echo Compiling phone catalog snapshots...
+cd /d %~dp0 && python -m smartshop.columnar
 echo Starting modules...
 start cmd /k "cd /d %~dp0\phonefinder && python app.py"
 start cmd /k "cd /d %~dp0\salesprediction && python app.py"
@@ -1,5 +1,7 @@
 #!/bin/bash
 # Start all module Flask apps in background. Run from project root (Phone Recommendation System).
+echo "Compiling phone catalog snapshots..."
+python -m smartshop.columnar
 echo "Starting modules..."
 (cd phonefinder && python app.py) &
 (cd salesprediction && python app.py) &
@@ -1,29 +1,92 @@
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, send_from_directory, url_for
 from pathlib import Path
-import io, csv, math
+import io, csv, hashlib, json, math, os, sys, tempfile, threading, time
 import pandas as pd
 import numpy as np
 from datetime import timedelta
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
+SAMPLE_FILE = STATIC_DIR / "sample_sales.csv"
+sys.path.insert(0, str(BASE_DIR.parent))  # shared helpers live in ../smartshop
 
-app = Flask(__name__, static_folder=str(STATIC_DIR), static_url_path="")
+from smartshop import forecast, models
+from smartshop.forecast import model_block
+from smartshop.jobs import QueueFull, open_jobs
+from smartshop.filecache import file_stamp
+from smartshop.lru import LRUCache
+from smartshop.metrics import instrument, register_cache, timed
 
-def load_csv_df(file_like):
-    df = pd.read_csv(file_like)
-    # Expect columns date,sales (case-insensitive)
-    cols = {c.lower(): c for c in df.columns}
+bp = Blueprint("salesprediction", __name__, static_folder=str(STATIC_DIR), static_url_path="")
+
+# Parsed CSVs, resampled series + trend fits and finished responses, keyed by
+# the CSV's content hash; bounded by SMARTSHOP_FORECAST_CACHE_MB (default 64)
+FORECAST_CACHE = LRUCache(maxsize=4096, maxbytes=int(float(os.environ.get("SMARTSHOP_FORECAST_CACHE_MB") or 64) * 2**20))
+register_cache("forecast", FORECAST_CACHE)
+_sample = {"stamp": False, "digest": None}
+_sample_lock = threading.Lock()
+
+# Rows per pd.read_csv chunk when ingesting uploads (SMARTSHOP_CSV_CHUNK_ROWS)
+CHUNK_ROWS = int(os.environ.get("SMARTSHOP_CSV_CHUNK_ROWS") or 200_000)
+
+# Background forecasts for `async` requests (see smartshop/jobs.py for the SMARTSHOP_JOB* settings)
+JOBS = open_jobs(BASE_DIR / "jobs")
+
+@timed("forecast.ingest_csv")
+def ingest_csv(file_like, chunksize=CHUNK_ROWS, progress=None):
+    """
+    Stream a date,sales CSV (columns case-insensitive) in chunks and fold
+    each chunk into per-day sales totals, so memory grows with the number
+    of days covered rather than the number of rows. Rows whose date or
+    sales fail to parse are dropped. Returns (df, stats): df has one row
+    per day with sales (date, sales), sorted; stats counts rows read and
+    dropped and the ingest rate. Needs a seekable file. progress(fraction,
+    message), if given, is called after each chunk.
+    """
+    started = time.perf_counter()
+    size = file_like.seek(0, 2)
+    file_like.seek(0)
+    header = pd.read_csv(file_like, nrows=0).columns
+    cols = {c.lower(): c for c in header}
     if "date" not in cols or "sales" not in cols:
         raise ValueError("CSV must have columns: date,sales")
-    df = df.rename(columns={cols["date"]:"date", cols["sales"]:"sales"})
-    # Parse dates and coerce sales to numeric
-    df["date"] = pd.to_datetime(df["date"], errors="coerce")
-    df["sales"] = pd.to_numeric(df["sales"], errors="coerce")
-    df = df.dropna(subset=["date", "sales"]).sort_values("date")
-    return df
+    file_like.seek(0)
+    date_col, sales_col = cols["date"], cols["sales"]
+    totals = None
+    rows = dropped = 0
+    # Dates stay strings until to_datetime; sales use the C parser's numeric
+    # fast path and only chunks with junk in them come back as objects
+    reader = pd.read_csv(file_like, usecols=[date_col, sales_col], chunksize=chunksize,
+                         dtype={date_col: str})
+    for chunk in reader:
+        # Parse dates and coerce sales to numeric
+        dates = pd.to_datetime(chunk[date_col], errors="coerce")
+        sales = pd.to_numeric(chunk[sales_col], errors="coerce")
+        ok = dates.notna() & sales.notna()
+        rows += len(chunk)
+        dropped += int((~ok).sum())
+        part = sales[ok].groupby(dates[ok].dt.floor("D")).sum()
+        totals = part if totals is None else totals.add(part, fill_value=0)
+        if progress:
+            progress(file_like.tell() / size if size else None, f"parsed {rows:,} rows")
+    if totals is None:
+        totals = pd.Series([], dtype=float, index=pd.DatetimeIndex([]))
+    df = pd.DataFrame({"date": totals.index, "sales": totals.values}).sort_values("date")
+    elapsed = time.perf_counter() - started
+    stats = {
+        "rows": rows,
+        "rows_dropped": dropped,
+        "days": int(len(df)),
+        "seconds": round(elapsed, 4),
+        "rows_per_sec": int(rows / elapsed) if elapsed > 0 else None,
+    }
+    return df, stats
+
+def load_csv_df(file_like):
+    return ingest_csv(file_like)[0]
 
+@timed("forecast.resample")
 def resample_series(df, freq):
     s = df.set_index("date")["sales"].sort_index()
     if freq == "D":
@@ -35,10 +98,10 @@ def resample_series(df, freq):
     # default daily
     return s.resample("D").sum().fillna(0)
 
-def simple_forecast(series: pd.Series, n_periods: int):
+@timed("forecast.fit_trend")
+def fit_trend(series: pd.Series):
     """
-    Linear trend + Gaussian noise interval.
-    y = a*t + b, intervals = +/- 1.96*std(residuals)
+    Linear trend fit y = a*t + b plus the residual spread used for intervals.
     """
     y = series.values.astype(float)
     t = np.arange(len(y))
@@ -57,8 +120,21 @@ def simple_forecast(series: pd.Series, n_periods: int):
     sse = float(np.sum((residuals)**2)) if len(y) > 1 else 0.0
     r2 = float(1.0 - sse / sst) if sst > 0 else 0.0
 
+    return {"a": float(a), "b": float(b), "sigma": sigma, "r2": r2, "n": len(y),
+            "train_fitted": yhat_train.tolist()}
+
+@timed("forecast.simple_forecast")
+def simple_forecast(series: pd.Series, n_periods: int, fit=None):
+    """
+    Linear trend + Gaussian noise interval.
+    y = a*t + b, intervals = +/- 1.96*std(residuals)
+    `fit` is a fit_trend() result for `series`, if already computed.
+    """
+    fit = fit or fit_trend(series)
+    a, b, sigma = fit["a"], fit["b"], fit["sigma"]
+
     # Forecast
-    t_future = np.arange(len(y), len(y) + n_periods)
+    t_future = np.arange(fit["n"], fit["n"] + n_periods)
     yhat_future = a * t_future + b
     lower = yhat_future - 1.96 * sigma
     upper = yhat_future + 1.96 * sigma
@@ -70,8 +146,8 @@ def simple_forecast(series: pd.Series, n_periods: int):
         "a": float(a),
         "b": float(b),
         "sigma": sigma,
-        "r2": r2,
-        "train_fitted": yhat_train.tolist(),
+        "r2": fit["r2"],
+        "train_fitted": fit["train_fitted"],
         "future_mean": yhat_future.tolist(),
         "future_lower": lower.tolist(),
         "future_upper": upper.tolist(),
@@ -86,58 +162,75 @@ def smooth(series: pd.Series, freq: str):
         return series.rolling(3, min_periods=1).mean()
     return series
 
-@app.route("/")
-def index():
-    return app.send_static_file("index.html")
+def file_digest(f, block=1 << 20):
+    """SHA-256 of a seekable file, read in blocks; leaves it rewound."""
+    h = hashlib.sha256()
+    for chunk in iter(lambda: f.read(block), b""):
+        h.update(chunk)
+    f.seek(0)
+    return h.hexdigest()
 
-@app.route("/api/sample-csv")
-def sample_csv():
-    # Let the user download the sample
-    return send_from_directory(STATIC_DIR, "sample_sales.csv", as_attachment=True)
+def sample_digest():
+    """Content hash of the sample CSV, recomputed only when the file changes."""
+    stamp = file_stamp(SAMPLE_FILE)
+    with _sample_lock:
+        if stamp != _sample["stamp"]:
+            with open(SAMPLE_FILE, "rb") as f:
+                _sample["digest"] = file_digest(f)
+            _sample["stamp"] = stamp
+        return _sample["digest"]
 
-@app.route("/api/predict", methods=["POST"])
-def api_predict():
-    """
-    Accepts multipart/form-data:
-      - file: CSV with columns date,sales
-      - freq: D | W | M
-      - n_periods: int (default based on freq)
-    OR JSON body: { "sample": true, "freq": "M", "n_periods": 6 }
-    Returns JSON with history + forecast arrays.
-    """
-    freq = "M"
-    n_periods = None
-    df = None
+def spool_upload(stream, block=1 << 20):
+    """Copy an upload to a temporary file that outlives the request; returns (file, SHA-256)."""
+    h = hashlib.sha256()
+    tmp = tempfile.TemporaryFile()
+    for chunk in iter(lambda: stream.read(block), b""):
+        h.update(chunk)
+        tmp.write(chunk)
+    tmp.seek(0)
+    return tmp, h.hexdigest()
 
-    if request.content_type and "application/json" in request.content_type:
-        data = request.get_json(silent=True) or {}
-        freq = (data.get("freq") or "M").upper()
-        n_periods = int(data.get("n_periods") or 6)
-        use_sample = bool(data.get("sample", False))
-        if use_sample:
-            with open(STATIC_DIR / "sample_sales.csv", "rb") as f:
-                df = load_csv_df(f)
-    else:
-        # multipart form
-        freq = (request.form.get("freq") or "M").upper()
-        n_periods = int(request.form.get("n_periods") or (30 if freq == "D" else 8 if freq == "W" else 6))
-        if "file" in request.files and request.files["file"].filename:
-            f = request.files["file"]
-            df = load_csv_df(f.stream)
+def parsed_csv(digest, open_csv, progress=None):
+    """ingest_csv() of the CSV whose content hash is `digest`; open_csv() opens it on a miss."""
+    key = ("df", digest)
+    entry = FORECAST_CACHE.get(key)
+    if entry is None:
+        with open_csv() as f:
+            entry = ingest_csv(f, progress=progress)
+        FORECAST_CACHE.put(key, entry, size=int(entry[0].memory_usage(deep=True).sum()))
+    return entry
 
-    if df is None:
-        # fallback to sample if nothing provided
-        with open(STATIC_DIR / "sample_sales.csv", "rb") as f:
-            df = load_csv_df(f)
+def prepared_series(digest, open_csv, freq, progress=None):
+    """(series, smoothed series, trend fit, ingest stats) for one CSV and frequency; shared by every n_periods."""
+    key = ("series", digest, freq)
+    entry = FORECAST_CACHE.get(key)
+    if entry is None:
+        df, ingest = parsed_csv(digest, open_csv, progress)
+        series = resample_series(df, freq)
+        series = series.asfreq(series.index.freq or freq, fill_value=0)
+        smooth_series = smooth(series, freq)
+        fit = fit_trend(series)
+        entry = (series, smooth_series, fit, ingest)
+        size = series.memory_usage(deep=True) + smooth_series.memory_usage(deep=True) + 32 * len(fit["train_fitted"])
+        FORECAST_CACHE.put(key, entry, size=int(size))
+    return entry
 
-    series = resample_series(df, freq)
-    series = series.asfreq(series.index.freq or freq, fill_value=0)
+def parse_model(raw):
+    """Model name from a request value: a smartshop.models name or "auto" (default linear)."""
+    model = (raw or "linear").strip().lower()
+    if model != "auto" and model not in models.MODELS:
+        raise ValueError("model must be one of: " + ", ".join([*models.MODELS, "auto"]))
+    return model
 
-    # Forecast
-    if n_periods is None:
-        n_periods = 6 if freq == "M" else (8 if freq == "W" else 30)
-    fc = simple_forecast(series, n_periods)
-    smooth_series = smooth(series, freq)
+def forecast_response(series, smooth_series, fit, ingest, freq, n_periods, model="linear"):
+    fc = simple_forecast(series, n_periods, fit)
+    picked = None
+    if model != "linear":
+        # registry model (or the best by backtest); the trend fields below stay the linear fit's
+        picked = model_block(series.values.astype(float)[None, :], np.array([len(series)]), freq, n_periods, model)
+        fc["future_mean"] = picked["mean"][0].tolist()
+        fc["future_lower"] = picked["lower"][0].tolist()
+        fc["future_upper"] = picked["upper"][0].tolist()
 
     # Build response
     history = []
@@ -172,8 +265,259 @@ def api_predict():
         "r2_trend_fit": fc["r2"],
         "sigma_residual": fc["sigma"]
     }
+    if picked is not None:
+        summary["model"] = picked["model"][0]
+        summary["backtest"] = picked["backtest"][0]
+
+    return {"status":"ok","history":history,"forecast":forecast,"summary":summary,"ingest":ingest}
+
+@bp.route("/")
+def index():
+    return bp.send_static_file("index.html")
+
+@bp.route("/api/sample-csv")
+def sample_csv():
+    # Let the user download the sample
+    return send_from_directory(STATIC_DIR, "sample_sales.csv", as_attachment=True)
+
+def wants_async(value):
+    """True for an `async` flag (true/1/yes/on) or a `Prefer: respond-async` header."""
+    if isinstance(value, str):
+        value = value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value) or "respond-async" in (request.headers.get("Prefer") or "").lower()
+
+def predict_body(digest, open_csv, freq, n_periods, model, progress=None):
+    """The /api/predict JSON body (bytes), cached per CSV and parameters. Raises ValueError on a bad CSV."""
+    key = ("response", digest, freq, n_periods, model)
+    body = FORECAST_CACHE.get(key)
+    if body is None:
+        prepared = prepared_series(digest, open_csv, freq, progress)
+        if progress:
+            progress(None, "forecasting")
+        body = jsonify(forecast_response(*prepared, freq, n_periods, model)).get_data()
+        FORECAST_CACHE.put(key, body, size=len(body))
+    return body
+
+def predict_job(progress, digest, upload, freq, n_periods, model):
+    """Job body for an async /api/predict; `upload` is the spooled file, or None for the sample."""
+    open_csv = (lambda: upload) if upload is not None else (lambda: open(SAMPLE_FILE, "rb"))
+    try:
+        return predict_body(digest, open_csv, freq, n_periods, model, progress), "application/json"
+    finally:
+        if upload is not None:
+            upload.close()
+
+def submit_job(kind, fn, *args):
+    """Queue fn(progress, *args) to run inside this app's context: 202 with the job's URLs, or 429 when full."""
+    app = current_app._get_current_object()
+
+    def run(progress, *args):
+        with app.app_context():
+            return fn(progress, *args)
+
+    try:
+        job_id = JOBS.submit(kind, run, *args)
+    except QueueFull:
+        resp = jsonify({"status":"error","message":"too many forecasts in progress, try again shortly"})
+        resp.status_code = 429
+        resp.headers["Retry-After"] = "5"
+        return resp
+    url = url_for(".api_job", job_id=job_id)
+    resp = jsonify({"status":"accepted","job_id":job_id,"job_url":url,
+                    "result_url":url_for(".api_job_result", job_id=job_id)})
+    resp.status_code = 202
+    resp.headers["Location"] = url
+    return resp
+
+@bp.route("/api/predict", methods=["POST"])
+def api_predict():
+    """
+    Accepts multipart/form-data:
+      - file: CSV with columns date,sales
+      - freq: D | W | M
+      - n_periods: int (default based on freq)
+      - model: linear (default) | seasonal_naive | holt_winters | seasonal_linear | auto
+      - async: 1 to run in the background (or send `Prefer: respond-async`)
+    OR JSON body: { "sample": true, "freq": "M", "n_periods": 6, "model": "auto", "async": false }
+    Returns JSON with history + forecast arrays, plus `ingest` (rows read,
+    rows dropped as unparseable, rows/sec). Other models than linear add
+    summary.model and summary.backtest (rolling-origin MAPE/RMSE/fit time
+    of each model tried); auto uses the lowest RMSE. Uploads are read in chunks;
+    identical CSV content (by SHA-256) reuses the cached parse, series and response.
+    With async, answers 202 with a job id at once (429 if the job queue is
+    full); poll /api/jobs/<id> and fetch /api/jobs/<id>/result.
+    """
+    freq = "M"
+    n_periods = None
+    digest = open_csv = upload = None
+
+    if request.content_type and "application/json" in request.content_type:
+        data = request.get_json(silent=True) or {}
+        freq = (data.get("freq") or "M").upper()
+        n_periods = int(data.get("n_periods") or 6)
+        raw_model = data.get("model")
+        run_async = wants_async(data.get("async"))
+    else:
+        # multipart form
+        freq = (request.form.get("freq") or "M").upper()
+        n_periods = int(request.form.get("n_periods") or (30 if freq == "D" else 8 if freq == "W" else 6))
+        raw_model = request.form.get("model")
+        run_async = wants_async(request.form.get("async"))
+
+    try:
+        model = parse_model(raw_model)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+
+    if "file" in request.files and request.files["file"].filename:
+        stream = request.files["file"].stream
+        if run_async:
+            # the request's file is gone once we answer, so the job gets its own copy
+            upload, digest = spool_upload(stream)
+        else:
+            digest, open_csv = file_digest(stream), lambda: stream
+
+    if digest is None:
+        # the sample was requested, or nothing was uploaded
+        digest, open_csv = sample_digest(), lambda: open(SAMPLE_FILE, "rb")
+
+    # Forecast
+    if n_periods is None:
+        n_periods = 6 if freq == "M" else (8 if freq == "W" else 30)
+    if run_async:
+        return submit_job("predict", predict_job, digest, upload, freq, n_periods, model)
+    try:
+        body = predict_body(digest, open_csv, freq, n_periods, model)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    return Response(body, mimetype="application/json")
+
+BATCH_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+def batch_output(results, ingest, fmt):
+    """The batch response body in `fmt`, as text chunks (one per series)."""
+    if fmt == "csv":
+        yield "series_id,date,yhat,lower,upper\n"
+        for res in results:
+            out = io.StringIO()
+            w = csv.writer(out, lineterminator="\n")
+            for f in res["forecast"]:
+                w.writerow([res["series_id"], f["date"], f["yhat"], f["lower"], f["upper"]])
+            yield out.getvalue()
+    else:
+        yield json.dumps({"ingest": ingest}) + "\n"
+        for res in results:
+            yield json.dumps(res) + "\n"
+
+def batch_job(progress, upload, freq, n_periods, model, fmt):
+    """Job body for an async /api/predict/batch."""
+    with upload:
+        totals, ingest = forecast.ingest_long_csv(upload, chunksize=CHUNK_ROWS, progress=progress)
+    progress(None, f"forecasting {ingest['series']:,} series")
+    results = forecast.batch_forecast(totals, freq, n_periods, model)
+    return "".join(batch_output(results, ingest, fmt)).encode(), BATCH_MIMETYPES[fmt]
+
+@bp.route("/api/predict/batch", methods=["POST"])
+def api_predict_batch():
+    """
+    Forecast many series from one long-format upload.
+    Accepts multipart/form-data:
+      - file: CSV with columns date,series_id,sales
+      - freq: D | W | M
+      - n_periods: int (default based on freq)
+      - format: ndjson (default; one JSON object per series) | csv (download)
+      - model: as for /api/predict; auto picks per series
+      - async: 1 to run as a background job, as for /api/predict
+    Series are fitted together with vectorized least squares; large jobs
+    use a process pool (see smartshop/forecast.py). Other models backtest
+    equal-length series together. The response streams.
+    """
+    freq = (request.form.get("freq") or "M").upper()
+    if freq not in forecast.PERIODS:
+        return jsonify({"status":"error","message":"freq must be D, W or M"}), 400
+    n_periods = max(1, request.form.get("n_periods", forecast.DEFAULT_PERIODS[freq], type=int))
+    fmt = (request.form.get("format") or "ndjson").lower()
+    if fmt not in BATCH_MIMETYPES:
+        return jsonify({"status":"error","message":"format must be ndjson or csv"}), 400
+    try:
+        model = parse_model(request.form.get("model"))
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return jsonify({"status":"error","message":"upload a CSV with columns date,series_id,sales"}), 400
+    if wants_async(request.form.get("async")):
+        return submit_job("batch", batch_job, spool_upload(upload.stream)[0], freq, n_periods, model, fmt)
+    try:
+        totals, ingest = forecast.ingest_long_csv(upload.stream, chunksize=CHUNK_ROWS)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    results = forecast.batch_forecast(totals, freq, n_periods, model)
+
+    resp = Response(batch_output(results, ingest, fmt), mimetype=BATCH_MIMETYPES[fmt])
+    if fmt == "csv":
+        resp.headers["Content-Disposition"] = "attachment; filename=forecast_batch.csv"
+    resp.headers["X-Rows"] = str(ingest["rows"])
+    resp.headers["X-Rows-Dropped"] = str(ingest["rows_dropped"])
+    resp.headers["X-Series"] = str(ingest["series"])
+    return resp
+
+def iso_time(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(t)) if t else None
+
+def job_view(job):
+    """Status fields of a job record, without the result."""
+    view = {k: job[k] for k in ("id", "kind", "state", "progress", "message", "error")}
+    for k in ("created_at", "started_at", "finished_at", "expires_at"):
+        view[k] = iso_time(job[k])
+    if job["state"] == "done":
+        view["result_url"] = url_for(".api_job_result", job_id=job["id"])
+    return view
+
+@bp.route("/api/jobs", methods=["GET"])
+def api_jobs():
+    """Job queue settings and how many jobs this process is running or holding."""
+    return jsonify({"status":"ok", **JOBS.stats()})
+
+@bp.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job(job_id):
+    """State of a background job: queued | running | done | error, with progress (0-1) and a message."""
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"status":"error","message":"job not found or expired"}), 404
+    return jsonify({"status":"ok","job":job_view(job)})
+
+@bp.route("/api/jobs/<job_id>/result", methods=["GET"])
+def api_job_result(job_id):
+    """
+    The finished job's response, exactly as the synchronous endpoint would
+    have sent it. 202 with the job's state while it is still queued or
+    running; the job's error (400/500) if it failed.
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"status":"error","message":"job not found or expired"}), 404
+    if job["state"] == "error":
+        return jsonify({"status":"error","message":job["error"]}), job["error_status"] or 500
+    if job["state"] != "done":
+        resp = jsonify({"status":"ok","job":job_view(job)})
+        resp.status_code = 202
+        resp.headers["Retry-After"] = "1"
+        return resp
+    resp = Response(job["result"], mimetype=job["mimetype"])
+    if job["mimetype"] == BATCH_MIMETYPES["csv"]:
+        resp.headers["Content-Disposition"] = "attachment; filename=forecast_batch.csv"
+    return resp
+
+@bp.route("/api/predict/cache", methods=["GET"])
+def api_predict_cache():
+    """Size and hit/miss counters of the forecast cache."""
+    return jsonify({"status":"ok", **FORECAST_CACHE.stats()})
 
-    return jsonify({"status":"ok","history":history,"forecast":forecast,"summary":summary})
+# Standalone server for this module; gateway.py mounts `bp` under /salesprediction instead
+app = Flask(__name__, static_folder=None)
+app.register_blueprint(bp)
+instrument(app)
 
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5001, debug=True)
@@ -72,6 +72,28 @@ $("#downloadCsv").addEventListener("click", () => {
   URL.revokeObjectURL(url);
 });
 
+/* Header line; names the model and its backtest MAPE when one was chosen */
+function metaText(summary) {
+  let text = `Obs: ${summary.n_obs} • Last: ${summary.last_date} • Horizon: ${summary.n_forecast} • R² (trend): ${Number(summary.r2_trend_fit).toFixed(2)}`;
+  if (summary.model) {
+    const mape = (summary.backtest && summary.backtest[summary.model] || {}).mape;
+    text += ` • Model: ${summary.model}` + (mape != null ? ` (MAPE ${Number(mape).toFixed(1)}%)` : "");
+  }
+  return text;
+}
+
+/* Poll a background job, showing its progress, until its result is ready */
+async function waitForJob(job) {
+  for (;;) {
+    const res = await fetch(job.result_url);
+    const data = await res.json();
+    if (res.status !== 202) return data;
+    const pct = Math.round((data.job.progress || 0) * 100);
+    $("#meta").textContent = `Working… ${pct}%` + (data.job.message ? ` • ${data.job.message}` : "");
+    await new Promise(r => setTimeout(r, 500));
+  }
+}
+
 /* Submit handler */
 $("#predictForm").addEventListener("submit", async (e) => {
   e.preventDefault();
@@ -80,12 +102,18 @@ $("#predictForm").addEventListener("submit", async (e) => {
   if (file) formData.append("file", file);
   formData.append("freq", $("#freq").value);
   formData.append("n_periods", $("#n_periods").value || 6);
+  formData.append("model", $("#model").value);
+  // uploads run as a background job so big files don't hold the request open
+  if (file) formData.append("async", "1");
 
-  const res = await fetch("/api/predict", { method: "POST", body: formData });
-  const data = await res.json();
-  if (data.status !== "ok") { alert("Prediction failed."); return; }
+  const res = await fetch("api/predict", { method: "POST", body: formData });
+  let data = await res.json();
+  if (res.status === 202) data = await waitForJob(data);
+  if (data.status !== "ok") { alert("Prediction failed." + (data.message ? " " + data.message : "")); return; }
 
-  $("#meta").textContent = `Obs: ${data.summary.n_obs} • Last: ${data.summary.last_date} • Horizon: ${data.summary.n_forecast} • R² (trend): ${Number(data.summary.r2_trend_fit).toFixed(2)}`;
+  const ingest = data.ingest || {};
+  $("#meta").textContent = metaText(data.summary) +
+    (ingest.rows_dropped ? ` • Skipped ${fmtINR(ingest.rows_dropped)} of ${fmtINR(ingest.rows)} rows` : "");
   renderChart(data.history, data.forecast);
   renderTable(data.forecast);
   window._forecast = data.forecast;
@@ -93,12 +121,12 @@ $("#predictForm").addEventListener("submit", async (e) => {
 
 /* Sample button */
 $("#sampleBtn").addEventListener("click", async () => {
-  const payload = { sample: true, freq: $("#freq").value, n_periods: Number($("#n_periods").value || 6) };
-  const res = await fetch("/api/predict", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify(payload) });
+  const payload = { sample: true, freq: $("#freq").value, n_periods: Number($("#n_periods").value || 6), model: $("#model").value };
+  const res = await fetch("api/predict", { method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify(payload) });
   const data = await res.json();
-  if (data.status !== "ok") { alert("Prediction failed."); return; }
+  if (data.status !== "ok") { alert("Prediction failed." + (data.message ? " " + data.message : "")); return; }
 
-  $("#meta").textContent = `Obs: ${data.summary.n_obs} • Last: ${data.summary.last_date} • Horizon: ${data.summary.n_forecast} • R² (trend): ${Number(data.summary.r2_trend_fit).toFixed(2)}`;
+  $("#meta").textContent = metaText(data.summary);
   renderChart(data.history, data.forecast);
   renderTable(data.forecast);
   window._forecast = data.forecast;
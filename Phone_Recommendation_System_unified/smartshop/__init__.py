@@ -0,0 +1,7 @@
+"""
+Shared helpers used by the Smart Shop modules (catalog indexes, storage, search).
+
+Each module adds the project root to sys.path so `import smartshop` works both
+when a module is started on its own (`cd phonefinder && python app.py`) and
+when it is imported from elsewhere.
+"""
@@ -0,0 +1,740 @@
+"""
+Load tests of every endpoint on synthetic data of a chosen size.
+
+    python -m smartshop.bench run --rows 10000
+        generates a data set (rows phones, rows reviews, rows listings,
+        rows reminders, rows sales CSV lines, rows/10 shops and upcoming
+        phones) in a scratch copy of the project and drives every endpoint
+        through the Flask test client, in a fresh process
+    python -m smartshop.bench run --rows 100000 --driver http --workers 4 --concurrency 16
+        the same against gunicorn over real HTTP, from several client processes
+    python -m smartshop.bench run --rows 10000 --out before.json
+    python -m smartshop.bench compare before.json after.json
+        per-scenario changes; exit status 1 if a p50, p90 or throughput got worse
+        by more than --threshold and --min-ms (p99 is shown, not judged)
+    python -m smartshop.bench generate /tmp/bench-1m --rows 1000000
+        only write the project copy with its data set; `run --project` reuses it
+
+The data comes from --seed, so runs on two commits see the same records
+and send the same requests (upcoming release dates are placed around the
+day the data is generated, so "upcoming" always has phones in it). Each
+scenario sends --requests requests, the CSV uploads a twentieth of that,
+cycling through up to VARIANTS distinct queries drawn from the data, so the
+response caches see repeats as they would in production. Every scenario is
+warmed up with one pass over its distinct queries and then measured --repeat
+times; the report gives the median of those rounds' latency percentiles and
+throughput per scenario, the time until the app
+was ready and the server's peak resident memory (summed over gunicorn's
+processes over HTTP, which counts shared pages once per process; Linux only).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import argparse, datetime, http.client, json, os, platform, random, shutil, subprocess, sys, tempfile, threading, time
+from urllib.parse import urlencode, urlsplit
+
+from .stress import ROOT, copy_project, launch
+
+# Distinct requests per scenario
+VARIANTS = 50
+
+# Heavy scenarios (uploads) send this many times fewer requests
+HEAVY_SHARE = 20
+
+# Startup time changes smaller than this (seconds) are noise (imports, page cache)
+STARTUP_NOISE_S = 0.25
+
+# Timestamps of generated reviews, listings and sales end here
+BASE_DATE = datetime.date(2025, 1, 1)
+
+BRANDS = ["Apple", "Samsung", "OnePlus", "Xiaomi", "Realme", "Vivo", "Oppo", "Google", "Motorola", "Nothing"]
+SUFFIXES = ["Pro", "Lite", "Max", "Plus", "Neo", "Ultra"]
+CONDITIONS = ["Like New", "Good", "Fair"]
+WORDS = ("great battery camera smooth display bright heats gaming value fast charging loud speaker "
+         "solid build slow updates light premium cheap night photos").split()
+# city, state, centroid, pincode prefix
+CITIES = [("Ahmedabad", "Gujarat", 23.03, 72.58, "380"), ("Mumbai", "Maharashtra", 19.08, 72.88, "400"),
+          ("Pune", "Maharashtra", 18.52, 73.86, "411"), ("Delhi", "Delhi", 28.61, 77.21, "110"),
+          ("Bengaluru", "Karnataka", 12.97, 77.59, "560"), ("Chennai", "Tamil Nadu", 13.08, 80.27, "600"),
+          ("Hyderabad", "Telangana", 17.39, 78.49, "500"), ("Kolkata", "West Bengal", 22.57, 88.36, "700"),
+          ("Jaipur", "Rajasthan", 26.91, 75.79, "302"), ("Surat", "Gujarat", 21.17, 72.83, "395")]
+
+DATA_FILES = {
+    "phones": ("phonefinder/static/phones.json", "comparephone/static/phones.json"),
+    "shops": ("phonefinder/static/shops.json",),
+    "pincodes": ("phonefinder/static/pincodes.json",),
+    "reviews": ("reviews/data/reviews.json",),
+    "listings": ("buyandsell/data/listings.json",),
+    "upcoming": ("upcomingphone/data/upcoming_phones.json",),
+    "notifications": ("upcomingphone/data/notifications.json",),
+    "dispatches": ("upcomingphone/data/dispatches.json",),
+}
+SALES_CSV = "bench/sales.csv"
+SALES_LONG_CSV = "bench/sales_long.csv"
+MANIFEST = "bench.json"
+
+
+# ---- synthetic data ---------------------------------------------------------
+
+def sizes_for(rows, overrides=""):
+    """Records per kind for --rows, with `kind=n,...` overrides."""
+    sizes = {"phones": rows, "shops": max(10, rows // 10), "reviews": rows, "listings": rows,
+             "upcoming": max(10, rows // 10), "notifications": rows, "sales": rows}
+    for item in filter(None, (overrides or "").split(",")):
+        kind, _, n = item.partition("=")
+        if kind.strip() not in sizes:
+            raise ValueError(f"unknown data kind {kind!r} (one of {', '.join(sizes)})")
+        sizes[kind.strip()] = int(n)
+    return sizes
+
+
+def iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def spread(n, days, end, rng):
+    """n increasing datetimes over the `days` days before `end`."""
+    start = datetime.datetime.combine(end, datetime.time()) - datetime.timedelta(days=days)
+    step = days * 86400 / max(n, 1)
+    return [start + datetime.timedelta(seconds=int(i * step + rng.random() * step)) for i in range(n)]
+
+
+def gen_phones(n, rng):
+    phones = []
+    for i in range(n):
+        brand = rng.choice(BRANDS)
+        phones.append({"id": f"P{i:07d}", "brand": brand, "model": f"{brand} Model {i} {rng.choice(SUFFIXES)}",
+                       "price": rng.randrange(6000, 150000, 500), "ram_gb": rng.choice([4, 6, 8, 12, 16]),
+                       "storage_gb": rng.choice([64, 128, 256, 512]), "battery_mah": rng.randrange(3000, 6000, 50),
+                       "rating": round(rng.uniform(3.0, 5.0), 1), "camera_mp": rng.choice([12, 48, 50, 64, 108, 200]),
+                       "display_inch": round(rng.uniform(5.8, 6.9), 1)})
+    return phones
+
+
+def gen_pincodes(rng, per_city=20):
+    return {f"{prefix}{k:03d}": [round(lat + rng.uniform(-0.15, 0.15), 4), round(lon + rng.uniform(-0.15, 0.15), 4)]
+            for _, _, lat, lon, prefix in CITIES for k in range(1, per_city + 1)}
+
+
+def gen_shops(n, phones, pincodes, rng):
+    city_of = {c[4]: c for c in CITIES}
+    pins = sorted(pincodes)
+    ids = [p["id"] for p in phones]
+    shops = []
+    for i in range(n):
+        pin = rng.choice(pins)
+        city, state = city_of[pin[:3]][:2]
+        shop = {"id": f"S{i:06d}", "name": f"{rng.choice(['Mobile Hub', 'Phone Point', 'Smart Store', 'Cell World'])} {i}",
+                "address": f"Shop {i}, Main Road", "city": city, "state": state, "pincode": pin,
+                "phone": f"+91-{rng.randrange(10**9, 10**10)}", "opening_hours": "Mon-Sun 10:00-21:00",
+                "phone_brands": sorted(rng.sample(BRANDS, rng.randrange(3, 7))),
+                "inventory": rng.sample(ids, min(len(ids), rng.randrange(10, 60)))}
+        if rng.random() < 0.9:
+            # the rest are located by their pincode's centroid
+            lat, lon = pincodes[pin]
+            shop["lat"], shop["lon"] = round(lat + rng.uniform(-0.02, 0.02), 5), round(lon + rng.uniform(-0.02, 0.02), 5)
+        shops.append(shop)
+    return shops
+
+
+def gen_reviews(n, phones, rng):
+    popular = [p["model"] for p in phones[:2000]]
+    reviews = []
+    for i, at in enumerate(spread(n, 730, BASE_DATE, rng)):
+        city = rng.choice(CITIES)[0]
+        reviews.append({"id": f"R{i:08d}", "reviewer_name": f"user{rng.randrange(max(n, 1))}",
+                        "rating": rng.choices(range(1, 6), weights=(1, 1, 2, 4, 4))[0],
+                        "title": " ".join(rng.sample(WORDS, 2)).capitalize(), "body": " ".join(rng.sample(WORDS, 8)),
+                        "model": rng.choice(popular), "city": city, "created_at": iso(at), "visible": rng.random() > 0.05})
+    return reviews
+
+
+def gen_listings(n, phones, rng):
+    popular = phones[:2000]
+    listings = []
+    for i, at in enumerate(spread(n, 730, BASE_DATE, rng)):
+        phone = rng.choice(popular)
+        city, state = rng.choice(CITIES)[:2]
+        ltype = "sell" if rng.random() < 0.85 else "buy"
+        price = float(round(phone["price"] * rng.uniform(0.3, 0.8), -2))
+        rec = {"id": f"L{i:08d}", "type": ltype, "brand": phone["brand"], "model": phone["model"],
+               "condition": rng.choice(CONDITIONS), "price": price, "description": " ".join(rng.sample(WORDS, 6)),
+               "city": city, "state": state, "seller_name": f"seller{i}", "contact_phone": f"+91-{rng.randrange(10**9, 10**10)}",
+               "images": [], "status": "available", "posted_at": iso(at)}
+        if ltype == "sell" and rng.random() < 0.3:
+            rec.update(status="sold", sold_at=iso(at + datetime.timedelta(hours=rng.randrange(1, 24 * 60))),
+                       sold_price=float(round(price * rng.uniform(0.85, 1.0), -2)))
+        listings.append(rec)
+    return listings
+
+
+def gen_upcoming(n, rng, today=None):
+    today = today or datetime.date.today()
+    phones = []
+    for i in range(n):
+        brand = rng.choice(BRANDS)
+        release = today + datetime.timedelta(days=rng.randrange(-180, 365))
+        undated = rng.random() < 0.1
+        phones.append({"id": f"UP{i:06d}", "brand": brand, "model": f"{brand} Next {i} {rng.choice(SUFFIXES)}",
+                       "release_date": "" if undated else release.isoformat(),
+                       "price": "TBD" if rng.random() < 0.5 else rng.randrange(10000, 150000, 1000),
+                       "description": " ".join(rng.sample(WORDS, 10)), "announced_by": brand,
+                       "pre_order_date": "" if undated else (release - datetime.timedelta(days=rng.randrange(0, 14))).isoformat(),
+                       "notes": "", "img_url": ""})
+    return phones
+
+
+def gen_notifications(n, upcoming, rng):
+    return [{"id": f"N{i:08d}", "phone_id": rng.choice(upcoming)["id"], "name": f"user{i}",
+             "contact": f"user{i}@example.com", "notes": "", "created_at": iso(at)}
+            for i, at in enumerate(spread(n, 90, BASE_DATE, rng))]
+
+
+def write_sales(path, n, years, rng, series=None):
+    """A CSV of n sales rows over `years` years: date,sales, or date,series_id,sales split into `series` series."""
+    days = years * 365
+    start = BASE_DATE - datetime.timedelta(days=days)
+    per_series = max(1, n // (series or 1))
+    lines = ["date,sales" if series is None else "date,series_id,sales"]
+    for s in range(series or 1):
+        level, trend = rng.uniform(50, 500), rng.uniform(-0.02, 0.2)
+        for i in range(per_series):
+            d = i * days // per_series
+            seasonal = 1 + 0.3 * ((d % 365) / 365 - 0.5)
+            value = max(0, round(level * seasonal + trend * d + rng.gauss(0, level * 0.1)))
+            day = (start + datetime.timedelta(days=d)).isoformat()
+            lines.append(f"{day},{value}" if series is None else f"{day},S{s:04d},{value}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def write_json(project, kind, data):
+    for rel in DATA_FILES[kind]:
+        path = project / rel
+        path.write_text(json.dumps(data), encoding="utf-8")
+        # a leftover append log would be replayed on top of the new snapshot
+        path.with_name(path.name + ".log").unlink(missing_ok=True)
+
+
+def generate(project, sizes, seed=7, years=3):
+    """Write a synthetic data set into the project copy at `project`; returns its manifest."""
+    project = Path(project)
+    rng = random.Random(seed)
+    phones = gen_phones(sizes["phones"], rng)
+    pincodes = gen_pincodes(rng)
+    upcoming = gen_upcoming(sizes["upcoming"], rng)
+    listings = gen_listings(sizes["listings"], phones, rng)
+    reviews = gen_reviews(sizes["reviews"], phones, rng)
+    write_json(project, "phones", phones)
+    write_json(project, "pincodes", pincodes)
+    write_json(project, "shops", gen_shops(sizes["shops"], phones, pincodes, rng))
+    write_json(project, "reviews", reviews)
+    write_json(project, "listings", listings)
+    write_json(project, "upcoming", upcoming)
+    write_json(project, "notifications", gen_notifications(sizes["notifications"], upcoming, rng))
+    write_json(project, "dispatches", [])
+    (project / "upcomingphone" / "data" / "outbox.jsonl").unlink(missing_ok=True)
+    write_sales(project / SALES_CSV, sizes["sales"], years, rng)
+    write_sales(project / SALES_LONG_CSV, sizes["sales"], years, rng, series=max(2, sizes["sales"] // 1000))
+
+    # what the scenarios draw their queries from
+    sample = lambda xs: rng.sample(xs, min(len(xs), 2 * VARIANTS))
+    sold = [r for r in listings if r["status"] == "sold"]
+    today = datetime.date.today()
+    pools = {
+        "phone_ids": sample([p["id"] for p in phones]),
+        "phone_words": sample([w for p in phones[:1000]
+                               for w in (f"{p['brand'][:4].lower()} {p['model'].split()[2]}", p["model"].split()[-1][:3].lower())]),
+        "pincodes": sorted(pincodes)[:: max(1, len(pincodes) // VARIANTS)],
+        "centroids": [[lat, lon] for lat, lon in pincodes.values()][:: max(1, len(pincodes) // VARIANTS)],
+        "upcoming_ids": sample([p["id"] for p in upcoming]),
+        "months": [(today.replace(day=1) + datetime.timedelta(days=31 * k)).strftime("%Y-%m") for k in range(-6, 12)],
+        "listing_ids": sample([r["id"] for r in listings if r["status"] == "available" and r["type"] == "sell"]),
+        "sold_groups": sample([[r["brand"], r["model"], r["condition"]] for r in sold]) or [["Apple", "iPhone 14", "Good"]],
+        "review_ids": sample([r["id"] for r in reviews]),
+        "review_models": sample(sorted({r["model"] for r in reviews})),
+    }
+    manifest = {"seed": seed, "years": years, "sizes": sizes, "generated": iso(datetime.datetime.utcnow()), "pools": pools}
+    (project / MANIFEST).write_text(json.dumps(manifest, indent=1), encoding="utf-8")
+    return manifest
+
+
+def prepare(project, storage):
+    """Compile catalog snapshots (as run_all does) and, for SQLite, migrate the JSON data."""
+    subprocess.run([sys.executable, "-m", "smartshop.columnar"], cwd=project, check=True, stdout=subprocess.DEVNULL)
+    if storage == "sqlite":
+        env = {k: v for k, v in os.environ.items() if k != "SMARTSHOP_DB"}
+        subprocess.run([sys.executable, "-m", "smartshop.migrate"], cwd=project, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+
+
+# ---- scenarios ----------------------------------------------------------------
+
+def scenarios(pools, seed=7):
+    """[(name, heavy, [request spec, ...])]; a spec is {method, path[, json][, form, file]}."""
+    rng = random.Random(seed)
+    pick = rng.choice
+    city = lambda: pick(CITIES)[0]
+
+    def get(path, make=lambda: {}):
+        specs = []
+        for _ in range(VARIANTS):
+            query = urlencode(make())
+            specs.append({"method": "GET", "path": path() if callable(path) else path + ("?" + query if query else "")})
+        return specs
+
+    def post(path, make):
+        return [{"method": "POST", "path": path, "json": make()} for _ in range(VARIANTS)]
+
+    def upload(path, csv, make):
+        return [{"method": "POST", "path": path, "form": make(), "file": csv} for _ in range(VARIANTS)]
+
+    counter = iter(range(10**9))
+    out = [
+        ("pages", False, [{"method": "GET", "path": p} for p in ("/", "/phonefinder/", "/salesprediction/", "/buyandsell/",
+                                                                  "/comparephone/", "/upcomingphone/", "/reviews/")]),
+        ("phonefinder.phones.search", False, get("/phonefinder/api/phones", lambda: {"q": pick(pools["phone_words"]), "limit": 20})),
+        ("phonefinder.phones.filter", False, get("/phonefinder/api/phones", lambda: {
+            "brand": pick(BRANDS), "min_price": rng.randrange(5000, 50000, 5000), "max_price": rng.randrange(60000, 150000, 10000),
+            "ram_min": pick([4, 8]), "sort": pick(["price_asc", "price_desc", "rating_desc"]), "limit": 20})),
+        ("phonefinder.phones.id", False, get("/phonefinder/api/phones", lambda: {"model_id": pick(pools["phone_ids"])})),
+        ("phonefinder.shops.city", False, get("/phonefinder/api/shops", lambda: {"city": city(), "brand": pick(BRANDS)})),
+        ("phonefinder.shops.near", False, get("/phonefinder/api/shops", lambda: {
+            "near": "%s,%s" % tuple(pick(pools["centroids"])), "radius_km": pick([5, 10, 25]), "limit": 20})),
+        ("phonefinder.shops.pincode", False, get("/phonefinder/api/shops", lambda: {"pincode": pick(pools["pincodes"]), "limit": 20})),
+        ("comparephone.phones", False, get("/comparephone/api/phones", lambda: {"q": pick(pools["phone_words"]), "limit": 20})),
+        ("comparephone.phone", False, get(lambda: f"/comparephone/api/phone/{pick(pools['phone_ids'])}")),
+        ("comparephone.compare.get", False, get("/comparephone/api/compare", lambda: {
+            "id1": pick(pools["phone_ids"]), "id2": pick(pools["phone_ids"])})),
+        ("comparephone.compare.post", False, post("/comparephone/api/compare", lambda: {
+            "id1": pick(pools["phone_ids"]), "id2": pick(pools["phone_ids"]), "weights": f"rating:{rng.randrange(1, 4)},price:2"})),
+        ("comparephone.compare.cache", False, get("/comparephone/api/compare/cache")),
+        ("comparephone.rank", False, get("/comparephone/api/rank", lambda: {
+            "weights": f"rating:{rng.randrange(1, 4)},price:{rng.randrange(1, 4)},battery_mah:1", "brand": pick(BRANDS), "k": 10})),
+        ("upcomingphone.upcoming", False, get("/upcomingphone/api/upcoming", lambda: pick([
+            {"days": pick([30, 90, 365]), "limit": 20}, {"all": 1, "sort": "latest", "limit": 20},
+            {"q": pick(WORDS), "limit": 20}, {"brand": pick(BRANDS), "limit": 20}]))),
+        ("upcomingphone.calendar", False, get("/upcomingphone/api/upcoming/calendar", lambda: {
+            "month": pick(pools["months"]), "months": pick([1, 3]), "fields": "id,model,release_date"})),
+        ("upcomingphone.phone", False, get(lambda: f"/upcomingphone/api/phone/{pick(pools['upcoming_ids'])}")),
+        ("upcomingphone.notify", False, post("/upcomingphone/api/notify", lambda: {
+            "phone_id": pick(pools["upcoming_ids"]), "name": "bench", "contact": f"bench{next(counter)}@example.com"})),
+        ("upcomingphone.notifications", False, get("/upcomingphone/api/notifications", lambda: {"limit": pick([20, 100])})),
+        ("upcomingphone.dispatches", False, get("/upcomingphone/api/notify/dispatches", lambda: {"limit": 20})),
+        ("buyandsell.listings.newest", False, get("/buyandsell/api/listings", lambda: {"city": city(), "limit": 20})),
+        ("buyandsell.listings.search", False, get("/buyandsell/api/listings", lambda: {"q": pick(pools["phone_words"]), "limit": 20})),
+        ("buyandsell.listings.price", False, get("/buyandsell/api/listings", lambda: {
+            "min_price": rng.randrange(1000, 20000, 1000), "max_price": rng.randrange(30000, 90000, 5000),
+            "sort": pick(["price", "price_desc"]), "limit": 20})),
+        ("buyandsell.price_suggestion", False, get("/buyandsell/api/listings/price_suggestion", lambda: dict(
+            zip(("brand", "model", "condition"), pick(pools["sold_groups"]))))),
+        ("buyandsell.post", False, post("/buyandsell/api/listings", lambda: {
+            "type": "sell", "seller_name": "bench", "contact_phone": "0", "brand": pick(BRANDS), "model": "Bench Phone",
+            "condition": pick(CONDITIONS), "price": rng.randrange(1000, 90000, 500), "city": city(), "state": "Bench"})),
+        ("buyandsell.mark_sold", False, [{"method": "POST", "path": "/buyandsell/api/mark_sold", "json": {"id": lid}}
+                                         for lid in pools["listing_ids"][:VARIANTS]]),
+        ("reviews.list", False, get("/reviews/api/reviews", lambda: pick([
+            {"model": pick(pools["review_models"]), "limit": 20}, {"city": city(), "min_rating": 4, "limit": 20},
+            {"sort": "highest", "limit": 20}]))),
+        ("reviews.search", False, get("/reviews/api/reviews", lambda: {"q": " ".join(rng.sample(WORDS, 2)), "limit": 20})),
+        ("reviews.stats", False, get("/reviews/api/reviews/stats", lambda: pick([
+            {"model": pick(pools["review_models"])}, {"city": city()}, {"group_by": pick(["model", "city"])}]))),
+        ("reviews.post", False, post("/reviews/api/reviews", lambda: {
+            "reviewer_name": "bench", "rating": rng.randrange(1, 6), "body": " ".join(rng.sample(WORDS, 8)),
+            "model": pick(pools["review_models"]), "city": city()})),
+        ("reviews.hide", False, post("/reviews/api/reviews/hide", lambda: {"ids": rng.sample(pools["review_ids"], 5)})),
+        ("reviews.unhide", False, post("/reviews/api/reviews/unhide", lambda: {"ids": rng.sample(pools["review_ids"], 5)})),
+        ("salesprediction.predict.sample", False, post("/salesprediction/api/predict", lambda: {
+            "sample": True, "freq": pick(["M", "W"]), "n_periods": rng.randrange(3, 13), "model": pick(["linear", "auto"])})),
+        ("salesprediction.predict.upload", True, upload("/salesprediction/api/predict", SALES_CSV, lambda: {
+            "freq": pick(["D", "W", "M"]), "n_periods": rng.randrange(3, 13)})),
+        ("salesprediction.predict.batch", True, upload("/salesprediction/api/predict/batch", SALES_LONG_CSV, lambda: {
+            "freq": pick(["W", "M"]), "n_periods": rng.randrange(3, 13)})),
+        ("salesprediction.jobs", False, get("/salesprediction/api/jobs")),
+        ("salesprediction.predict.cache", False, get("/salesprediction/api/predict/cache")),
+        ("gateway.metrics", False, get("/metrics")),
+    ]
+    return out
+
+
+def encode(spec, project, _files={}):
+    """(body, headers) of a request spec."""
+    if "json" in spec:
+        return json.dumps(spec["json"]).encode("utf-8"), {"Content-Type": "application/json"}
+    if "file" not in spec:
+        return None, {}
+    data = _files.get(spec["file"])
+    if data is None:
+        data = _files[spec["file"]] = (Path(project) / spec["file"]).read_bytes()
+    boundary = "smartshop-bench-boundary"
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode()
+             for k, v in spec.get("form", {}).items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{Path(spec["file"]).name}"\r\n'
+                 f'Content-Type: text/csv\r\n\r\n'.encode() + data + f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def summarize(samples, wall):
+    """Latency percentiles (ms), throughput and errors of [(seconds, status)] taking `wall` seconds."""
+    lat = sorted(s for s, _ in samples)
+    errors = [status for _, status in samples if status is None or status >= 400]
+    pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 3) if lat else None
+    return {"n": len(lat), "errors": len(errors), "error_statuses": sorted(set(map(str, errors))),
+            "p50_ms": pct(0.5), "p90_ms": pct(0.9), "p99_ms": pct(0.99), "max_ms": round(lat[-1] * 1000, 3) if lat else None,
+            "mean_ms": round(sum(lat) / len(lat) * 1000, 3) if lat else None,
+            "rps": round(len(lat) / wall, 1) if wall > 0 else None}
+
+
+def combine(rounds):
+    """One summary of repeated rounds: requests and errors added up, the median of every statistic."""
+    out = {"n": sum(r["n"] for r in rounds), "errors": sum(r["errors"] for r in rounds),
+           "error_statuses": sorted(set().union(*(r["error_statuses"] for r in rounds))), "rounds": len(rounds)}
+    for k in ("p50_ms", "p90_ms", "p99_ms", "max_ms", "mean_ms", "rps"):
+        vals = sorted(r[k] for r in rounds if r[k] is not None)
+        out[k] = vals[len(vals) // 2] if vals else None
+    return out
+
+
+def measure(send, specs, heavy, plan):
+    """
+    Statistics of one scenario: a warm-up pass over its distinct requests,
+    then plan["repeat"] rounds of plan["requests"] requests (a HEAVY_SHARE
+    of that for heavy ones). send(indices) sends specs[i % len(specs)] for
+    each index and returns [(seconds, status)].
+    """
+    n = max(1, plan["requests"] // HEAVY_SHARE) if heavy else plan["requests"]
+    if plan["warmup"]:
+        send(list(range(1 if heavy else min(len(specs), n))))
+    rounds = []
+    for _ in range(plan["repeat"]):
+        wall = time.perf_counter()
+        samples = send(list(range(n)))
+        rounds.append(summarize(samples, time.perf_counter() - wall))
+    return combine(rounds)
+
+
+def threaded(threads, indices, fn):
+    """Run fn(share) for `threads` interleaved shares of `indices` at once; the concatenated results."""
+    out = [[] for _ in range(threads)]
+
+    def run(t):
+        out[t] = fn(indices[t::threads])
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for th in pool:
+        th.start()
+    for th in pool:
+        th.join()
+    return [s for part in out for s in part]
+
+
+# ---- drivers -----------------------------------------------------------------
+
+def rss_mb(pid="self"):
+    """(current, peak) resident MB of a process from /proc, or (None, None) where there is no /proc."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None, None
+    mb = lambda k: round(int(status[k].split()[0]) / 1024, 1) if k in status else None
+    return mb("VmRSS"), mb("VmHWM")
+
+
+def run_client(project, plan_path):
+    """Child process of the test-client driver: load the gateway from `project`, run the plan, print the results."""
+    plan = json.loads(Path(plan_path).read_text(encoding="utf-8"))
+    os.chdir(project)
+    sys.path.insert(0, str(project))
+    started = time.perf_counter()
+    from gateway import app
+    startup = time.perf_counter() - started
+    rss_ready = rss_mb()[0]
+    results = {}
+    for name, heavy, specs in plan["scenarios"]:
+        encoded = [encode(s, project) for s in specs]
+
+        def send_share(indices):
+            client, samples = app.test_client(), []
+            for i in indices:
+                spec, (body, headers) = specs[i % len(specs)], encoded[i % len(specs)]
+                t0 = time.perf_counter()
+                resp = client.open(spec["path"], method=spec["method"], data=body, headers=headers)
+                resp.get_data()
+                samples.append((time.perf_counter() - t0, resp.status_code))
+                resp.close()
+            return samples
+
+        results[name] = measure(lambda indices: threaded(plan["concurrency"], indices, send_share), specs, heavy, plan)
+    peak = rss_mb()[1]
+    if peak is None:
+        try:
+            import resource
+            peak = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KB on Linux
+        except ImportError:
+            pass
+    print(json.dumps({"startup_s": round(startup, 3), "rss_ready_mb": rss_ready, "peak_rss_mb": peak, "scenarios": results}))
+
+
+def http_worker(base, project, specs, indices, threads):
+    """Send specs[i] for i in `indices` over `threads` keep-alive connections; [(seconds, status)]."""
+    url = urlsplit(base)
+    encoded = [encode(s, project) for s in specs]
+
+    def send_share(share):
+        conn, samples = http.client.HTTPConnection(url.hostname, url.port, timeout=300), []
+        for i in share:
+            spec, (body, headers) = specs[i % len(specs)], encoded[i % len(specs)]
+            t0 = time.perf_counter()
+            try:
+                conn.request(spec["method"], spec["path"], body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(url.hostname, url.port, timeout=300)
+                status = None
+            samples.append((time.perf_counter() - t0, status))
+        conn.close()
+        return samples
+
+    return threaded(threads, indices, send_share)
+
+
+def server_rss(pid):
+    """(current, peak) resident MB summed over a process and its children."""
+    pids = [pid]
+    for entry in Path("/proc").glob("[0-9]*"):
+        try:
+            status = (entry / "status").read_text(encoding="ascii")
+        except OSError:
+            continue
+        if f"\nPPid:\t{pid}\n" in status:
+            pids.append(entry.name)
+    both = [rss_mb(p) for p in pids]
+    if any(cur is None for cur, _ in both):
+        return None, None
+    return round(sum(cur for cur, _ in both), 1), round(sum(peak for _, peak in both), 1)
+
+
+def run_http(project, plan, workers, storage, clients):
+    started = time.perf_counter()
+    proc, base = launch(project, workers, storage, timeout=600)
+    startup = time.perf_counter() - started
+    try:
+        rss_ready = server_rss(proc.pid)[0]
+        results = {}
+        procs = max(1, min(clients, plan["concurrency"]))
+        threads = [len(range(p, plan["concurrency"], procs)) for p in range(procs)]
+        with ProcessPoolExecutor(max_workers=procs) as pool:
+            for name, heavy, specs in plan["scenarios"]:
+
+                def send(indices):
+                    futures = [pool.submit(http_worker, base, str(project), specs, indices[p::procs], threads[p])
+                               for p in range(procs) if indices[p::procs]]
+                    return [s for f in futures for s in f.result()]
+
+                results[name] = measure(send, specs, heavy, plan)
+        return {"startup_s": round(startup, 3), "rss_ready_mb": rss_ready, "peak_rss_mb": server_rss(proc.pid)[1],
+                "scenarios": results}
+    finally:
+        proc.terminate()
+        proc.wait(60)
+
+
+# ---- reports -----------------------------------------------------------------
+
+def commit_id():
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def fmt(v, spec="8.2f"):
+    return format(v, spec) if v is not None else format("-", spec[:-2] + "s")
+
+
+def print_report(report):
+    meta, proc = report["meta"], report["process"]
+    print(f"{meta['commit'] or 'unknown commit'}  driver={meta['driver']} storage={meta['storage']} "
+          f"concurrency={meta['concurrency']} repeat={meta.get('repeat', 1)}" + (f" workers={meta['workers']}" if meta["driver"] == "http" else ""))
+    print("data: " + ", ".join(f"{k} {v:,}" for k, v in meta["sizes"].items()))
+    print(f"ready in {proc['startup_s']:.2f}s, rss at ready {fmt(proc['rss_ready_mb'], '.1f')} MB, "
+          f"peak rss {fmt(proc['peak_rss_mb'], '.1f')} MB")
+    print(f"{'scenario':34} {'n':>6} {'err':>4} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} {'req/s':>8}")
+    for name, s in report["scenarios"].items():
+        print(f"{name:34} {s['n']:6d} {s['errors']:4d} {fmt(s['p50_ms'])} {fmt(s['p90_ms'])} {fmt(s['p99_ms'])} "
+              f"{fmt(s['max_ms'])} {fmt(s['rps'], '8.1f')}")
+
+
+def compare(old, new, threshold, min_ms):
+    """Print per-scenario changes from report `old` to `new`; the list of regressions."""
+    regressions = []
+    for key in ("driver", "storage", "sizes", "concurrency", "requests", "repeat", "seed", "cpus"):
+        if old["meta"].get(key) != new["meta"].get(key):
+            print(f"warning: {key} differs ({old['meta'].get(key)} vs {new['meta'].get(key)}), results may not be comparable")
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    print(f"{'scenario':34} {'p50 ms':>17} {'p90 ms':>17} {'p99 ms':>17} {'req/s':>17}")
+
+    def change(a, b, field):
+        """(cell text, regressed?) of one statistic; p99 is shown but too noisy to judge."""
+        if a is None or b is None:
+            return "-", False
+        if field == "rps":  # judged by the time per request it implies
+            worse = b < a / (1 + threshold) and (1000 / b - 1000 / a if b else min_ms) >= min_ms
+        elif field.endswith("_ms"):
+            worse = field != "p99_ms" and b > a * (1 + threshold) and b - a >= min_ms
+        elif field == "startup_s":
+            worse = b > a * (1 + threshold) and b - a >= STARTUP_NOISE_S
+        else:
+            worse = b > a * (1 + threshold)
+        pct = (b - a) / a * 100 if a else 0.0
+        return f"{b:8.2f} ({pct:+5.0f}%)", worse
+
+    for name, b in new["scenarios"].items():
+        a = old["scenarios"].get(name)
+        if a is None:
+            print(f"{name:34} (new)")
+            continue
+        cells, bad = [], []
+        for field in ("p50_ms", "p90_ms", "p99_ms", "rps"):
+            text, worse = change(a[field], b[field], field)
+            cells.append(text)
+            if worse:
+                bad.append(field)
+        if b["errors"] > a["errors"]:
+            bad.append("errors")
+        print(f"{name:34} " + " ".join(f"{c:>17}" for c in cells) + ("  REGRESSION: " + ", ".join(bad) if bad else ""))
+        regressions += [f"{name} {f}" for f in bad]
+    for field in ("startup_s", "peak_rss_mb"):
+        a, b = old["process"].get(field), new["process"].get(field)
+        text, worse = change(a, b, field)
+        print(f"{field:34} {text:>17}" + ("  REGRESSION" if worse else ""))
+        if worse:
+            regressions.append(field)
+    return regressions
+
+
+# ---- command line ------------------------------------------------------------
+
+def cmd_generate(args):
+    project = Path(args.project)
+    if project.exists():
+        raise SystemExit(f"{project} already exists")
+    copy_project(project)
+    started = time.perf_counter()
+    manifest = generate(project, sizes_for(args.rows, args.size), args.seed, args.years)
+    print(f"generated in {time.perf_counter() - started:.1f}s into {project}: "
+          + ", ".join(f"{k} {v:,}" for k, v in manifest["sizes"].items()))
+
+
+def cmd_run(args):
+    tmp = None
+    if args.project:
+        project = Path(args.project).resolve()
+        manifest = json.loads((project / MANIFEST).read_text(encoding="utf-8"))
+    else:
+        tmp = tempfile.mkdtemp(prefix="smartshop-bench-")
+        project = Path(tmp) / "project"
+        copy_project(project)
+        manifest = generate(project, sizes_for(args.rows, args.size), args.seed, args.years)
+    try:
+        prepare(project, args.storage)
+        concurrency = args.concurrency or (1 if args.driver == "client" else 8)
+        plan = {"requests": args.requests, "concurrency": concurrency, "repeat": args.repeat, "warmup": not args.no_warmup,
+                "scenarios": [s for s in scenarios(manifest["pools"], manifest["seed"])
+                              if not args.only or any(part in s[0] for part in args.only.split(","))]}
+        if args.driver == "client":
+            plan_path = project / "bench-plan.json"
+            plan_path.write_text(json.dumps(plan), encoding="utf-8")
+            env = {**os.environ, "SMARTSHOP_STORAGE": args.storage, "SMARTSHOP_NOTIFY_INTERVAL": "0"}
+            for k in ("SMARTSHOP_DB", "SMARTSHOP_METRICS_DIR"):
+                env.pop(k, None)
+            out = subprocess.run([sys.executable, "-m", "smartshop.bench", "_client", str(project), str(plan_path)],
+                                 cwd=project, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+            process = json.loads(out.strip().splitlines()[-1])
+        else:
+            process = run_http(project, plan, args.workers, args.storage, args.clients)
+    finally:
+        if tmp and not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+    report = {
+        "meta": {"commit": commit_id(), "date": iso(datetime.datetime.utcnow()), "python": platform.python_version(),
+                 "platform": platform.platform(), "cpus": os.cpu_count(), "driver": args.driver, "storage": args.storage,
+                 "workers": args.workers, "concurrency": concurrency, "requests": args.requests, "repeat": args.repeat,
+                 "seed": manifest["seed"], "sizes": manifest["sizes"]},
+        "process": {k: process[k] for k in ("startup_s", "rss_ready_mb", "peak_rss_mb")},
+        "scenarios": process["scenarios"],
+    }
+    print_report(report)
+    if tmp and args.keep:
+        print(f"project kept at {project}")
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=1), encoding="utf-8")
+    failed = [name for name, s in report["scenarios"].items() if s["errors"]]
+    if failed:
+        print("requests failed in: " + ", ".join(f"{n} ({'/'.join(report['scenarios'][n]['error_statuses'])})" for n in failed))
+        return 1
+    return 0
+
+
+def cmd_compare(args):
+    load = lambda p: json.loads(Path(p).read_text(encoding="utf-8"))
+    regressions = compare(load(args.old), load(args.new), args.threshold, args.min_ms)
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}: " + ", ".join(regressions))
+        return 1
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    def data_args(p):
+        p.add_argument("--rows", type=int, default=1000, help="base size of the data set (default 1000)")
+        p.add_argument("--size", default="", help="per-kind sizes, e.g. reviews=500000,shops=200")
+        p.add_argument("--seed", type=int, default=7, help="random seed of data and requests (default 7)")
+        p.add_argument("--years", type=int, default=3, help="years of sales history (default 3)")
+
+    p = sub.add_parser("generate", help="write a project copy with a synthetic data set")
+    p.add_argument("project", help="directory to create")
+    data_args(p)
+    p.set_defaults(fn=cmd_generate)
+
+    p = sub.add_parser("run", help="benchmark every endpoint")
+    data_args(p)
+    p.add_argument("--project", help="use a project written by `generate` instead of a fresh scratch copy")
+    p.add_argument("--driver", default="client", choices=("client", "http"), help="Flask test client or gunicorn over HTTP")
+    p.add_argument("--storage", default="json", choices=("json", "sqlite"), help="record store backend")
+    p.add_argument("--requests", type=int, default=200, help="requests per scenario (default 200)")
+    p.add_argument("--concurrency", type=int, help="concurrent requests (default 1 with the test client, 8 over HTTP)")
+    p.add_argument("--repeat", type=int, default=3, help="measured rounds per scenario; the median is reported (default 3)")
+    p.add_argument("--no-warmup", action="store_true", help="measure the first requests too (cold caches)")
+    p.add_argument("--workers", type=int, default=4, help="gunicorn workers for --driver http (default 4)")
+    p.add_argument("--clients", type=int, default=4, help="client processes for --driver http (default 4)")
+    p.add_argument("--only", help="comma-separated substrings of the scenarios to run")
+    p.add_argument("--out", help="write the report as JSON (for compare)")
+    p.add_argument("--keep", action="store_true", help="keep the scratch project")
+    p.set_defaults(fn=cmd_run)
+
+    p = sub.add_parser("compare", help="compare two --out reports")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.2, help="relative slowdown counted as a regression (default 0.2)")
+    p.add_argument("--min-ms", type=float, default=0.5, help="ignore latency changes smaller than this (default 0.5)")
+    p.set_defaults(fn=cmd_compare)
+
+    p = sub.add_parser("_client")  # the test-client driver's child process
+    p.add_argument("project")
+    p.add_argument("plan")
+    p.set_defaults(fn=lambda args: run_client(Path(args.project), args.plan))
+
+    args = ap.parse_args(argv)
+    return args.fn(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import copy, threading
+
+import numpy as np
+
+from .columnar import as_table, open_snapshot
+from .filecache import JsonFileIndex
+from .metrics import span, timed
+from .text import normalize, tokenize
+
+# Numeric specs that get a sorted array for range queries
+RANGE_FIELDS = ("price", "ram_gb", "storage_gb", "rating")
+
+# Fields the `q` text search covers
+SEARCH_FIELDS = ("brand", "model")
+
+# sort name -> (field, descending)
+SORTS = {
+    "price_asc": ("price", False),
+    "price_desc": ("price", True),
+    "rating_desc": ("rating", True),
+}
+
+
+def _num(p, field):
+    return p.get(field) or 0
+
+
+def reorder(order, key, changed):
+    """
+    `order` (positions sorted by an old key, ties by position) sorted by
+    the new `key` array, when only the positions in `changed` have a new
+    key: they are taken out and inserted back by binary search, so the
+    cost is a copy of `order` rather than a sort.
+    """
+    changed = np.unique(np.asarray(changed, dtype=np.intp))
+    if not len(changed):
+        return order
+    keep = order[~np.isin(order, changed)]
+    kept = key[keep]
+    moved = changed[np.argsort(key[changed], kind="stable")]
+    at = np.searchsorted(kept, key[moved], side="left")
+    end = np.searchsorted(kept, key[moved], side="right")
+    for j in np.flatnonzero(end > at):
+        at[j] += np.searchsorted(keep[at[j]:end[j]], moved[j])  # ties in catalog order
+    return np.insert(keep, at, moved)
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of one version of a phones.json file plus its indexes:
+      - by_id:    id -> position
+      - by_brand: normalized brand -> [positions]
+      - sorted value arrays per RANGE_FIELDS for range lookups
+      - search:   SearchIndex over brand/model for `q`
+    `phones` is a table (see smartshop/columnar.py): the parsed JSON
+    records, or a memory-mapped columnar snapshot of them.
+    """
+
+    def __init__(self, phones, version):
+        self.phones = phones = as_table(phones)
+        self.version = version
+        self.by_id = phones.lookup("id")
+        codes, brands = phones.factorize("brand")
+        names = [normalize(b) for b in brands]
+        self._brand_group = {b: g for g, b in enumerate(dict.fromkeys(names))}
+        # normalized-brand group of every phone
+        self._brands = np.array([self._brand_group[b] for b in names], dtype=np.int32)[codes]
+        order = np.argsort(self._brands, kind="stable")
+        bounds = np.searchsorted(self._brands[order], np.arange(len(self._brand_group) + 1))
+        self.by_brand = {b: order[bounds[g]:bounds[g + 1]] for b, g in self._brand_group.items()}
+        self.search = phones.search_index(SEARCH_FIELDS)
+
+        self._values = {}
+        self._sorted = {}
+        for field in RANGE_FIELDS:
+            vals = phones.numbers(field)
+            order = np.argsort(vals, kind="stable")
+            self._values[field] = vals
+            self._sorted[field] = (vals[order], order)
+        self._orders = {}
+        self._orders_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.phones)
+
+    def with_values(self, phones, field, values, changed, version):
+        """
+        A snapshot of `phones` (this snapshot's records with numeric `field`
+        set to `values`, which differ from this snapshot's at `changed`
+        positions only). Every other index is shared; the sorted arrays of
+        `field` are repaired in place of a rebuild.
+        """
+        snap = copy.copy(self)
+        snap.phones, snap.version = phones, version
+        snap._values = {**self._values, field: values}
+        if field in self._sorted:
+            order = reorder(self._sorted[field][1], values, changed)
+            snap._sorted = {**self._sorted, field: (values[order], order)}
+        orders = {}
+        for sort, order in list(self._orders.items()):
+            name, desc = SORTS[sort]
+            orders[sort] = order if name != field else reorder(order, -values if desc else values, changed)
+        snap._orders = orders
+        snap._orders_lock = threading.Lock()
+        return snap
+
+    def get(self, pid):
+        i = self.by_id.get(pid)
+        return self.phones[i] if i is not None else None
+
+    def column(self, field):
+        """Float array of a RANGE_FIELDS field, by position."""
+        return self._values[field]
+
+    def value(self, field, i):
+        vals = self._values.get(field)
+        return vals[i] if vals is not None else _num(self.phones[i], field)
+
+    def range_positions(self, field, lo=None, hi=None):
+        """Positions whose `field` lies in [lo, hi] (either bound optional), via binary search."""
+        vals, order = self._sorted[field]
+        a = np.searchsorted(vals, lo, side="left") if lo is not None else 0
+        b = np.searchsorted(vals, hi, side="right") if hi is not None else len(vals)
+        return order[a:b]
+
+    def sort_key(self, sort=None, ranked=False):
+        """
+        key() matching the order query() returns, for paging.paginate():
+        [value, position] for a sort, [position] for catalog order, None
+        for relevance-ranked text matches.
+        """
+        pos = lambda p: self.by_id.get(p.get("id"), -1)
+        if sort in SORTS:
+            field, desc = SORTS[sort]
+            sign = -1 if desc else 1
+            return lambda p: [sign * _num(p, field), pos(p)]
+        if ranked:
+            return None
+        return lambda p: [pos(p)]
+
+    def _sorted_order(self, sort):
+        # Full-catalog ordering for a sort key, computed once per snapshot
+        order = self._orders.get(sort)
+        if order is None:
+            with self._orders_lock:
+                order = self._orders.get(sort)
+                if order is None:
+                    order = self._order(np.arange(len(self.phones)), sort)
+                    self._orders[sort] = order
+        return order
+
+    @timed("catalog.sort")
+    def _order(self, positions, sort):
+        field, desc = SORTS[sort]
+        vals = self._values[field][positions]
+        # by value, ties in catalog order
+        return positions[np.lexsort((positions, -vals if desc else vals))]
+
+    def query(self, q="", brand="", model_id=None, min_price=None, max_price=None,
+              ram_min=None, storage_min=None, sort=None):
+        """Filtered/sorted list of phones; see positions()."""
+        return [self.phones[i] for i in self.positions(
+            q=q, brand=brand, model_id=model_id, min_price=min_price, max_price=max_price,
+            ram_min=ram_min, storage_min=storage_min, sort=sort)]
+
+    @timed("catalog.query")
+    def positions(self, q="", brand="", model_id=None, min_price=None, max_price=None,
+                  ram_min=None, storage_min=None, sort=None):
+        """
+        Catalog positions of the filtered/sorted phones. `brand` must already be normalized.
+        Candidates come from the most selective index (text search, id,
+        brand or the narrowest numeric range); the remaining predicates are
+        checked on those candidates at once, with array masks. Without
+        `sort`, text matches are ranked by relevance; otherwise catalog
+        order is kept.
+        """
+        ranges = {}
+        if min_price is not None or max_price is not None:
+            ranges["price"] = (min_price, max_price)
+        if ram_min is not None:
+            ranges["ram_gb"] = (ram_min, None)
+        if storage_min is not None:
+            ranges["storage_gb"] = (storage_min, None)
+
+        candidates = None
+        driver = None
+        if tokenize(q):
+            with span("catalog.search"):
+                candidates, driver = [i for i, _ in self.search.search(q)], "q"
+        elif model_id:
+            i = self.by_id.get(model_id)
+            candidates = [i] if i is not None else []
+        elif brand:
+            candidates = self.by_brand.get(brand, [])
+        if driver is None:
+            for field, (lo, hi) in ranges.items():
+                pos = self.range_positions(field, lo, hi)
+                if candidates is None or len(pos) < len(candidates):
+                    candidates, driver = pos, field
+
+        filtered = candidates is not None
+        if sort in SORTS and not filtered:
+            candidates = self._sorted_order(sort)
+        elif candidates is None:
+            candidates = np.arange(len(self.phones))
+        positions = np.asarray(candidates, dtype=np.intp)
+
+        keep = np.ones(len(positions), dtype=bool)
+        if model_id:
+            keep &= positions == self.by_id.get(model_id, -1)
+        if brand:
+            keep &= self._brands[positions] == self._brand_group.get(brand, -1)
+        for field, (lo, hi) in ranges.items():
+            if field == driver:
+                continue
+            v = self._values[field][positions]
+            if lo is not None:
+                keep &= v >= lo
+            if hi is not None:
+                keep &= v <= hi
+        positions = positions[keep]
+
+        if sort in SORTS and filtered:
+            positions = self._order(positions, sort)
+        elif sort not in SORTS and driver in ranges:
+            positions = np.sort(positions)  # keep catalog order
+        return positions.tolist()
+
+
+class PhoneCatalog(JsonFileIndex):
+    """
+    phones.json loaded once and re-indexed only when the file changes.
+    When an up-to-date columnar snapshot (phones.cols, see
+    smartshop/columnar.py) sits next to it, that is memory-mapped instead.
+    """
+
+    def load(self):
+        table = open_snapshot(self.path)
+        return table if table is not None else super().load()
+
+    def build(self, records, version):
+        return CatalogSnapshot(records, version)
+
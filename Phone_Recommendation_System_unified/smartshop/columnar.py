@@ -0,0 +1,540 @@
+"""
+Columnar binary snapshots of the phone catalogs (phonefinder, comparephone).
+
+    python -m smartshop.columnar                  # compile every catalog next to its phones.json
+    python -m smartshop.columnar a/phones.json    # or just the given files
+    python -m smartshop.columnar --bench 200000   # cold start and RSS, JSON vs snapshot
+
+`phones.json` compiles to `phones.cols`: one array per field (int64 or
+float64 for numbers, int32 codes into a sorted table of interned strings
+for text, JSON-encoded values for anything else) plus a presence mask for
+fields that some records lack. The file is memory-mapped read-only, so
+the arrays are never copied onto the heap and every worker process shares
+the same page-cache pages; a record only becomes a dict when a response
+needs it.
+
+A snapshot records the SHA-1 of the JSON it was compiled from and is
+ignored (with a warning) once the JSON changes, so a stale snapshot never
+hides an edit. SMARTSHOP_CATALOG_FORMAT=json ignores snapshots altogether.
+
+Catalog code reads records through the table API shared by RecordTable
+(a list of dicts, the JSON path) and ColumnarTable:
+
+    len(t), t[i], iter(t)   records as dicts
+    t.value(field, i)       one field of one record (None if absent)
+    t.numbers(field)        float64 array, 0 where missing or not a number
+    t.factorize(field)      (codes, values): values[codes[i]] is record i's value
+    t.lookup(field)         mapping value -> first position holding it
+    t.select(fields)        iterator of dicts holding just `fields`
+    t.search_index(fields)  SearchIndex over `fields` (snapshots store theirs
+                            prebuilt, see search.FrozenSearchIndex)
+"""
+from pathlib import Path
+import argparse, hashlib, json, os, sys, time
+
+import numpy as np
+
+from .search import FrozenSearchIndex, SearchIndex
+
+MAGIC = b"SSCOLS1\n"
+ALIGN = 64
+SUFFIX = ".cols"
+
+ROOT = Path(__file__).resolve().parent.parent
+CATALOGS = (ROOT / "phonefinder" / "static" / "phones.json", ROOT / "comparephone" / "static" / "phones.json")
+
+DTYPES = {"int": "<i8", "float": "<f8", "str": "<i4", "json": "<i4"}
+
+
+def catalog_format():
+    fmt = (os.environ.get("SMARTSHOP_CATALOG_FORMAT") or "auto").strip().lower()
+    if fmt not in ("auto", "json"):
+        raise ValueError(f"unknown SMARTSHOP_CATALOG_FORMAT: {fmt}")
+    return fmt
+
+
+def snapshot_path(json_path):
+    return Path(json_path).with_suffix(SUFFIX)
+
+
+def _number(v):
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return float(v)
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RecordTable:
+    """The table API over a list of record dicts (catalogs loaded from JSON)."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def value(self, field, i):
+        return self.records[i].get(field)
+
+    def numbers(self, field):
+        return np.array([_number(r.get(field)) for r in self.records], dtype=float)
+
+    def factorize(self, field):
+        seen, values = {}, []
+        codes = np.empty(len(self.records), dtype=np.int32)
+        for i, r in enumerate(self.records):
+            v = r.get(field)
+            key = json.dumps(v, sort_keys=True) if isinstance(v, (dict, list)) else v
+            c = seen.get(key)
+            if c is None:
+                c = seen[key] = len(values)
+                values.append(v)
+            codes[i] = c
+        return codes, values
+
+    def lookup(self, field):
+        index = {}
+        for i, r in enumerate(self.records):
+            index.setdefault(r.get(field), i)
+        return index
+
+    def select(self, fields):
+        return iter(self.records)
+
+    def search_index(self, fields):
+        index = SearchIndex(fields)
+        for i, rec in enumerate(self.records):
+            index.add(i, rec)
+        return index
+
+
+class OverlayTable:
+    """
+    The table API over another table with some fields replaced for some
+    records: where mask[i] is set, record i has field f = columns[f][i].
+    Building one copies nothing from `base`, so a catalog can change a
+    few records' ratings without re-reading (or un-mapping) the rest.
+    """
+
+    def __init__(self, base, columns, mask):
+        self.base = base
+        self.columns = columns
+        self.mask = mask
+
+    def __len__(self):
+        return len(self.base)
+
+    def _patch(self, i, rec, fields=None):
+        if not self.mask[i]:
+            return rec
+        return {**rec, **{f: col[i].item() for f, col in self.columns.items() if fields is None or f in fields}}
+
+    def __getitem__(self, i):
+        return self._patch(i, self.base[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def value(self, field, i):
+        col = self.columns.get(field)
+        return col[i].item() if col is not None and self.mask[i] else self.base.value(field, i)
+
+    def numbers(self, field):
+        col = self.columns.get(field)
+        base = self.base.numbers(field)
+        return base if col is None else np.where(self.mask, col, base).astype(float)
+
+    def factorize(self, field):
+        if field in self.columns:
+            return RecordTable(list(self.select([field]))).factorize(field)
+        return self.base.factorize(field)
+
+    def lookup(self, field):
+        if field in self.columns:
+            return RecordTable(list(self.select([field]))).lookup(field)
+        return self.base.lookup(field)
+
+    def select(self, fields):
+        return (self._patch(i, rec, fields) for i, rec in enumerate(self.base.select(fields)))
+
+    def search_index(self, fields):
+        if any(f in self.columns for f in fields):
+            return RecordTable(list(self.select(fields))).search_index(fields)
+        return self.base.search_index(fields)
+
+
+def as_table(records):
+    """`records` as a table: tables as is, a list of dicts wrapped in RecordTable."""
+    return records if isinstance(records, (RecordTable, ColumnarTable, OverlayTable)) else RecordTable(records)
+
+
+def _kind(values):
+    if all(type(v) is int for v in values):
+        return "int" if all(-2 ** 63 <= v < 2 ** 63 for v in values) else "json"
+    if all(type(v) in (int, float) for v in values):
+        # ints stored as float64 must survive the round trip
+        return "float" if all(type(v) is float or abs(v) <= 2 ** 53 for v in values) else "json"
+    if all(type(v) is str for v in values):
+        return "str"
+    return "json"
+
+
+def _pad(n):
+    return -n % ALIGN
+
+
+def write_snapshot(records, out_path, source_sha1=None, search_fields=()):
+    """
+    Compile a list of record dicts into a columnar snapshot at out_path
+    (written atomically), with the SearchIndex postings over
+    `search_fields` if any are given.
+    """
+    if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+        raise ValueError("a catalog must be a JSON list of objects")
+    n = len(records)
+    postings = RecordTable(records).search_index(search_fields).arrays() if search_fields else None
+    fields = list(dict.fromkeys(k for r in records for k in r))
+    kinds = {}
+    interned = set()
+    for f in fields:
+        kinds[f] = kind = _kind([r[f] for r in records if f in r])
+        if kind == "str":
+            interned.update(r[f] for r in records if f in r)
+        elif kind == "json":
+            interned.update(json.dumps(r[f], ensure_ascii=False) for r in records if f in r)
+    if postings:
+        interned.update(postings[0])
+    strings = sorted(interned)
+    code = {s: c for c, s in enumerate(strings)}
+    blobs = [s.encode("utf-8") for s in strings]
+
+    chunks, offset = [], 0
+
+    def add(arr):
+        nonlocal offset
+        data = np.ascontiguousarray(arr).tobytes()
+        at = offset
+        chunks.append(data + b"\0" * _pad(len(data)))
+        offset += len(data) + _pad(len(data))
+        return at
+
+    columns = []
+    for f in fields:
+        kind = kinds[f]
+        present = np.array([f in r for r in records], dtype=np.uint8)
+        col = {"name": f, "kind": kind, "present": None, "ints": None}
+        if kind == "int":
+            arr = np.array([r.get(f, 0) for r in records], dtype=DTYPES[kind])
+        elif kind == "float":
+            arr = np.array([r.get(f, 0) for r in records], dtype=DTYPES[kind])
+            ints = np.array([type(r.get(f)) is int for r in records], dtype=np.uint8)
+            if ints.any():
+                col["ints"] = add(ints)
+        elif kind == "str":
+            arr = np.array([code[r[f]] if f in r else -1 for r in records], dtype=DTYPES[kind])
+        else:
+            arr = np.array([code[json.dumps(r[f], ensure_ascii=False)] if f in r else -1 for r in records],
+                           dtype=DTYPES[kind])
+        col["offset"] = add(arr)
+        if not present.all():
+            col["present"] = add(present)
+        columns.append(col)
+    search = None
+    if postings:
+        terms, offsets, docs, tfs, doc_len = postings
+        search = {"fields": list(search_fields), "count": len(terms),
+                  "terms": add(np.array([code[t] for t in terms], dtype="<i4")), "offsets": add(offsets.astype("<i8")),
+                  "postings": len(docs), "docs": add(docs.astype("<i4")), "tfs": add(tfs.astype("<i4")),
+                  "doc_len": add(doc_len.astype("<i4"))}
+    ends = np.cumsum([0] + [len(b) for b in blobs], dtype=np.int64)
+    table = {"count": len(strings), "offsets": add(ends), "data": add(np.frombuffer(b"".join(blobs), dtype=np.uint8))}
+
+    header = json.dumps({"format": 1, "rows": n, "source_sha1": source_sha1,
+                         "columns": columns, "strings": table, "search": search}).encode("utf-8")
+    prefix = MAGIC + len(header).to_bytes(8, "little") + header
+    out_path = Path(out_path)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(prefix + b"\0" * _pad(len(prefix)))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def compile_catalog(json_path, out_path=None):
+    """Compile a phones.json into its snapshot (default: next to it, as phones.cols)."""
+    from .catalog import SEARCH_FIELDS
+    data = Path(json_path).read_bytes()
+    records = json.loads(data.decode("utf-8"))
+    return write_snapshot(records, out_path or snapshot_path(json_path), hashlib.sha1(data).hexdigest(), SEARCH_FIELDS)
+
+
+class CodeIndex:
+    """Read-only mapping string -> first position, over an interned string column."""
+
+    def __init__(self, table, codes):
+        self.table = table
+        self.codes, self.first = np.unique(codes[codes >= 0], return_index=True)
+        self.first = np.flatnonzero(codes >= 0)[self.first]
+
+    def get(self, key, default=None):
+        c = self.table.code(key) if isinstance(key, str) else None
+        if c is None:
+            return default
+        j = np.searchsorted(self.codes, c)
+        return int(self.first[j]) if j < len(self.codes) and self.codes[j] == c else default
+
+    def __getitem__(self, key):
+        i = self.get(key)
+        if i is None:
+            raise KeyError(key)
+        return i
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        return (self.table.string(c) for c in self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+class _Strings:
+    """Sequence of interned strings by code, decoded on access (for bisect)."""
+
+    def __init__(self, table, codes):
+        self.table = table
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.table.string(self.codes[i])
+
+
+class ColumnarTable:
+    """The table API over a memory-mapped snapshot file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a catalog snapshot")
+            size = int.from_bytes(f.read(8), "little")
+            self.header = json.loads(f.read(size).decode("utf-8"))
+        start = len(MAGIC) + 8 + size
+        start += _pad(start)
+        # plain ndarray views of the mapping: np.memmap's own indexing is slow per element
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode="r").view(np.ndarray)
+        self.rows = self.header["rows"]
+
+        def array(offset, dtype, count):
+            if offset is None:
+                return None
+            dtype = np.dtype(dtype)
+            return self._mm[start + offset:start + offset + count * dtype.itemsize].view(dtype)
+
+        self.fields = [c["name"] for c in self.header["columns"]]
+        self.columns = {}
+        for c in self.header["columns"]:
+            self.columns[c["name"]] = (c["kind"], array(c["offset"], DTYPES[c["kind"]], self.rows),
+                                       array(c["present"], np.uint8, self.rows), array(c["ints"], np.uint8, self.rows))
+        self._array = array
+        table = self.header["strings"]
+        ends = array(table["offsets"], "<i8", table["count"] + 1)
+        # memoryviews index to Python ints/bytes without numpy scalar overhead
+        self._ends = memoryview(ends).cast("B").cast("q")
+        self._blob = memoryview(array(table["data"], np.uint8, ends[-1]))
+
+    def string(self, c):
+        return str(self._blob[self._ends[c]:self._ends[c + 1]], "utf-8")
+
+    def code(self, s):
+        """Code of string `s` in the interned table, or None (binary search; UTF-8 bytes sort like str)."""
+        key = s.encode("utf-8")
+        blob, ends = self._blob, self._ends
+        lo, hi = 0, len(ends) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if blob[ends[mid]:ends[mid + 1]].tobytes() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(ends) - 1 and blob[ends[lo]:ends[lo + 1]] == key:
+            return lo
+        return None
+
+    def __len__(self):
+        return self.rows
+
+    def _get(self, kind, arr, ints, i):
+        if kind == "int":
+            return int(arr[i])
+        if kind == "float":
+            return int(arr[i]) if ints is not None and ints[i] else float(arr[i])
+        s = self.string(arr[i])
+        return s if kind == "str" else json.loads(s)
+
+    def value(self, field, i):
+        col = self.columns.get(field)
+        if col is None:
+            return None
+        kind, arr, present, ints = col
+        if present is not None and not present[i]:
+            return None
+        return self._get(kind, arr, ints, i)
+
+    def _record(self, i, fields):
+        rec = {}
+        for f in fields:
+            kind, arr, present, ints = self.columns[f]
+            if present is None or present[i]:
+                rec[f] = self._get(kind, arr, ints, i)
+        return rec
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.rows
+        if not 0 <= i < self.rows:
+            raise IndexError(i)
+        return self._record(i, self.fields)
+
+    def __iter__(self):
+        return (self._record(i, self.fields) for i in range(self.rows))
+
+    def select(self, fields):
+        fields = [f for f in fields if f in self.columns]
+        if not all(self.columns[f][0] == "str" and self.columns[f][2] is None for f in fields):
+            return (self._record(i, fields) for i in range(self.rows))
+        # all plain text: decode straight from the code columns
+        string = self.string
+        codes = [self.columns[f][1] for f in fields]
+        return ({f: string(c[i]) for f, c in zip(fields, codes)} for i in range(self.rows))
+
+    def search_index(self, fields):
+        search = self.header.get("search")
+        if not search or search["fields"] != list(fields):
+            return RecordTable(list(self.select(fields))).search_index(fields)
+        array, n = self._array, search["count"]
+        return FrozenSearchIndex(_Strings(self, memoryview(array(search["terms"], "<i4", n)).cast("B").cast("i")),
+                                 array(search["offsets"], "<i8", n + 1), array(search["docs"], "<i4", search["postings"]),
+                                 array(search["tfs"], "<i4", search["postings"]), array(search["doc_len"], "<i4", self.rows))
+
+    def numbers(self, field):
+        kind, arr, present, _ = self.columns.get(field) or (None, None, None, None)
+        if kind == "float":
+            return arr  # missing values were written as 0; a read-only view of the mapped file
+        if kind == "int":
+            return arr.astype(float)
+        if kind is None:
+            return np.zeros(self.rows)
+        return np.array([_number(self.value(field, i)) for i in range(self.rows)], dtype=float)
+
+    def factorize(self, field):
+        kind, arr, present, _ = self.columns.get(field) or (None, None, None, None)
+        if kind is None:
+            return np.zeros(self.rows, dtype=np.int32), [None]
+        if kind != "str":
+            return RecordTable(list(self.select([field]))).factorize(field)
+        uniq, codes = np.unique(arr, return_inverse=True)
+        return codes.astype(np.int32), [self.string(c) if c >= 0 else None for c in uniq]
+
+    def lookup(self, field):
+        kind, arr, _, _ = self.columns.get(field) or (None, None, None, None)
+        if kind == "str":
+            return CodeIndex(self, arr)
+        return RecordTable(list(self.select([field]))).lookup(field)
+
+
+def open_snapshot(json_path):
+    """
+    ColumnarTable for a JSON catalog, if it has an up-to-date snapshot and
+    SMARTSHOP_CATALOG_FORMAT allows it; otherwise None (load the JSON).
+    """
+    path = snapshot_path(json_path)
+    if catalog_format() == "json" or not path.exists():
+        return None
+    try:
+        table = ColumnarTable(path)
+    except (OSError, ValueError) as e:
+        print(f"smartshop: ignoring unreadable {path}: {e}", file=sys.stderr)
+        return None
+    if table.header.get("source_sha1") != hashlib.sha1(Path(json_path).read_bytes()).hexdigest():
+        print(f"smartshop: ignoring stale {path} (rebuild with python -m smartshop.columnar)", file=sys.stderr)
+        return None
+    return table
+
+
+_BENCH = r"""
+import json, os, sys, time
+sys.path.insert(0, %(root)r)
+import numpy, flask
+from smartshop.rank import RankedCatalog, parse_weights
+
+def rss():
+    status = dict(line.split(":", 1) for line in open("/proc/self/status") if ":" in line)
+    return {k: int(status[k].split()[0]) // 1024 for k in ("VmRSS", "RssAnon", "RssFile") if k in status}
+
+before = rss()
+started = time.perf_counter()
+snap = RankedCatalog(%(path)r).get()
+ready = time.perf_counter() - started
+snap.query(brand="samsung", max_price=40000, sort="price_asc")
+snap.engine.rank(snap.positions(ram_min=8), parse_weights(None), 10)
+after = rss()
+print(json.dumps({"backend": type(snap.phones).__name__, "rows": len(snap), "ready_s": round(ready, 3),
+                  "first_query_s": round(time.perf_counter() - started - ready, 3),
+                  "rss_mb": after["VmRSS"] - before["VmRSS"], "anon_mb": after.get("RssAnon", 0) - before.get("RssAnon", 0),
+                  "file_mb": after.get("RssFile", 0) - before.get("RssFile", 0)}))
+"""
+
+
+def bench(rows, workdir=None):
+    """
+    Time a fresh process loading a synthetic catalog of `rows` phones as
+    JSON and as a snapshot, and report its memory growth (anon = private
+    heap, file = mapped pages shareable between workers; Linux only).
+    """
+    import random, subprocess, tempfile
+    from .bench import gen_phones
+    phones = gen_phones(rows, random.Random(7))
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        path = Path(tmp) / "phones.json"
+        path.write_text(json.dumps(phones, indent=2), encoding="utf-8")
+        started = time.perf_counter()
+        compile_catalog(path)
+        print(f"{rows:,} phones: json {path.stat().st_size / 2 ** 20:.1f} MB, snapshot "
+              f"{snapshot_path(path).stat().st_size / 2 ** 20:.1f} MB, compiled in {time.perf_counter() - started:.2f}s")
+        for fmt in ("json", "auto"):
+            env = {**os.environ, "SMARTSHOP_CATALOG_FORMAT": fmt}
+            out = subprocess.run([sys.executable, "-c", _BENCH % {"root": str(ROOT), "path": str(path)}],
+                                 env=env, capture_output=True, text=True, check=True).stdout
+            print(out.strip())
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("paths", nargs="*", help="phones.json files (default: the phonefinder and comparephone catalogs)")
+    ap.add_argument("--bench", type=int, metavar="ROWS", help="benchmark a synthetic catalog of ROWS phones instead")
+    args = ap.parse_args(argv)
+    if args.bench:
+        bench(args.bench)
+        return
+    for json_path in args.paths or CATALOGS:
+        out = compile_catalog(json_path)
+        print(f"{json_path}: {ColumnarTable(out).rows} phones written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""
+Launch-day notification fan-out (upcomingphone).
+
+Reminder requests (the `notifications` store, one record per subscriber
+and phone) are acted on when the phone's pre_order_date or release_date
+arrives. A LaunchScheduler thread looks for due events every `interval`
+seconds and hands each one ("UP001:release:2025-10-01") to a Dispatcher,
+which reads the phone's subscribers from the store in batches (by
+phone_id, in subscription order) and sends every batch through a bounded
+pool of threads, retrying failed sends with exponential backoff.
+
+Progress is checkpointed per batch in the `dispatches` store as the sort
+key (created_at, id) of the last subscriber handled, and the next batch is
+read past it (keyset paging), so a restarted process resumes where the last
+one stopped and people who subscribe after an event went out are picked up
+on the next run while the event is within `lookback` days. Subscriptions
+younger than SETTLE_S are left for the next run, so a write that was still
+in flight when a batch was read is not skipped. Every message carries an
+idempotency key (event + contact): the Dispatcher remembers the contacts
+it notified for each event still within `lookback` (someone who signed up
+twice is notified once) and the sender drops repeats sent since the last
+checkpoint (a replayed batch).
+
+Only one process at a time runs the scheduler (a non-blocking flock on
+its lock file, POSIX), and request workers never send anything
+themselves: a launch with 100k subscribers costs them nothing.
+
+    SMARTSHOP_NOTIFY_SENDER       sender name in SENDERS (default outbox)
+    SMARTSHOP_NOTIFY_OUTBOX       outbox file for the outbox sender (default <data dir>/outbox.jsonl)
+    SMARTSHOP_NOTIFY_CONCURRENCY  sends in flight at once (default 8)
+    SMARTSHOP_NOTIFY_BATCH        subscribers per batch and checkpoint (default 1000)
+    SMARTSHOP_NOTIFY_RETRIES      retries of a failed send (default 3)
+    SMARTSHOP_NOTIFY_INTERVAL     seconds between scheduler runs (default 60; 0 = no thread)
+    SMARTSHOP_NOTIFY_LOOKBACK     days after its date an event is still dispatched (default 7)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import datetime, json, os, threading, time, traceback
+
+from .text import normalize
+
+try:
+    import fcntl  # cross-process locking (POSIX only)
+except ImportError:
+    fcntl = None
+
+SENDERS = {}
+
+# Last send errors kept on a dispatch record
+MAX_ERRORS = 10
+
+# Subscriptions younger than this (seconds) wait for the next run
+SETTLE_S = 5
+
+
+def register_sender(name):
+    def deco(cls):
+        SENDERS[name] = cls
+        return cls
+    return deco
+
+
+@register_sender("outbox")
+class OutboxSender:
+    """
+    Appends messages as JSON lines to a local outbox file (for tests and
+    demos, or for a relay that forwards them). The idempotency keys written
+    since the last checkpoint are remembered, including lines written by
+    other processes, and a message whose key is among them is skipped.
+
+    Senders implement send(message) -> True if sent, False if it was a
+    repeat (raising on failure, which is retried); flush(), called before a
+    batch is checkpointed, which returns a JSON-able mark saved with the
+    checkpoint (here the outbox size); and optionally resume(mark), called
+    before an event is dispatched with the mark of its last checkpoint.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.fsync = fsync
+        self._keys = set()
+        self._offset = None
+        self._lock = threading.Lock()
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def _catch_up(self):
+        size = self._size()
+        if self._offset is None:
+            self._offset = size  # nothing to replay before the first checkpoint
+        if size < self._offset:
+            self._keys, self._offset = set(), 0  # truncated (or rotated) by the relay
+        if size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if line.strip():
+                self._keys.add(json.loads(line).get("idempotency_key"))
+        self._offset += end
+
+    def _locked(self, fn):
+        with self._lock:
+            fd = None
+            if fcntl is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                return fn()
+            finally:
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+
+    def resume(self, mark):
+        """Forget the keys held so far and reread the ones written after `mark`."""
+        def reset():
+            self._keys = set()
+            self._offset = mark if isinstance(mark, int) and 0 <= mark <= self._size() else None
+            self._catch_up()
+        self._locked(reset)
+
+    def send(self, message):
+        key = message["idempotency_key"]
+
+        def append():
+            self._catch_up()
+            if key in self._keys:
+                return False
+            line = json.dumps({**message, "sent_at": datetime.datetime.utcnow().isoformat() + "Z"},
+                              ensure_ascii=False).encode("utf-8") + b"\n"
+            out = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(out, line)
+            finally:
+                os.close(out)
+            self._offset += len(line)
+            self._keys.add(key)
+            return True
+        return self._locked(append)
+
+    def flush(self):
+        if self.fsync and self.path.exists():
+            fd = os.open(self.path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        def checkpoint():
+            # everything up to here is covered by the checkpoint being written
+            self._catch_up()
+            self._keys = set()
+            return self._offset
+        return self._locked(checkpoint)
+
+
+def event_id(phone_id, kind, date):
+    return f"{phone_id}:{kind}:{date}"
+
+
+def compose(phone, kind, date, sub):
+    """The message for one subscriber of a phone's launch event."""
+    name = f"{phone.get('brand', '')} {phone.get('model', '')}".strip() or phone.get("id")
+    event = event_id(phone.get("id"), kind, date)
+    contact = (sub.get("contact") or "").strip()
+    if kind == "pre_order":
+        subject = f"Pre-orders for the {name} open today"
+    else:
+        subject = f"The {name} is out today"
+    greeting = f"Hi {sub['name']}, " if sub.get("name") else ""
+    return {
+        "idempotency_key": f"{event}:{normalize(contact)}",
+        "event": event,
+        "kind": kind,
+        "phone_id": phone.get("id"),
+        "subscription_id": sub.get("id"),
+        "to": contact,
+        "subject": subject,
+        "body": f"{greeting}you asked us to remind you: {subject[0].lower()}{subject[1:]} ({date}).",
+    }
+
+
+class Dispatcher:
+    """Sends one launch event to all of a phone's subscribers, in checkpointed batches."""
+
+    def __init__(self, subscriptions, dispatches, sender, concurrency=8, batch=1000, retries=3,
+                 backoff=0.5, sleep=time.sleep, settle=SETTLE_S):
+        self.subscriptions = subscriptions
+        self.dispatches = dispatches
+        self.sender = sender
+        self.concurrency = concurrency
+        self.batch = batch
+        self.retries = retries
+        self.backoff = backoff
+        self.settle = settle
+        self._sleep = sleep
+        self._executor = None
+        self._pid = None
+        self._seen = {}  # event id -> (checkpoint, normalized contacts notified up to it)
+
+    def _pool(self):
+        # created on first use, so processes forked after import get their own threads
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="smartshop-notify")
+            self._pid = os.getpid()
+        return self._executor
+
+    def _page(self, pid, after, limit, upto):
+        """Subscribers of `pid` past the sort key `after`, created no later than `upto`."""
+        return self.subscriptions.find(eq={"phone_id": pid}, le={"created_at": upto}, order_by="created_at",
+                                       limit=limit, after=after)
+
+    def _contacts(self, eid, pid, after, upto):
+        """
+        The normalized contacts already notified for an event, i.e. of its
+        subscribers up to the sort key `after`; kept per event and caught up
+        with checkpoints written by other processes.
+        """
+        key, seen = self._seen.get(eid) or (None, set())
+        while after is not None and (key is None or key < after):
+            subs = self._page(pid, key, self.batch, upto)
+            for s in subs:
+                key = self.subscriptions.sort_key(s, "created_at")
+                if key > after:
+                    break
+                seen.add(normalize((s.get("contact") or "").strip()))
+            if len(subs) < self.batch:
+                break
+        self._seen[eid] = (after, seen)
+        return seen
+
+    def forget(self, keep):
+        """Drop the contacts remembered for events not in `keep` (they will not be dispatched again)."""
+        self._seen = {eid: v for eid, v in self._seen.items() if eid in keep}
+
+    def deliver(self, message):
+        """("sent" | "duplicate" | "failed", error) for one message, after up to `retries` retries."""
+        for attempt in range(self.retries + 1):
+            try:
+                return ("sent" if self.sender.send(message) else "duplicate"), None
+            except Exception as e:
+                if attempt == self.retries:
+                    return "failed", f"{message['idempotency_key']}: {e!r}"
+                self._sleep(self.backoff * 2 ** attempt)
+
+    def run(self, phone, kind, date):
+        """Dispatch the event (or the part of it not dispatched yet); returns its dispatch record."""
+        pid = phone.get("id")
+        eid = event_id(pid, kind, date)
+        now = lambda: datetime.datetime.utcnow().isoformat() + "Z"
+        upto = (datetime.datetime.utcnow() - datetime.timedelta(seconds=self.settle)).isoformat() + "Z"
+        state = self.dispatches.get(eid)
+        if state is None:
+            state = self.dispatches.insert({
+                "id": eid, "phone_id": pid, "kind": kind, "date": date, "state": "running",
+                "after": None, "offset": 0, "sent": 0, "duplicates": 0, "skipped": 0, "failed": 0, "errors": [],
+                "sender_mark": self.sender.flush(),
+                "started_at": now(), "updated_at": now(), "finished_at": None,
+            })
+        else:
+            if "after" not in state:
+                # checkpointed by subscriber count before keyset paging: find the last one counted
+                last = self.subscriptions.find(eq={"phone_id": pid}, order_by="created_at",
+                                               limit=1, offset=state["offset"] - 1) if state["offset"] else []
+                state = self.dispatches.update(eid, {
+                    "after": self.subscriptions.sort_key(last[0], "created_at") if last else None})
+            if not self._page(pid, state["after"], 1, upto):
+                # nobody new since the last run
+                if state["state"] == "done":
+                    return state
+                return self.dispatches.update(eid, {"state": "done", "finished_at": now()})
+            state = self.dispatches.update(eid, {"state": "running", "updated_at": now()})
+
+        resume = getattr(self.sender, "resume", None)
+        if resume is not None:
+            resume(state.get("sender_mark"))
+        seen = self._contacts(eid, pid, state["after"], upto)
+        while True:
+            subs = self._page(pid, state["after"], self.batch, upto)
+            if not subs:
+                break
+            messages, repeats = [], 0
+            for s in subs:
+                contact = (s.get("contact") or "").strip()
+                if not contact:
+                    continue
+                if normalize(contact) in seen:
+                    repeats += 1
+                    continue
+                seen.add(normalize(contact))
+                messages.append(compose(phone, kind, date, s))
+            counts = {"sent": 0, "duplicate": repeats, "failed": 0}
+            errors = list(state["errors"])
+            for outcome, error in self._pool().map(self.deliver, messages):
+                counts[outcome] += 1
+                if error:
+                    errors = (errors + [error])[-MAX_ERRORS:]
+            mark = self.sender.flush()
+            after = self.subscriptions.sort_key(subs[-1], "created_at")
+            self._seen[eid] = (after, seen)
+            state = self.dispatches.update(eid, {
+                "after": after,
+                "offset": state["offset"] + len(subs),
+                "sent": state["sent"] + counts["sent"],
+                "duplicates": state["duplicates"] + counts["duplicate"],
+                "skipped": state["skipped"] + len(subs) - len(messages) - repeats,
+                "failed": state["failed"] + counts["failed"],
+                "errors": errors,
+                "sender_mark": mark,
+                "updated_at": now(),
+            })
+            if len(subs) < self.batch:
+                break
+        return self.dispatches.update(eid, {"state": "done", "finished_at": now()})
+
+
+class LaunchScheduler:
+    """
+    Background thread that runs the Dispatcher for every event returned by
+    due_events(first_day, last_day) (day ordinals; an iterable of (phone,
+    kind, "YYYY-MM-DD")) from `lookback` days ago up to today.
+    """
+
+    def __init__(self, dispatcher, due_events, lock_path, interval=60, lookback=7, today=datetime.date.today):
+        self.dispatcher = dispatcher
+        self.due_events = due_events
+        self.lock_path = Path(lock_path)
+        self.interval = interval
+        self.lookback = lookback
+        self._today = today
+        self._wake = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.last_run = None
+
+    def _lease(self):
+        """Lock file descriptor if this process may dispatch now, else None."""
+        if fcntl is None:
+            return -1
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def tick(self):
+        """Dispatch everything due; returns the dispatch records, or None if another process holds the lease."""
+        with self._run_lock:
+            fd = self._lease()
+            if fd is None:
+                return None
+            try:
+                today = self._today().toordinal()
+                due = list(self.due_events(today - self.lookback, today))
+                self.dispatcher.forget({event_id(phone.get("id"), kind, date) for phone, kind, date in due})
+                out = [self.dispatcher.run(phone, kind, date) for phone, kind, date in due]
+                self.last_run = time.time()
+                return out
+            finally:
+                if fd != -1:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                traceback.print_exc()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        """Start the thread in this process (again after a fork); no-op when interval is 0."""
+        if self.interval <= 0:
+            return
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name="smartshop-launches", daemon=True)
+            self._thread.start()
+
+    def trigger(self):
+        """Run a tick soon, off the calling thread."""
+        if self.interval > 0:
+            self.start()
+            self._wake.set()
+        else:
+            threading.Thread(target=self.tick, name="smartshop-launches-once", daemon=True).start()
+
+    def stats(self):
+        return {"interval": self.interval, "lookback_days": self.lookback, "last_run": self.last_run,
+                "concurrency": self.dispatcher.concurrency, "batch": self.dispatcher.batch,
+                "retries": self.dispatcher.retries, "sender": type(self.dispatcher.sender).__name__}
+
+
+def open_sender(data_dir):
+    name = (os.environ.get("SMARTSHOP_NOTIFY_SENDER") or "outbox").strip().lower()
+    if name not in SENDERS:
+        raise ValueError(f"unknown SMARTSHOP_NOTIFY_SENDER: {name}")
+    if name == "outbox":
+        return OutboxSender(os.environ.get("SMARTSHOP_NOTIFY_OUTBOX") or Path(data_dir) / "outbox.jsonl")
+    return SENDERS[name]()
+
+
+def open_scheduler(subscriptions, dispatches, due_events, data_dir):
+    """LaunchScheduler configured from the environment (not started)."""
+    dispatcher = Dispatcher(subscriptions, dispatches, open_sender(data_dir),
+                            concurrency=int(os.environ.get("SMARTSHOP_NOTIFY_CONCURRENCY") or 8),
+                            batch=int(os.environ.get("SMARTSHOP_NOTIFY_BATCH") or 1000),
+                            retries=int(os.environ.get("SMARTSHOP_NOTIFY_RETRIES") or 3))
+    interval = os.environ.get("SMARTSHOP_NOTIFY_INTERVAL")
+    return LaunchScheduler(dispatcher, due_events, Path(data_dir) / "fanout.lock",
+                           interval=float(interval) if interval not in (None, "") else 60,
+                           lookback=int(os.environ.get("SMARTSHOP_NOTIFY_LOOKBACK") or 7))
@@ -0,0 +1,75 @@
+from pathlib import Path
+import json, os, threading
+
+from .metrics import span
+
+
+def file_stamp(path):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class JsonFileIndex:
+    """
+    Loads a JSON file once and keeps an immutable snapshot built from it.
+    The file is only re-parsed when its mtime/size changes, so a request
+    costs one stat() instead of a full json.load().
+
+    Subclasses implement build(records, version) and return the snapshot
+    object that request handlers query. Use shared(path) so every module
+    mounted in one process (see gateway.py) reuses the same parsed copy.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, path):
+        """The process-wide instance of this index for `path`."""
+        key = (cls, Path(path).resolve())
+        with JsonFileIndex._shared_lock:
+            inst = JsonFileIndex._shared.get(key)
+            if inst is None:
+                inst = JsonFileIndex._shared[key] = cls(path)
+        return inst
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._stamp = False  # never loaded (None means "file missing")
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def build(self, records, version):
+        raise NotImplementedError
+
+    def load(self):
+        """The records passed to build(); the parsed JSON unless a subclass knows better."""
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _version(stamp):
+        return "%x-%x" % stamp if stamp else "0"
+
+    def version(self):
+        """Version of the current snapshot (the one passed to build()), loading it if needed."""
+        self.get()
+        return self._version(self._stamp)
+
+    def get(self):
+        stamp = file_stamp(self.path)
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    name = type(self).__name__
+                    with span(f"{name}.load"):
+                        records = self.load() if stamp is not None else []
+                    version = self._version(stamp)
+                    with span(f"{name}.build"):
+                        self._snapshot = self.build(records, version)
+                    self._stamp = stamp
+        return self._snapshot
@@ -0,0 +1,257 @@
+"""
+Batch trend forecasts for many sales series at once (salesprediction).
+
+A long-format CSV (date,series_id,sales) is streamed in chunks into
+per-(series, day) totals, bucketed to D/W/M periods with one groupby, and
+laid out as a zero-padded [series x periods] matrix. The linear trend of
+every series is then fitted with masked closed-form least squares, the
+same fit (and the same intervals) as simple_forecast() does one series
+at a time with np.polyfit. Big jobs are split by series across a process
+pool. Other models from smartshop.models (or "auto") can be used instead.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing, os, threading, time
+
+import numpy as np
+import pandas as pd
+
+from . import models
+
+# freq -> pandas period used for bucketing, and whether labels are the period's end
+PERIODS = {"D": ("D", False), "W": ("W-SUN", True), "M": ("M", False)}
+DEFAULT_PERIODS = {"D": 30, "W": 8, "M": 6}
+
+# Series per process-pool task; jobs with more series than this fan out
+POOL_CHUNK = int(os.environ.get("SMARTSHOP_FORECAST_POOL_CHUNK") or 20000)
+POOL_PROCS = int(os.environ.get("SMARTSHOP_FORECAST_PROCS") or min(4, os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the web worker is multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=POOL_PROCS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def ingest_long_csv(file_like, chunksize=200_000, progress=None):
+    """
+    Stream a date,series_id,sales CSV (columns case-insensitive) into
+    per-(series_id, day) sales totals. Rows with an unparseable date or
+    sales value, or no series_id, are dropped. Returns (totals, stats):
+    totals is a Series indexed by (series_id, day). progress(fraction,
+    message), if given, is called after each chunk.
+    """
+    started = time.perf_counter()
+    size = file_like.seek(0, 2)
+    file_like.seek(0)
+    header = pd.read_csv(file_like, nrows=0).columns
+    cols = {c.lower(): c for c in header}
+    if not {"date", "series_id", "sales"} <= set(cols):
+        raise ValueError("CSV must have columns: date,series_id,sales")
+    file_like.seek(0)
+    date_col, sid_col, sales_col = cols["date"], cols["series_id"], cols["sales"]
+    parts = []
+    rows = dropped = 0
+    reader = pd.read_csv(file_like, usecols=[date_col, sid_col, sales_col], chunksize=chunksize,
+                         dtype={date_col: str, sid_col: str})
+    for chunk in reader:
+        dates = pd.to_datetime(chunk[date_col], errors="coerce")
+        sales = pd.to_numeric(chunk[sales_col], errors="coerce")
+        sids = chunk[sid_col].str.strip()
+        ok = dates.notna() & sales.notna() & sids.notna() & (sids != "")
+        rows += len(chunk)
+        dropped += int((~ok).sum())
+        parts.append(sales[ok].groupby([sids[ok], dates[ok].dt.floor("D")]).sum())
+        if progress:
+            progress(file_like.tell() / size if size else None, f"parsed {rows:,} rows")
+        if len(parts) >= 16:
+            parts = [pd.concat(parts).groupby(level=[0, 1]).sum()]
+    if parts:
+        totals = pd.concat(parts).groupby(level=[0, 1]).sum()
+    else:
+        totals = pd.Series([], dtype=float, index=pd.MultiIndex.from_arrays(
+            [pd.Index([], dtype=object), pd.DatetimeIndex([])]))
+    totals.index.names = ["series_id", "date"]
+    elapsed = time.perf_counter() - started
+    stats = {
+        "rows": rows,
+        "rows_dropped": dropped,
+        "series": int(totals.index.get_level_values(0).nunique()),
+        "seconds": round(elapsed, 4),
+        "rows_per_sec": int(rows / elapsed) if elapsed > 0 else None,
+    }
+    return totals, stats
+
+
+def to_matrix(totals, freq):
+    """
+    Bucket per-day totals into `freq` periods for every series at once.
+    Returns (series_ids, Y, lengths, first): Y[s, t] is the sales of
+    series s in its t-th period counted from its own first period
+    `first[s]` (a pandas period ordinal), zero-padded past lengths[s].
+    """
+    period = PERIODS[freq][0]
+    days = totals.index.get_level_values("date")
+    ords = pd.PeriodIndex(days, freq=period).asi8
+    sids = totals.index.get_level_values("series_id")
+    buckets = pd.Series(totals.values.astype(float)).groupby([sids, ords]).sum()
+    codes, series_ids = pd.factorize(buckets.index.get_level_values(0), sort=True)
+    o = buckets.index.get_level_values(1).to_numpy()
+    n = len(series_ids)
+    first = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    last = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+    np.minimum.at(first, codes, o)
+    np.maximum.at(last, codes, o)
+    lengths = (last - first + 1) if n else np.zeros(0, dtype=np.int64)
+    Y = np.zeros((n, int(lengths.max()) if n else 0))
+    Y[codes, o - first[codes]] = buckets.to_numpy()
+    return list(series_ids), Y, lengths, first
+
+
+def fit_trends(Y, lengths):
+    """
+    Least-squares y = a*t + b for every row of Y over its first lengths[s]
+    values, vectorized. Returns a dict of arrays a, b, sigma, r2 with the
+    same conventions as fit_trend() (a=0, b=mean for fewer than 2 points).
+    """
+    S, T = Y.shape
+    t = np.arange(T, dtype=float)
+    mask = t[None, :] < lengths[:, None]
+    n = lengths.astype(float)
+    Ym = np.where(mask, Y, 0.0)
+    st = n * (n - 1) / 2                      # sum of t over 0..n-1
+    stt = (n - 1) * n * (2 * n - 1) / 6       # sum of t^2
+    sy = Ym.sum(axis=1)
+    sty = Ym @ t
+    den = n * stt - st * st
+    with np.errstate(divide="ignore", invalid="ignore"):
+        a = np.where(den > 0, (n * sty - st * sy) / den, 0.0)
+        mean = np.where(n > 0, sy / n, 0.0)
+        b = np.where(n >= 2, (sy - a * st) / n, mean)
+        resid = np.where(mask, Y - (a[:, None] * t[None, :] + b[:, None]), 0.0)
+        sse = (resid ** 2).sum(axis=1)
+        sst = (np.where(mask, Y - mean[:, None], 0.0) ** 2).sum(axis=1)
+        sigma = np.where(n > 1, np.sqrt(sse / (n - 1)), 0.0)
+        r2 = np.where((n > 1) & (sst > 0), 1.0 - sse / sst, 0.0)
+    return {"a": a, "b": b, "sigma": sigma, "r2": r2}
+
+
+def _forecast_block(Y, lengths, n_periods):
+    """Fit plus future mean/lower/upper ([series x n_periods]) for one block of series."""
+    fit = fit_trends(Y, lengths)
+    t_future = lengths[:, None] + np.arange(n_periods)[None, :]
+    mean = fit["a"][:, None] * t_future + fit["b"][:, None]
+    spread = 1.96 * fit["sigma"][:, None]
+    fit["lower"] = np.maximum(0, mean - spread)
+    fit["upper"] = np.maximum(0, mean + spread)
+    fit["mean"] = np.maximum(0, mean)
+    return fit
+
+
+def _metric(x):
+    return round(float(x), 4) if np.isfinite(x) else None
+
+
+def model_block(Y, lengths, freq, n_periods, model):
+    """
+    _forecast_block() with the forecast taken from a registry model, or
+    from the best one per series by backtest RMSE when model is "auto".
+    Equal-length series are backtested together. Intervals are +/- 1.96
+    x the backtest RMSE (the trend fit's residual spread when the series
+    is too short for a backtest). Adds per-series "model" and "backtest".
+    """
+    res = _forecast_block(Y, lengths, n_periods)
+    S = len(lengths)
+    res["model"], res["backtest"] = [None] * S, [None] * S
+    names = None if model == "auto" else [model]
+    for L in np.unique(lengths):
+        idx = np.flatnonzero(lengths == L)
+        scores, best = models.backtest(Y[idx, :L], freq, n_periods, models=names)
+        for j, s in enumerate(idx):
+            chosen = scores[best[j]]
+            rmse = chosen["rmse"][j]
+            sigma = rmse if np.isfinite(rmse) else res["sigma"][s]
+            mean = chosen["forecast"][j]
+            res["mean"][s] = np.maximum(0, mean)
+            res["lower"][s] = np.maximum(0, mean - 1.96 * sigma)
+            res["upper"][s] = np.maximum(0, mean + 1.96 * sigma)
+            res["model"][s] = best[j]
+            res["backtest"][s] = {name: {"mape": _metric(sc["mape"][j]), "rmse": _metric(sc["rmse"][j]),
+                                         "fit_ms": round(sc["seconds"] * 1000 / len(idx), 3)}
+                                  for name, sc in scores.items()}
+    return res
+
+
+def forecast_blocks(Y, lengths, n_periods, freq=None, model="linear"):
+    """
+    Yield (start, block result) for consecutive blocks of series. Jobs
+    larger than POOL_CHUNK series run on the process pool, in order.
+    Registry models other than the plain trend run in-process.
+    """
+    S = len(lengths)
+    if model != "linear":
+        yield 0, model_block(Y, lengths, freq, n_periods, model)
+        return
+    if S <= POOL_CHUNK or POOL_PROCS <= 1:
+        yield 0, _forecast_block(Y, lengths, n_periods)
+        return
+    starts = range(0, S, POOL_CHUNK)
+    futures = [_get_pool().submit(_forecast_block, Y[s:s + POOL_CHUNK, :int(lengths[s:s + POOL_CHUNK].max())],
+                                  lengths[s:s + POOL_CHUNK], n_periods) for s in starts]
+    for s, fut in zip(starts, futures):
+        yield s, fut.result()
+
+
+def period_labels(freq, lo, hi):
+    """Date strings for period ordinals lo..hi, labelled like resample_series() does."""
+    period, at_end = PERIODS[freq]
+    idx = pd.PeriodIndex.from_ordinals(np.arange(lo, hi + 1), freq=period)
+    stamps = idx.end_time.normalize() if at_end else idx.start_time
+    return np.asarray(stamps.strftime("%Y-%m-%d"))
+
+
+def batch_forecast(totals, freq, n_periods, model="linear"):
+    """
+    Forecast every series in `totals` (from ingest_long_csv) with `model`
+    (a models.MODELS name or "auto"). Yields one dict per series, in
+    series_id order, as results become available.
+    """
+    series_ids, Y, lengths, first = to_matrix(totals, freq)
+    if not series_ids:
+        return
+    lo = int(first.min())
+    labels = period_labels(freq, lo, int((first + lengths).max()) + n_periods)
+    for start, res in forecast_blocks(Y, lengths, n_periods, freq, model):
+        for k in range(len(res["a"])):
+            s = start + k
+            n = int(lengths[s])
+            fut = first[s] + n - lo + np.arange(n_periods)
+            out = {
+                "series_id": series_ids[s],
+                "summary": {
+                    "n_obs": n,
+                    "first_date": labels[first[s] - lo],
+                    "last_date": labels[first[s] - lo + n - 1],
+                    "freq": freq,
+                    "n_forecast": n_periods,
+                    "trend_slope_per_period": float(res["a"][k]),
+                    "trend_intercept": float(res["b"][k]),
+                    "r2_trend_fit": float(res["r2"][k]),
+                    "sigma_residual": float(res["sigma"][k]),
+                },
+                "forecast": [{
+                    "date": labels[f],
+                    "yhat": float(res["mean"][k, i]),
+                    "lower": float(res["lower"][k, i]),
+                    "upper": float(res["upper"][k, i]),
+                } for i, f in enumerate(fut)],
+            }
+            if "model" in res:
+                out["summary"]["model"] = res["model"][k]
+                out["summary"]["backtest"] = res["backtest"][k]
+            yield out
@@ -0,0 +1,82 @@
+"""
+Distance search for shops: great-circle distances and a grid index.
+
+Points are bucketed into cells of `cell_deg` degrees of latitude and
+longitude. A radius query only visits the cells overlapping the circle's
+bounding box, so its cost depends on how many shops are nearby, not on
+how many there are in total.
+"""
+import math
+
+from .filecache import JsonFileIndex
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_latlon(s):
+    """(lat, lon) from "lat,lon"; raises ValueError."""
+    try:
+        lat, lon = (float(x) for x in (s or "").split(","))
+    except ValueError:
+        raise ValueError("near must look like 19.07,72.87")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError("near is out of range")
+    return lat, lon
+
+
+class GeoGrid:
+    """Grid index over (lat, lon) points, keyed by their position in `points`."""
+
+    def __init__(self, points, cell_deg=0.5):
+        self.cell = cell_deg
+        self.points = points
+        self.cells = {}
+        self._lon_cells = int(math.ceil(360 / cell_deg))
+        for i, pt in enumerate(points):
+            if pt is not None:
+                self.cells.setdefault(self._key(*pt), []).append(i)
+
+    def __len__(self):
+        return sum(len(v) for v in self.cells.values())
+
+    def _key(self, lat, lon):
+        return int(math.floor(lat / self.cell)), int(math.floor(lon / self.cell)) % self._lon_cells
+
+    def within(self, lat, lon, radius_km, allowed=None):
+        """[(distance_km, position)] of points within radius_km, nearest first; optionally only positions in `allowed`."""
+        dlat = radius_km / KM_PER_DEG_LAT
+        lat_lo, lat_hi = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+        # widest longitude span of the circle, at the box edge closest to a pole
+        cos_lat = min(math.cos(math.radians(lat_lo)), math.cos(math.radians(lat_hi)))
+        if cos_lat <= 1e-9 or radius_km / (KM_PER_DEG_LAT * cos_lat) >= 180:
+            lon_cells = range(self._lon_cells)
+        else:
+            dlon = radius_km / (KM_PER_DEG_LAT * cos_lat)
+            a, b = int(math.floor((lon - dlon) / self.cell)), int(math.floor((lon + dlon) / self.cell))
+            lon_cells = sorted({c % self._lon_cells for c in range(a, b + 1)})
+        hits = []
+        for r in range(int(math.floor(lat_lo / self.cell)), int(math.floor(lat_hi / self.cell)) + 1):
+            for c in lon_cells:
+                for i in self.cells.get((r, c), ()):
+                    if allowed is not None and i not in allowed:
+                        continue
+                    d = haversine_km(lat, lon, *self.points[i])
+                    if d <= radius_km:
+                        hits.append((d, i))
+        hits.sort()
+        return hits
+
+
+class PincodeTable(JsonFileIndex):
+    """Offline pincode -> [lat, lon] centroid table, loaded once per file version."""
+
+    def build(self, records, version):
+        return {str(pin): (float(ll[0]), float(ll[1])) for pin, ll in (records or {}).items()}
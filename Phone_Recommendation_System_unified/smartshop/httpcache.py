@@ -0,0 +1,83 @@
+"""
+Pre-serialized responses for read endpoints, with conditional GET.
+
+    @bp.route("/api/phones")
+    @cached_get(lambda: CATALOG.get().version)
+    def api_phones(): ...
+
+A 200 JSON response is kept as encoded bytes (and gzip-compressed bytes
+when it is large enough) under (endpoint, URL args, query args, data
+version), where the version function returns something that changes
+whenever the data behind the endpoint does: a catalog snapshot version,
+a store version, today's date. A repeated request is answered from those
+bytes without running the view, serializing or compressing; one carrying
+a matching If-None-Match (or an If-Modified-Since not older than the
+entry) gets a 304. Entries of older versions are never served again and
+age out of the LRU.
+
+If the version function raises ValueError (a bad query parameter) the view
+runs uncached and reports the error itself.
+
+    SMARTSHOP_RESPONSE_CACHE_MB   memory for cached bodies, per process (default 64; 0 disables)
+"""
+from functools import wraps
+import datetime, gzip, hashlib, os
+
+from flask import Response, make_response, request
+
+from .lru import LRUCache
+from .metrics import register_cache
+
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+RESPONSES = LRUCache(maxsize=100000, maxbytes=int(float(os.environ.get("SMARTSHOP_RESPONSE_CACHE_MB") or 64) * 2**20))
+register_cache("responses", RESPONSES)
+
+
+def _serve(entry):
+    body, etag = entry["body"], entry["etag"]
+    gz = entry["gzip"] is not None and request.accept_encodings["gzip"] > 0
+    if gz:
+        body, etag = entry["gzip"], etag + "-gzip"
+    resp = Response(body, mimetype=entry["mimetype"])
+    resp.set_etag(etag)
+    resp.last_modified = entry["last_modified"]
+    resp.headers["Cache-Control"] = "no-cache"
+    if entry["gzip"] is not None:
+        resp.vary.add("Accept-Encoding")
+    if gz:
+        resp.headers["Content-Encoding"] = "gzip"
+    return resp.make_conditional(request)
+
+
+def cached_get(version, cache=RESPONSES):
+    """Decorator for GET views whose output depends only on the request URL and version()."""
+
+    def deco(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not cache.maxbytes:
+                return view(*args, **kwargs)
+            try:
+                key = (request.endpoint, tuple(sorted(kwargs.items())),
+                       tuple(sorted((k, tuple(v)) for k, v in request.args.lists())), version())
+            except ValueError:
+                return view(*args, **kwargs)
+            entry = cache.get(key)
+            if entry is None:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200 or not resp.is_json or resp.direct_passthrough:
+                    return resp
+                body = resp.get_data()
+                entry = {
+                    "body": body,
+                    "gzip": gzip.compress(body, compresslevel=6, mtime=0) if len(body) >= GZIP_MIN_BYTES else None,
+                    "etag": hashlib.sha1(body).hexdigest(),
+                    "mimetype": resp.mimetype,
+                    "last_modified": datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0),
+                }
+                cache.put(key, entry, size=len(body) + len(entry["gzip"] or b""))
+            return _serve(entry)
+        return wrapper
+    return deco
@@ -0,0 +1,55 @@
+"""
+Record ids: time-ordered and unique across threads, workers and hosts.
+
+An id is a prefix plus 26 Crockford base32 characters, as in ULID: a
+48-bit millisecond timestamp followed by 80 random bits. Ids therefore
+sort by creation time. Within one millisecond a process increments the
+random part instead of drawing a new one, so its ids stay strictly
+increasing (even if the clock steps back), and a forked worker draws
+fresh randomness instead of continuing its parent's sequence.
+"""
+import os, threading, time
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+RANDOM_BITS = 80
+
+
+def encode(n, width):
+    out = []
+    for _ in range(width):
+        n, r = divmod(n, 32)
+        out.append(ALPHABET[r])
+    return "".join(reversed(out))
+
+
+class IdGenerator:
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pid = None
+        self._ms = -1
+        self._rand = 0
+
+    def new(self, prefix=""):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid, self._ms = os.getpid(), -1
+            ms = int(self._clock() * 1000)
+            if ms > self._ms:
+                rand = int.from_bytes(os.urandom(RANDOM_BITS // 8), "big")
+            else:
+                # same millisecond (or the clock went back): keep counting from the last id
+                ms, rand = self._ms, self._rand + 1
+                if rand >> RANDOM_BITS:
+                    ms, rand = ms + 1, int.from_bytes(os.urandom(RANDOM_BITS // 8), "big")
+            self._ms, self._rand = ms, rand
+        return prefix + encode(ms, 10) + encode(rand, 16)
+
+
+_generator = IdGenerator()
+
+
+def new_id(prefix=""):
+    """A new record id, e.g. new_id("R") -> "R01JAB3Z6Y2W8K4N5Q7T9V0X1C"."""
+    return _generator.new(prefix)
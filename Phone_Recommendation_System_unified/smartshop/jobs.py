@@ -0,0 +1,231 @@
+"""
+Background jobs for long-running requests (salesprediction forecasts).
+
+A JobQueue runs submitted functions on a bounded thread pool inside the
+web process: at most `workers` run at once and at most `max_pending` more
+wait; past that submit() raises QueueFull and the route answers 429. Job
+state, progress and results are kept until `ttl` seconds after the job
+finishes, either in memory (one process) or in a SQLite table, so with
+several gunicorn workers whichever worker gets a status poll can answer.
+
+    SMARTSHOP_JOBS          memory | sqlite (default: sqlite when SMARTSHOP_STORAGE=sqlite;
+                            gunicorn.conf.py also picks sqlite for more than one worker)
+    SMARTSHOP_JOB_WORKERS   jobs running at once, per process (default 2)
+    SMARTSHOP_JOB_QUEUE     jobs waiting, per process, before 429 (default 8)
+    SMARTSHOP_JOB_TTL       seconds a finished job is kept (default 600)
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import json, os, sqlite3, threading, time, traceback, uuid
+
+from .storage import db_path_for, storage_backend
+
+
+# Unfinished jobs are dropped this long after they were queued (their process may have died)
+STALE_AFTER = 24 * 3600
+
+
+class QueueFull(Exception):
+    pass
+
+
+class MemoryJobStore:
+    """Jobs in a dict; only the process that ran a job can report it."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id, fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def purge(self, now):
+        with self._lock:
+            for job_id in [k for k, j in self._jobs.items() if j["expires_at"] and j["expires_at"] < now]:
+                del self._jobs[job_id]
+
+
+class SqliteJobStore:
+    """Jobs in a SQLite table (WAL), visible to every process using the file."""
+
+    name = "sqlite"
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().execute("CREATE TABLE IF NOT EXISTS jobs "
+                             "(id TEXT PRIMARY KEY, doc TEXT NOT NULL, result BLOB, expires_at REAL)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid != os.getpid():
+            conn = None  # never share a connection across a fork
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _split(job):
+        doc = {k: v for k, v in job.items() if k != "result"}
+        return json.dumps(doc), job.get("result"), job.get("expires_at")
+
+    def create(self, job):
+        self._conn().execute("INSERT INTO jobs (id, doc, result, expires_at) VALUES (?, ?, ?, ?)",
+                             (job["id"], *self._split(job)))
+
+    def update(self, job_id, fields):
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute("SELECT doc, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None:
+                job = {**json.loads(row[0]), "result": row[1], **fields}
+                c.execute("UPDATE jobs SET doc = ?, result = ?, expires_at = ? WHERE id = ?",
+                          (*self._split(job), job_id))
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT doc, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {**json.loads(row[0]), "result": row[1]}
+
+    def purge(self, now):
+        self._conn().execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+
+
+class JobQueue:
+    """
+    Bounded background runner. submit(kind, fn, *args) calls
+    fn(progress, *args) on a worker thread, where progress(fraction,
+    message) records how far along it is; fn returns (body bytes,
+    mimetype). A ValueError from fn is reported as a 400 error, anything
+    else as a 500.
+    """
+
+    def __init__(self, store, workers=2, max_pending=8, ttl=600, clock=time.time):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.running = self.queued = 0
+
+    def _pool(self):
+        # created on first use, so processes forked after import get their own threads
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smartshop-job")
+            self._pid = os.getpid()
+            self.running = self.queued = 0
+        return self._executor
+
+    def submit(self, kind, fn, *args):
+        """Queue fn(progress, *args); returns the job id. Raises QueueFull when all slots are taken."""
+        now = self._clock()
+        self.store.purge(now)
+        with self._lock:
+            pool = self._pool()
+            if self.running + self.queued >= self.workers + self.max_pending:
+                raise QueueFull(f"{self.running} jobs running and {self.queued} waiting")
+            self.queued += 1
+        job_id = uuid.uuid4().hex
+        self.store.create({"id": job_id, "kind": kind, "state": "queued", "progress": 0.0, "message": None,
+                           "created_at": now, "started_at": None, "finished_at": None, "expires_at": now + STALE_AFTER,
+                           "error": None, "error_status": None, "mimetype": None, "result": None})
+        try:
+            pool.submit(self._run, job_id, fn, args)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            self.store.update(job_id, {"state": "error", "error": "could not start job", "error_status": 503,
+                                       "finished_at": now, "expires_at": now + self.ttl})
+            raise
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        self.store.update(job_id, {"state": "running", "started_at": self._clock()})
+
+        def progress(fraction=None, message=None):
+            fields = {"message": message}
+            if fraction is not None:
+                fields["progress"] = round(min(max(float(fraction), 0.0), 1.0), 4)
+            self.store.update(job_id, fields)
+
+        try:
+            body, mimetype = fn(progress, *args)
+            fields = {"state": "done", "progress": 1.0, "message": None, "result": body, "mimetype": mimetype}
+        except ValueError as e:
+            fields = {"state": "error", "error": str(e), "error_status": 400}
+        except Exception:
+            traceback.print_exc()
+            fields = {"state": "error", "error": "job failed", "error_status": 500}
+        finally:
+            with self._lock:
+                self.running -= 1
+        now = self._clock()
+        self.store.update(job_id, {**fields, "finished_at": now, "expires_at": now + self.ttl})
+
+    def get(self, job_id):
+        """The job record (with its result bytes once done), or None if unknown or expired."""
+        now = self._clock()
+        job = self.store.get(job_id)
+        if job is not None and job["expires_at"] and job["expires_at"] < now:
+            self.store.purge(now)
+            return None
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {"backend": self.store.name, "workers": self.workers, "max_pending": self.max_pending,
+                    "ttl": self.ttl, "running": self.running, "queued": self.queued}
+
+
+def jobs_backend():
+    default = "sqlite" if storage_backend() == "sqlite" else "memory"
+    return (os.environ.get("SMARTSHOP_JOBS") or default).strip().lower()
+
+
+def open_jobs(near):
+    """
+    JobQueue configured from the environment. The SQLite backend uses
+    SMARTSHOP_DB, or smartshop.db in the directory of `near`.
+    """
+    backend = jobs_backend()
+    if backend == "sqlite":
+        store = SqliteJobStore(db_path_for(near))
+    elif backend == "memory":
+        store = MemoryJobStore()
+    else:
+        raise ValueError(f"unknown SMARTSHOP_JOBS backend: {backend}")
+    return JobQueue(store,
+                    workers=int(os.environ.get("SMARTSHOP_JOB_WORKERS") or 2),
+                    max_pending=int(os.environ.get("SMARTSHOP_JOB_QUEUE") or 8),
+                    ttl=float(os.environ.get("SMARTSHOP_JOB_TTL") or 600))
@@ -0,0 +1,490 @@
+from bisect import bisect_left, bisect_right, insort
+from pathlib import Path
+import json, logging, os, threading
+
+from .metrics import timed
+from .schema import filter_records, summarize
+from .search import SearchIndex
+from .text import tokenize
+
+try:
+    import fcntl  # cross-process locking (POSIX)
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    try:
+        import msvcrt  # Windows: exclusive byte-range locks only
+    except ImportError:
+        msvcrt = None
+
+
+log = logging.getLogger("smartshop.logstore")
+
+
+class KeyExists(ValueError):
+    """insert() of a record whose key is already taken."""
+
+
+class Conflict(ValueError):
+    """update() of a record that already has the values of its `unless` condition."""
+
+
+def matches(rec, values):
+    """True when `rec` has every field of `values` set to that value."""
+    return bool(values) and all(rec.get(k) == v for k, v in values.items())
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _fsync_dir(path):
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_json(path, data):
+    """Write JSON to a temp file, fsync it and rename it over `path`."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path.parent)
+
+
+class Partition:
+    """
+    Keys of a LogStore's records bucketed by the (schema-normalized) value
+    of one column. Each bucket lists its keys in the store's record order;
+    a record that moves back into a bucket is put back in place lazily.
+    """
+
+    def __init__(self, schema, col):
+        self.schema = schema
+        self.col = col
+        self.reset()
+
+    def reset(self):
+        self._buckets = {}   # value -> {key: None}
+        self._unsorted = set()
+        self._seq = {}       # key -> position in the store
+
+    def apply(self, key, old, new):
+        seq = self._seq.setdefault(key, len(self._seq))
+        if old is not None:
+            self._buckets.get(self.schema.value(old, self.col), {}).pop(key, None)
+        if new is not None:
+            value = self.schema.value(new, self.col)
+            bucket = self._buckets.setdefault(value, {})
+            if bucket and self._seq[next(reversed(bucket))] > seq:
+                self._unsorted.add(value)
+            bucket[key] = None
+
+    def keys(self, value):
+        bucket = self._buckets.get(value, {})
+        if value in self._unsorted:
+            bucket = self._buckets[value] = dict.fromkeys(sorted(bucket, key=self._seq.__getitem__))
+            self._unsorted.discard(value)
+        return bucket.keys()
+
+
+class _Top:
+    """Compares above every value (upper bound for bisect on partial keys)."""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return other is not self
+
+
+_TOP = _Top()
+
+
+class SortedKeys:
+    """
+    Keys of a LogStore's records sorted by schema.sort_key() on one column,
+    i.e. (value, id). Sorted lazily after a reload, then kept in order with
+    insort as records change.
+    """
+
+    def __init__(self, schema, col):
+        self.schema = schema
+        self.col = col
+        self.reset()
+
+    def reset(self):
+        self._entry = {}     # key -> (value, id, seq)
+        self._keys = {}      # seq -> key
+        self._seq = {}       # key -> seq, unique tiebreak (legacy records have no id)
+        self._sorted = None
+
+    def apply(self, key, old, new):
+        seq = self._seq.setdefault(key, len(self._seq))
+        self._keys[seq] = key
+        entry = (*self.schema.sort_key(new, self.col), seq) if new is not None else None
+        prev = self._entry.get(key)
+        if prev == entry:
+            return
+        if entry is None:
+            self._entry.pop(key, None)
+        else:
+            self._entry[key] = entry
+        if self._sorted is not None:
+            if prev is not None:
+                del self._sorted[bisect_left(self._sorted, prev)]
+            if entry is not None:
+                insort(self._sorted, entry)
+
+    def scan(self, lo=None, hi=None, after=None, desc=False):
+        """
+        Keys with lo <= value <= hi (either optional), past the `after` sort
+        key, in (value, id) order; a generator, consume it under the store lock.
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self._entry.values())
+        entries = self._sorted
+        a = bisect_left(entries, (lo,)) if lo not in (None, "") else 0
+        b = bisect_right(entries, (hi, _TOP)) if hi not in (None, "") else len(entries)
+        if after is not None:
+            if desc:
+                b = min(b, bisect_left(entries, tuple(after)))
+            else:
+                a = max(a, bisect_right(entries, (*after, _TOP)))
+        for i in (range(b - 1, a - 1, -1) if desc else range(a, b)):
+            yield self._keys[entries[i][2]]
+
+
+class LogStore:
+    """
+    Record store backed by a JSON snapshot plus an append-only JSON-lines log.
+
+      <name>.json       compacted snapshot (same list-of-objects format as before)
+      <name>.json.log   one event per line: {"op": "put", "rec": {...}}
+                        or {"op": "set", "id": ..., "fields": {...}}
+      <name>.json.lock  flock()ed by writers (exclusive) and readers (shared)
+
+    Writes append one fsync'd line instead of rewriting the whole file.
+    Every process keeps an in-memory materialized view and tails the log
+    before each read, so several gunicorn workers see each other's writes.
+    After `compact_every` events the log is folded into a new snapshot
+    (temp file + rename) and truncated. Events are idempotent, so a crash
+    between the rename and the truncate just replays them, and a crash in
+    the middle of an append leaves a partial last line that readers ignore
+    and the next writer truncates.
+
+    With a `schema` (see smartshop.schema) the store also answers find(),
+    using an in-memory SearchIndex over schema.text_fields for `text` and
+    a Partition per schema.partitions column for equality filters and
+    SortedKeys per schema.ranges column for sorts and range filters.
+    Other derived views can be attached with add_view(): they get reset()
+    on a full reload and apply(key, old, new) for every record change,
+    including changes replayed from other processes' log lines.
+    """
+
+    def __init__(self, path, key="id", compact_every=1000, fsync=True, schema=None):
+        self.path = Path(path)
+        self.log_path = self.path.with_name(self.path.name + ".log")
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self.schema = schema
+        self.key = schema.key if schema else key
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._rows = {}
+        self._snap_stamp = False
+        self._offset = 0
+        self._log_events = 0
+        self._tlock = threading.RLock()
+        self._views = []
+        self.search_index = None
+        if schema is not None and schema.text_fields:
+            self.search_index = SearchIndex(schema.text_fields)
+            self._views.append(self.search_index)
+        self.partitions = {}
+        for col in (schema.partitions if schema is not None else ()):
+            self.partitions[col] = Partition(schema, col)
+            self._views.append(self.partitions[col])
+        self.ranges = {}
+        for col in (schema.ranges if schema is not None else ()):
+            self.ranges[col] = SortedKeys(schema, col)
+            self._views.append(self.ranges[col])
+
+    def add_view(self, view):
+        with self._tlock:
+            self._views.append(view)
+            for k, rec in self._rows.items():
+                view.apply(k, None, rec)
+
+    # ---- locking -------------------------------------------------------
+
+    def _flock(self, exclusive):
+        if fcntl is None and msvcrt is None:
+            return None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            return fd
+        # no shared locks on Windows, so readers lock exclusively too;
+        # LK_LOCK gives up with OSError after ~10s of contention, so keep trying
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return fd
+            except OSError:
+                continue
+
+    def _unflock(self, fd):
+        if fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+    # ---- replay --------------------------------------------------------
+
+    def _apply(self, ev):
+        op = ev.get("op")
+        if op == "put":
+            new = ev["rec"]
+            key = new[self.key]
+            old = self._rows.get(key)
+        elif op == "set":
+            key = ev["id"]
+            old = self._rows.get(key)
+            if old is None:
+                return
+            new = {**old, **ev["fields"]}
+        else:
+            return
+        self._rows[key] = new
+        for view in self._views:
+            view.apply(key, old, new)
+
+    def _reload(self):
+        self._rows = {}
+        for view in self._views:
+            view.reset()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for i, rec in enumerate(json.load(f)):
+                    k = rec.get(self.key)
+                    # legacy rows without a key still need a slot in the view
+                    k = k if k is not None else ("#", i)
+                    self._rows[k] = rec
+                    for view in self._views:
+                        view.apply(k, None, rec)
+        except FileNotFoundError:
+            pass
+        self._snap_stamp = _stamp(self.path)
+        self._offset = 0
+        self._log_events = 0
+
+    def _sync(self):
+        """Bring the in-memory view up to date with the snapshot and log tail."""
+        if _stamp(self.path) != self._snap_stamp:
+            self._reload()
+        try:
+            size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._offset:
+            # log was truncated by another process's compaction
+            self._reload()
+        if size == self._offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read(size - self._offset)
+        end = chunk.rfind(b"\n") + 1  # only consume complete lines
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                ev = json.loads(line)
+            except ValueError:
+                # a torn write from before tails were repaired; losing it beats failing every read
+                log.warning("%s: skipping undecodable log line %r", self.log_path, line[:80])
+                continue
+            self._apply(ev)
+            self._log_events += 1
+        self._offset += end
+
+    def _append(self, events):
+        data = b"".join(json.dumps(ev, ensure_ascii=False).encode("utf-8") + b"\n" for ev in events)
+        fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            # _sync() (under the same exclusive lock) consumed every complete line, so
+            # anything past _offset is the partial line of a writer that crashed mid-write
+            if os.fstat(fd).st_size > self._offset:
+                log.warning("%s: dropping a partial last line (%d bytes)", self.log_path,
+                            os.fstat(fd).st_size - self._offset)
+                os.ftruncate(fd, self._offset)
+            os.write(fd, data)
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        for ev in events:
+            self._apply(ev)
+        self._offset += len(data)
+        self._log_events += len(events)
+        if self.compact_every and self._log_events >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        atomic_write_json(self.path, list(self._rows.values()))
+        with open(self.log_path, "wb") as f:
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._snap_stamp = _stamp(self.path)
+        self._offset = 0
+        self._log_events = 0
+
+    # ---- public API ----------------------------------------------------
+
+    @timed("logstore.refresh")
+    def _refresh(self):
+        fd = self._flock(exclusive=False)
+        try:
+            self._sync()
+        finally:
+            self._unflock(fd)
+
+    def refresh(self):
+        """Catch up with other processes' writes; attached views are updated too."""
+        with self._tlock:
+            self._refresh()
+
+    def all(self):
+        """All records in insertion order (treat them as read-only)."""
+        with self._tlock:
+            self._refresh()
+            return list(self._rows.values())
+
+    def sort_key(self, rec, col):
+        return self.schema.sort_key(rec, col)
+
+    def version(self):
+        """A string that changes whenever the records do (in any process)."""
+        with self._tlock:
+            self._refresh()
+            stamp = self._snap_stamp
+            return ("%x-%x-%x" % stamp if stamp else "0") + "+%x" % self._offset
+
+    @timed("logstore.find")
+    def find(self, eq=None, ge=None, text=None, order_by=None, desc=False,
+             limit=None, after=None, offset=0, le=None):
+        """
+        Filtered/sorted records; same semantics as SqliteStore.find().
+        With `text` and no `order_by`, results are ranked by relevance.
+        """
+        with self._tlock:
+            self._refresh()
+            if tokenize(text) and self.search_index is not None:
+                rows = [self._rows[k] for k, _ in self.search_index.search(text)]
+                text = None
+            elif order_by in self.ranges:
+                # already in order and past `after`: filter lazily up to the page
+                keys = self.ranges[order_by].scan((ge or {}).get(order_by), (le or {}).get(order_by), after, desc)
+                rows = (self._rows[k] for k in keys)
+                return filter_records(self.schema, rows, eq=eq, ge=ge, le=le, text=text, limit=limit, offset=offset)
+            else:
+                rows = self._candidates(eq)
+        return filter_records(self.schema, rows, eq=eq, ge=ge, le=le, text=text, order_by=order_by, desc=desc,
+                              limit=limit, after=after, offset=offset)
+
+    def _candidates(self, eq):
+        """Records that can match `eq`: the smallest matching partition, else all of them."""
+        best = None
+        for col, value in (eq or {}).items():
+            if col in self.partitions and value not in (None, ""):
+                keys = self.partitions[col].keys(value)
+                if best is None or len(keys) < len(best):
+                    best = keys
+        if best is None:
+            return list(self._rows.values())
+        return [self._rows[k] for k in best]
+
+    def stats(self, eq=None, ge=None, text=None, col=None, le=None):
+        """(number of matching records, sum of `col` over them)."""
+        return summarize(self.schema, self.find(eq=eq, ge=ge, le=le, text=text), col)
+
+    def get(self, key):
+        with self._tlock:
+            self._refresh()
+            return self._rows.get(key)
+
+    @timed("logstore.insert")
+    def insert(self, rec):
+        """Add a new record; raises KeyExists if its key is taken (ids are never reused)."""
+        with self._tlock:
+            fd = self._flock(exclusive=True)
+            try:
+                self._sync()
+                if rec.get(self.key) is not None and rec[self.key] in self._rows:
+                    raise KeyExists(rec[self.key])
+                self._append([{"op": "put", "rec": rec}])
+            finally:
+                self._unflock(fd)
+        return rec
+
+    @timed("logstore.update")
+    def update(self, key, fields, unless=None):
+        """
+        Set `fields` on one record; returns the updated record or None if
+        unknown. With `unless` ({field: value}) the check and the write are
+        one step: a record that already has those values is left alone and
+        Conflict is raised.
+        """
+        with self._tlock:
+            fd = self._flock(exclusive=True)
+            try:
+                self._sync()
+                if key not in self._rows:
+                    return None
+                if matches(self._rows[key], unless):
+                    raise Conflict(key)
+                self._append([{"op": "set", "id": key, "fields": fields}])
+                return self._rows[key]
+            finally:
+                self._unflock(fd)
+
+    @timed("logstore.update_many")
+    def update_many(self, keys, fields):
+        """Set `fields` on every known record in `keys` with one log append; returns the updated records."""
+        with self._tlock:
+            fd = self._flock(exclusive=True)
+            try:
+                self._sync()
+                found = [k for k in dict.fromkeys(keys) if k in self._rows]
+                if found:
+                    self._append([{"op": "set", "id": k, "fields": fields} for k in found])
+                return [self._rows[k] for k in found]
+            finally:
+                self._unflock(fd)
+
+    @timed("logstore.compact")
+    def compact(self):
+        with self._tlock:
+            fd = self._flock(exclusive=True)
+            try:
+                self._sync()
+                self._compact()
+            finally:
+                self._unflock(fd)
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+import threading, time
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Holds at most `maxsize` entries and, with `maxbytes`, at most that many
+    bytes as declared by put(size=...); least recently used entries are
+    dropped first. Entries older than `ttl` seconds (None: no expiry) count
+    as misses and are removed on access. Hit, miss, eviction and expiry
+    counters are kept for stats().
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxbytes=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (stored_at, value, size)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None and self._clock() - item[0] > self.ttl:
+                self._drop(key)
+                self.expired += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def _drop(self, key):
+        self.nbytes -= self._data.pop(key)[2]
+
+    def put(self, key, value, size=0):
+        """Store `value`; `size` (bytes) counts against maxbytes. Too-large values are not kept."""
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (self._clock(), value, size)
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "bytes": self.nbytes, "maxbytes": self.maxbytes,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions, "expired": self.expired,
+            }
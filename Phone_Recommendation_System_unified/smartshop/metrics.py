@@ -0,0 +1,354 @@
+"""
+Request and span timings, sizes and cache counters, exported at /metrics.
+
+    app = Flask(__name__)
+    instrument(app)               # request histograms, /metrics, slow-request log
+
+    @timed("forecast.fit_trend")  # or: with span("catalog.sort"): ...
+    def fit_trend(series): ...
+
+Every request is timed per endpoint (histogram) and counted per status,
+with request and response body sizes. A span is a named timer: its
+histogram covers every call, in requests or in background threads, and
+spans run during a request also make up that request's breakdown in the
+slow-request log. Caches registered with register_cache() export their
+hit/miss/eviction counters, entry count and bytes, plus the hit ratio.
+
+/metrics answers in the Prometheus text format. Under gunicorn each
+worker keeps its own numbers and writes them to SMARTSHOP_METRICS_DIR
+(gunicorn.conf.py sets up a scratch one) within a second; /metrics
+adds up the files of all workers, so any worker gives the totals.
+Counters of workers that have exited are kept, their gauges are not.
+Spans run in the gunicorn master before it forks (preloading) are not
+counted.
+
+    SMARTSHOP_METRICS         0 turns all of this off
+    SMARTSHOP_METRICS_DIR     directory for per-worker snapshots (default: this process only)
+    SMARTSHOP_SLOW_MS         log requests slower than this many ms with their spans
+                              to the smartshop.slow logger (default 0: off)
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from time import perf_counter
+import json, logging, os, tempfile, threading, time
+
+from flask import Response, g, request
+from flask.json.provider import DefaultJSONProvider
+
+ENABLED = os.environ.get("SMARTSHOP_METRICS", "1") != "0"
+METRICS_DIR = os.environ.get("SMARTSHOP_METRICS_DIR") or None
+SLOW_MS = float(os.environ.get("SMARTSHOP_SLOW_MS") or 0)
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between two snapshot writes of one worker
+FLUSH_INTERVAL = 1.0
+
+HELP = {
+    "smartshop_requests_total": ("counter", "Requests handled, by endpoint, method and status."),
+    "smartshop_request_seconds": ("histogram", "Request duration, by endpoint and method."),
+    "smartshop_request_bytes_total": ("counter", "Request body bytes received, by endpoint."),
+    "smartshop_response_bytes_total": ("counter", "Response body bytes sent (before compression by a proxy), by endpoint."),
+    "smartshop_slow_requests_total": ("counter", "Requests slower than SMARTSHOP_SLOW_MS, by endpoint."),
+    "smartshop_span_seconds": ("histogram", "Duration of named spans (loads, filters, sorts, serialization, storage calls)."),
+    "smartshop_cache_hits_total": ("counter", "Cache lookups that found an entry."),
+    "smartshop_cache_misses_total": ("counter", "Cache lookups that found nothing (or an expired entry)."),
+    "smartshop_cache_evictions_total": ("counter", "Entries dropped to stay within a cache's size or byte limit."),
+    "smartshop_cache_entries": ("gauge", "Entries held by a cache."),
+    "smartshop_cache_bytes": ("gauge", "Bytes held by a cache."),
+    "smartshop_cache_hit_ratio": ("gauge", "Hits / lookups of a cache since the workers started."),
+}
+
+log = logging.getLogger("smartshop.slow")
+
+# {span: [calls, seconds]} of the request being handled in this context, if any
+_trace = ContextVar("smartshop_trace", default=None)
+
+
+class Registry:
+    """Counters and histograms of this process, keyed by (metric, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) -> value
+        self._histograms = {}   # (name, labels) -> [count per bucket..., count above, sum]
+        self._caches = {}       # label -> LRUCache
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        i = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+            h[i] += 1
+            h[-1] += seconds
+
+    def reset(self):
+        # also called in a freshly forked child, where the old lock may be held by a thread that is gone
+        self._lock = threading.Lock()
+        self._counters, self._histograms = {}, {}
+
+    def register_cache(self, label, cache):
+        with self._lock:
+            self._caches[label] = cache
+
+    def snapshot(self):
+        """This process' numbers as JSON-able lists of [name, labels, value]."""
+        with self._lock:
+            counters = [[n, list(l), v] for (n, l), v in self._counters.items()]
+            histograms = [[n, list(l), list(h)] for (n, l), h in self._histograms.items()]
+            caches = list(self._caches.items())
+        gauges = []
+        for label, cache in caches:
+            s = cache.stats()
+            labels = [["cache", label]]
+            counters += [["smartshop_cache_hits_total", labels, s["hits"]],
+                         ["smartshop_cache_misses_total", labels, s["misses"]],
+                         ["smartshop_cache_evictions_total", labels, s["evictions"]]]
+            gauges += [["smartshop_cache_entries", labels, s["size"]],
+                       ["smartshop_cache_bytes", labels, s["bytes"]]]
+        return {"pid": os.getpid(), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+
+REGISTRY = Registry()
+if hasattr(os, "register_at_fork"):
+    # a forked worker starts from zero, so what the master did before forking is not counted once per worker
+    os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+def register_cache(label, cache):
+    """Export an LRUCache's counters under cache="<label>"."""
+    REGISTRY.register_cache(label, cache)
+
+
+def record_span(name, seconds):
+    if not ENABLED:
+        return
+    REGISTRY.observe("smartshop_span_seconds", (("span", name),), seconds)
+    trace = _trace.get()
+    if trace is not None:
+        t = trace.get(name)
+        if t is None:
+            trace[name] = [1, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+
+
+class span:
+    """Context manager timing a block as span `name`."""
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_span(self.name, perf_counter() - self.start)
+
+
+def timed(name):
+    """Decorator timing every call of a function as span `name`."""
+
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_span(name, perf_counter() - start)
+        return wrapper
+    return deco
+
+
+# ---- per-worker snapshots -------------------------------------------------
+
+_flusher = {"pid": None, "dirty": False}
+_flusher_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def _alive(pid):
+    if os.name != "posix":
+        return True  # os.kill(pid, 0) would terminate the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def flush():
+    """Write this process' snapshot to METRICS_DIR now."""
+    if METRICS_DIR is None:
+        return
+    with _write_lock:
+        folder = Path(METRICS_DIR)
+        folder.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(REGISTRY.snapshot(), f)
+        os.replace(tmp, folder / f"{os.getpid()}.json")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        if _flusher["dirty"]:
+            _flusher["dirty"] = False
+            try:
+                flush()
+            except OSError:
+                _flusher["dirty"] = True
+
+
+def touch():
+    """Note that this process has new numbers; its flusher thread writes them within FLUSH_INTERVAL."""
+    if METRICS_DIR is None:
+        return
+    _flusher["dirty"] = True
+    if _flusher["pid"] != os.getpid():
+        with _flusher_lock:
+            if _flusher["pid"] != os.getpid():
+                _flusher["pid"] = os.getpid()
+                threading.Thread(target=_flush_loop, name="smartshop-metrics", daemon=True).start()
+
+
+def snapshots():
+    """This process' snapshot plus the last one written by every other worker."""
+    own = REGISTRY.snapshot()
+    out = [own]
+    if METRICS_DIR is None:
+        return out
+    for path in Path(METRICS_DIR).glob("*.json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue  # removed or being replaced
+        if snap.get("pid") == own["pid"]:
+            continue
+        if not _alive(snap.get("pid")):
+            snap["gauges"] = []
+        out.append(snap)
+    return out
+
+
+# ---- Prometheus text format -----------------------------------------------
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v):
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def render(snaps):
+    """Prometheus exposition of the sum of `snaps` (see Registry.snapshot())."""
+    values, hists = {}, {}
+    for snap in snaps:
+        for name, labels, v in snap["counters"] + snap["gauges"]:
+            key = (name, tuple(map(tuple, labels)))
+            values[key] = values.get(key, 0) + v
+        for name, labels, h in snap["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            acc = hists.get(key)
+            hists[key] = list(h) if acc is None else [a + b for a, b in zip(acc, h)]
+    for (name, labels), hits in list(values.items()):
+        if name == "smartshop_cache_hits_total":
+            lookups = hits + values.get(("smartshop_cache_misses_total", labels), 0)
+            if lookups:
+                values[("smartshop_cache_hit_ratio", labels)] = round(hits / lookups, 4)
+
+    series = {}
+    for (name, labels), v in sorted(values.items()):
+        series.setdefault(name, []).append(f"{name}{_labels(labels)} {_num(v)}")
+    for (name, labels), h in sorted(hists.items()):
+        lines = series.setdefault(name, [])
+        total = 0
+        for bound, n in zip(BUCKETS + ("+Inf",), h[:-1]):
+            total += n
+            lines.append(f"{name}_bucket{_labels(labels + (('le', _num(bound) if bound != '+Inf' else bound),))} {total}")
+        lines.append(f"{name}_sum{_labels(labels)} {_num(h[-1])}")
+        lines.append(f"{name}_count{_labels(labels)} {total}")
+    out = []
+    for name in sorted(series):
+        kind, text = HELP.get(name, ("untyped", ""))
+        out += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"] + series[name]
+    return "\n".join(out) + "\n"
+
+
+# ---- Flask wiring -----------------------------------------------------------
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with jsonify() timed as span json.serialize."""
+
+    def response(self, *args, **kwargs):
+        with span("json.serialize"):
+            return super().response(*args, **kwargs)
+
+
+def _before():
+    g.smartshop_started = perf_counter()
+    g.smartshop_trace = _trace.set({})
+
+
+def _after(resp):
+    started = g.pop("smartshop_started", None)
+    if started is None:
+        return resp
+    seconds = perf_counter() - started
+    trace = _trace.get()
+    _trace.reset(g.pop("smartshop_trace"))
+    endpoint = request.endpoint or "unmatched"
+    REGISTRY.observe("smartshop_request_seconds", (("endpoint", endpoint), ("method", request.method)), seconds)
+    REGISTRY.inc("smartshop_requests_total", (("endpoint", endpoint), ("method", request.method),
+                                              ("status", str(resp.status_code))))
+    if request.content_length:
+        REGISTRY.inc("smartshop_request_bytes_total", (("endpoint", endpoint),), request.content_length)
+    if resp.content_length:
+        REGISTRY.inc("smartshop_response_bytes_total", (("endpoint", endpoint),), resp.content_length)
+    if SLOW_MS and seconds * 1000 >= SLOW_MS:
+        REGISTRY.inc("smartshop_slow_requests_total", (("endpoint", endpoint),))
+        log.warning("slow request %s", json.dumps({
+            "method": request.method, "path": request.path, "query": request.query_string.decode("latin-1"),
+            "endpoint": endpoint, "status": resp.status_code, "ms": round(seconds * 1000, 2),
+            "spans": {name: {"calls": n, "ms": round(s * 1000, 2)} for name, (n, s) in (trace or {}).items()},
+        }))
+    touch()
+    return resp
+
+
+def metrics_view():
+    flush()
+    return Response(render(snapshots()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def instrument(app):
+    """Time `app`'s requests and serve /metrics; a no-op with SMARTSHOP_METRICS=0."""
+    if not ENABLED:
+        return app
+    app.json = TimedJSONProvider(app)
+    app.before_request(_before)
+    app.after_request(_after)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    return app
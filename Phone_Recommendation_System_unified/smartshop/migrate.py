@@ -0,0 +1,42 @@
+"""
+One-shot migration of the modules' JSON data files into SQLite.
+
+    python -m smartshop.migrate            # copy records that are not in the DB yet
+    python -m smartshop.migrate --replace  # overwrite DB rows from the JSON files
+
+Run from the project root. The DB location follows SMARTSHOP_DB (see storage.py).
+Afterwards start the modules with SMARTSHOP_STORAGE=sqlite.
+"""
+from pathlib import Path
+import argparse
+
+from .logstore import LogStore
+from .schema import SCHEMAS
+from .sqlstore import SqliteStore, import_records
+from .storage import db_path_for
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SOURCES = {
+    "listings": ROOT / "buyandsell" / "data" / "listings.json",
+    "reviews": ROOT / "reviews" / "data" / "reviews.json",
+    "notifications": ROOT / "upcomingphone" / "data" / "notifications.json",
+    "dispatches": ROOT / "upcomingphone" / "data" / "dispatches.json",
+}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--replace", action="store_true", help="overwrite rows that already exist")
+    args = ap.parse_args(argv)
+    for name, json_path in SOURCES.items():
+        schema = SCHEMAS[name]
+        db = db_path_for(json_path)
+        store = SqliteStore(db, schema)
+        records = LogStore(json_path, key=schema.key).all()
+        n = import_records(store, records, replace=args.replace)
+        print(f"{name}: {n} of {len(records)} records written to {db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Forecasting model registry and rolling-origin backtest (salesprediction).
+
+Every model is a function  model(Y, origins, h, m) -> [series x origins x h]
+that, for each origin o, forecasts Y[:, o:o+h] from Y[:, :o] only. Y holds
+equal-length series (one per row) and m is the season length. Models work
+on all series and all origins at once, so a backtest costs one call per
+model rather than one fit per series, fold and model.
+
+    linear           trend line y = a*t + b (what simple_forecast() fits)
+    seasonal_naive   repeat the last observed season
+    holt_winters     additive Holt-Winters; (alpha, beta, gamma) picked per
+                     series and origin from a grid by one-step error so far
+    seasonal_linear  trend line plus one offset per season position
+
+Register more with @register("name").
+"""
+import time
+
+import numpy as np
+
+MODELS = {}
+
+# season length per resampling frequency
+SEASONS = {"D": 7, "W": 52, "M": 12}
+
+
+def register(name):
+    def deco(fn):
+        MODELS[name] = fn
+        return fn
+    return deco
+
+
+@register("linear")
+def linear(Y, origins, h, m):
+    S, L = Y.shape
+    t = np.arange(L, dtype=float)
+    cy = np.cumsum(Y, axis=1)
+    cty = np.cumsum(Y * t, axis=1)
+    out = np.empty((S, len(origins), h))
+    steps = np.arange(h, dtype=float)
+    for k, o in enumerate(origins):
+        n = float(o)
+        st, stt = n * (n - 1) / 2, (n - 1) * n * (2 * n - 1) / 6
+        sy, sty = cy[:, o - 1], cty[:, o - 1]
+        den = n * stt - st * st
+        a = (n * sty - st * sy) / den if den > 0 else np.zeros(S)
+        b = (sy - a * st) / n
+        out[:, k, :] = a[:, None] * (o + steps)[None, :] + b[:, None]
+    return out
+
+
+@register("seasonal_naive")
+def seasonal_naive(Y, origins, h, m):
+    out = np.empty((Y.shape[0], len(origins), h))
+    for k, o in enumerate(origins):
+        if o >= m:
+            idx = o - m + (np.arange(h) % m)
+        else:
+            idx = np.full(h, o - 1)
+        out[:, k, :] = Y[:, idx]
+    return out
+
+
+def _seasonal_design(t, m):
+    """Rows [1, t, one-hot season position 1..m-1] for the time indexes `t`."""
+    X = np.zeros((len(t), 1 + m))
+    X[:, 0] = 1.0
+    X[:, 1] = t
+    pos = t.astype(int) % m
+    rows = np.flatnonzero(pos > 0)
+    X[rows, 1 + pos[rows]] = 1.0
+    return X
+
+
+@register("seasonal_linear")
+def seasonal_linear(Y, origins, h, m):
+    S, L = Y.shape
+    X = _seasonal_design(np.arange(L + h, dtype=float), m)
+    out = np.empty((S, len(origins), h))
+    for k, o in enumerate(origins):
+        # least squares for every series at once: beta = Y pinv(X)^T
+        beta = Y[:, :o] @ np.linalg.pinv(X[:o]).T
+        out[:, k, :] = beta @ X[o:o + h].T
+    return out
+
+
+HW_GRID = np.array([(a, b, g)
+                    for a in (0.1, 0.2, 0.4, 0.6, 0.8)
+                    for b in (0.0, 0.05, 0.2)
+                    for g in (0.05, 0.15, 0.4)])
+
+
+@register("holt_winters")
+def holt_winters(Y, origins, h, m):
+    S, L = Y.shape
+    if L < 2 * m:
+        m = 1
+    G = len(HW_GRID)
+    alpha, beta, gamma = HW_GRID[:, 0], HW_GRID[:, 1], HW_GRID[:, 2]
+    if m == 1:
+        gamma = np.zeros(G)
+    start = 2 * m if m > 1 else 2
+    # initial state from the first two seasons, for every (series, grid point)
+    first = Y[:, :m].mean(axis=1)
+    second = Y[:, m:2 * m].mean(axis=1) if L >= 2 * m else first
+    level = np.repeat(first[:, None], G, axis=1)
+    trend = np.repeat(((second - first) / m)[:, None], G, axis=1)
+    season = np.repeat((Y[:, :m] - first[:, None])[:, None, :], G, axis=1)
+    if m == 1:
+        season[:] = 0.0
+    sse = np.zeros((S, G))  # one-step squared error so far, per grid point
+    want = {o: k for k, o in enumerate(origins)}
+    out = np.empty((S, len(origins), h))
+    steps = np.arange(1, h + 1, dtype=float)
+
+    def emit(o, k):
+        if o < start:
+            out[:, k, :] = Y[:, o - 1][:, None]
+            return
+        g = np.argmin(sse, axis=1)
+        rows = np.arange(S)
+        lv, tr, se = level[rows, g], trend[rows, g], season[rows, g]
+        pos = (o + np.arange(h)) % m
+        out[:, k, :] = lv[:, None] + steps[None, :] * tr[:, None] + se[:, pos]
+
+    # the state before step t has seen Y[:, :t] only, so origin t is emitted first
+    for t in range(m, L):
+        if t in want and t >= start:
+            emit(t, want[t])
+        y = Y[:, t][:, None]
+        pos = t % m
+        s_old = season[:, :, pos]
+        pred = level + trend + s_old
+        if t >= start:
+            sse += (y - pred) ** 2
+        new_level = alpha * (y - s_old) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        season[:, :, pos] = gamma * (y - new_level) + (1 - gamma) * s_old
+        level = new_level
+    for o, k in want.items():
+        if o >= L or o < start:
+            emit(o, k)
+    return out
+
+
+def season_for(freq, length, h):
+    """Season length to use: the frequency's, if the series has two seasons before the last h points."""
+    m = SEASONS.get(freq, 1)
+    return m if length - h >= 2 * m else 1
+
+
+def backtest(Y, freq, h, folds=3, models=None):
+    """
+    Rolling-origin evaluation of `models` (default: all) on equal-length
+    series Y: forecast the last `folds` non-overlapping blocks of h points
+    from everything before them, then forecast h points past the end.
+
+    Returns (scores, best): scores[name] has per-series arrays "rmse",
+    "mape" (percent, over non-zero actuals; NaN when no fold fits) and
+    "forecast" (the final h points), plus "seconds" for the whole call.
+    best is the per-series model name with the lowest RMSE.
+    """
+    S, L = Y.shape
+    names = list(models or MODELS)
+    m = season_for(freq, L, h)
+    min_train = max(3, 2 * m)
+    origins = [L - h * j for j in range(folds, 0, -1) if L - h * j >= min_train]
+    if origins:
+        actual = np.stack([Y[:, o:o + h] for o in origins], axis=1)
+    scores = {}
+    for name in names:
+        started = time.perf_counter()
+        pred = MODELS[name](Y, origins + [L], h, m) if L >= 2 else np.repeat(Y[:, -1:], h, axis=1)[:, None, :]
+        seconds = time.perf_counter() - started
+        res = {"forecast": pred[:, -1, :], "seconds": seconds,
+               "rmse": np.full(S, np.nan), "mape": np.full(S, np.nan)}
+        if origins:
+            err = pred[:, :-1, :] - actual
+            res["rmse"] = np.sqrt((err ** 2).mean(axis=(1, 2)))
+            nz = actual != 0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ape = np.where(nz, np.abs(err) / np.abs(np.where(nz, actual, 1.0)), 0.0)
+                res["mape"] = 100 * ape.sum(axis=(1, 2)) / nz.sum(axis=(1, 2))
+        scores[name] = res
+    rmse = np.stack([np.nan_to_num(scores[n]["rmse"], nan=np.inf) for n in names])
+    best_idx = np.argmin(rmse, axis=0)
+    fallback = names.index("linear") if "linear" in names else 0
+    best_idx = np.where(np.isfinite(rmse.min(axis=0)), best_idx, fallback)
+    return scores, [names[i] for i in best_idx]
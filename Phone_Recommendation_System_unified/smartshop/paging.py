@@ -0,0 +1,118 @@
+"""
+Cursor pagination and field projection for the list endpoints.
+
+    ?limit=20            page size (capped at MAX_LIMIT); without it the full list is returned
+    ?cursor=<opaque>     `next_cursor` from the previous page
+    ?fields=id,brand     only return these keys of each result
+
+Cursors are keyset cursors: they hold the sort key of the last row served
+(value + id or catalog position), and the next page starts strictly after
+it. Rows inserted elsewhere in the order therefore never shift or repeat
+rows on later pages. Relevance-ranked lists (text search without an
+explicit sort) have no stable key and use an offset cursor instead.
+"""
+from collections import namedtuple
+import base64, json
+
+MAX_LIMIT = 500
+
+Page = namedtuple("Page", "limit cursor fields")
+
+
+def encode_cursor(data):
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(s):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(s + "=" * (-len(s) % 4)))
+    except ValueError:
+        raise ValueError("invalid cursor")
+    if not isinstance(data, dict):
+        raise ValueError("invalid cursor")
+    k, o = data.get("k", []), data.get("o", 0)
+    if not isinstance(k, list) or not all(v is None or isinstance(v, (str, int, float)) for v in k):
+        raise ValueError("invalid cursor")
+    if not isinstance(o, int) or isinstance(o, bool) or o < 0:
+        raise ValueError("invalid cursor")
+    return data
+
+
+def page_args(args):
+    """Page from request.args; raises ValueError for a malformed cursor."""
+    limit = args.get("limit", type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_LIMIT))
+    cursor = args.get("cursor")
+    cursor = decode_cursor(cursor) if cursor else None
+    fields = [f.strip() for f in (args.get("fields") or "").split(",") if f.strip()] or None
+    return Page(limit, cursor, fields)
+
+
+def project(items, fields):
+    if not fields:
+        return items
+    return [{k: it[k] for k in fields if k in it} for it in items]
+
+
+def seek(items, key, after, desc=False):
+    """Index of the first item past `after` in a list sorted by key() (binary search)."""
+    after = list(after)
+    lo, hi = 0, len(items)
+    try:
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = key(items[mid])
+            if (k < after) if desc else (k > after):
+                hi = mid
+            else:
+                lo = mid + 1
+    except TypeError:
+        raise ValueError("invalid cursor")
+    return lo
+
+
+def paginate(items, page, key=None, desc=False):
+    """
+    One page of an already sorted in-memory list: (rows, next_cursor).
+    `key(item)` must return a list that increases (or decreases, with
+    desc) along the list; without a key an offset cursor is used.
+    """
+    if page.limit is None:
+        return items, None
+    cur = page.cursor or {}
+    if key is not None and "k" in cur:
+        start = seek(items, key, cur["k"], desc)
+    else:
+        start = cur.get("o", 0) if key is None else 0
+    rows = items[start:start + page.limit]
+    if start + page.limit >= len(items):
+        return rows, None
+    if key is not None:
+        return rows, encode_cursor({"k": key(rows[-1])})
+    return rows, encode_cursor({"o": start + page.limit})
+
+
+def find_page(store, page, order_by=None, desc=False, **query):
+    """
+    One page of store.find(): (rows, next_cursor). The limit and keyset
+    are pushed into the store, so the cost of a page does not depend on
+    how many rows match.
+    """
+    if page.limit is None:
+        return store.find(order_by=order_by, desc=desc, **query), None
+    cur = page.cursor or {}
+    if order_by:
+        if cur.get("k") is not None and len(cur["k"]) != 2:  # store sort keys are (value, id)
+            raise ValueError("invalid cursor")
+        rows = store.find(order_by=order_by, desc=desc, limit=page.limit + 1, after=cur.get("k"), **query)
+    else:
+        offset = cur.get("o", 0)
+        rows = store.find(limit=page.limit + 1, offset=offset, **query)
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    if order_by:
+        return rows, encode_cursor({"k": store.sort_key(rows[-1], order_by)})
+    return rows, encode_cursor({"o": offset + page.limit})
@@ -0,0 +1,259 @@
+"""
+Used-phone price index for buyandsell: sold prices per phone.
+
+For every (brand, model, condition) and every (brand, model), the index
+keeps the number of sales, their sum, min and max, and the 10th, 25th,
+50th, 75th and 90th percentiles of the prices. Up to EXACT_SALES sales the
+prices are kept sorted and the percentiles are exact (nearest rank); past
+that each percentile becomes a P² estimate (Jain & Chlamtac, 1985), seeded
+from the sorted prices, which updates in constant time and space per sale.
+
+A listing counts once, when it becomes a sold `sell` listing, at its
+`sold_price` (if the seller gave one) or else its asking price. With the
+JSON backend the index is a LogStore view (it sees every write, including
+other processes' log lines, and is rebuilt on a full reload); with SQLite
+each process tails the listings table by `sold_at`.
+
+    SMARTSHOP_PRICE_MIN_SALES  sales a (brand, model, condition) group needs
+                               before it is used instead of the whole model (default 3)
+"""
+from bisect import insort
+import math, os, threading
+
+from .logstore import LogStore
+from .text import normalize
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+MIN_SALES = int(os.environ.get("SMARTSHOP_PRICE_MIN_SALES") or 3)
+
+# Sales per group kept exactly before switching to P² estimates
+EXACT_SALES = 100
+
+
+def nearest_rank(values, p):
+    """The p-quantile of sorted `values` by the nearest-rank method."""
+    return values[max(0, math.ceil(p * len(values)) - 1)]
+
+
+class P2Quantile:
+    """Streaming estimate of one quantile `p` from five markers (P² algorithm)."""
+
+    def __init__(self, p):
+        self.p = p
+        self.q = []                                   # marker heights
+        self.n = [0, 1, 2, 3, 4]                      # marker positions
+        self.want = [0, 2 * p, 4 * p, 2 + 2 * p, 4]   # desired positions
+        self.step = [0, p / 2, p, (1 + p) / 2, 1]
+
+    @classmethod
+    def from_sorted(cls, p, values):
+        """An estimator that has seen sorted `values` (at least 5), markers placed at their exact quantiles."""
+        sketch = cls(p)
+        last = len(values) - 1
+        sketch.want = [last * f for f in sketch.step]
+        sketch.n = [round(w) for w in sketch.want]
+        for i in range(1, 5):  # markers need distinct positions
+            sketch.n[i] = max(sketch.n[i], sketch.n[i - 1] + 1)
+        for i in range(3, 0, -1):
+            sketch.n[i] = min(sketch.n[i], sketch.n[i + 1] - 1)
+        sketch.q = [values[i] for i in sketch.n]
+        return sketch
+
+    def add(self, x):
+        q, n = self.q, self.n
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.want[i] += self.step[i]
+        for i in (1, 2, 3):
+            d = self.want[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                h = self._parabolic(i, d)
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.q, self.n
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        if not self.q:
+            return None
+        if len(self.q) < 5:
+            # exact until there are enough samples for the markers
+            return nearest_rank(self.q, self.p)
+        return self.q[2]
+
+
+class PriceStats:
+    """Count, sum, min, max and percentiles (exact, then P²) of one group's sold prices."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = self.max = None
+        self.prices = []       # sorted, until EXACT_SALES is passed
+        self.sketches = None   # P2Quantile per QUANTILES after that
+
+    def add(self, price):
+        self.count += 1
+        self.total += price
+        self.min = price if self.min is None else min(self.min, price)
+        self.max = price if self.max is None else max(self.max, price)
+        if self.sketches is None:
+            insort(self.prices, price)
+            if len(self.prices) > EXACT_SALES:
+                self.sketches = [P2Quantile.from_sorted(p, self.prices) for p in QUANTILES]
+                self.prices = None
+            return
+        for s in self.sketches:
+            s.add(price)
+
+    def summary(self):
+        if self.sketches is None:
+            values = [nearest_rank(self.prices, p) for p in QUANTILES]
+        else:
+            values = [s.value() for s in self.sketches]
+        pct, floor = {}, self.min
+        for p, v in zip(QUANTILES, values):
+            # independent estimates can cross; keep them increasing and inside [min, max]
+            floor = min(max(v, floor), self.max)
+            pct[f"p{round(p * 100)}"] = round(floor, 2)
+        return {"count": self.count, "mean": round(self.total / self.count, 2),
+                "min": self.min, "max": self.max, "percentiles": pct}
+
+
+def sold_price(rec):
+    """The price a listing sold at if it is a sold `sell` listing with a positive price, else None."""
+    if rec is None or rec.get("status") != "sold" or (rec.get("type") or "sell") != "sell":
+        return None
+    try:
+        price = float(rec.get("sold_price") or rec.get("price") or 0)
+    except (TypeError, ValueError):
+        return None
+    return price if price > 0 else None
+
+
+def group_keys(brand, model, condition):
+    """(model_condition key, model key) for normalized brand/model/condition."""
+    brand, model, condition = normalize(brand), normalize(model), normalize(condition)
+    return (brand, model, condition), (brand, model, "")
+
+
+class PriceIndex:
+    """In-memory PriceStats per group; attach to a LogStore with add_view()."""
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._groups = {}
+
+    def apply(self, key, old, new):
+        price = sold_price(new)
+        if price is None or sold_price(old) is not None:
+            return  # only the sale itself counts (a sale cannot be taken out of the percentiles)
+        with self._lock:
+            for g in group_keys(new.get("brand"), new.get("model"), new.get("condition")):
+                self._groups.setdefault(g, PriceStats()).add(price)
+
+    def summary(self, group):
+        with self._lock:
+            stats = self._groups.get(group)
+            return stats.summary() if stats is not None else None
+
+
+class LogStorePrices:
+    """PriceIndex over a LogStore, caught up with the log before each read."""
+
+    def __init__(self, store):
+        self.store = store
+        self.index = PriceIndex()
+        store.add_view(self.index)
+
+    def summary(self, group):
+        self.store.refresh()
+        return self.index.summary(group)
+
+
+class SqlitePrices:
+    """
+    PriceIndex fed from a SqliteStore: sold listings are read in `sold_at`
+    order from the newest stamp seen, and each listing is counted once,
+    by id, however often its `sold_at` moves.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.index = PriceIndex()
+        self._last = ""        # newest sold_at applied
+        self._counted = set()  # ids of the listings in the index
+        self._lock = threading.Lock()
+
+    def _catch_up(self):
+        with self._lock:
+            rows = self.store.find(eq={"status": "sold"}, ge={"sold_at": self._last}, order_by="sold_at")
+            for rec in rows:
+                self._last = max(self._last, rec.get("sold_at") or "")
+                if rec.get("id") in self._counted:
+                    continue
+                self._counted.add(rec.get("id"))
+                self.index.apply(rec.get("id"), None, rec)
+
+    def summary(self, group):
+        self._catch_up()
+        return self.index.summary(group)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def price_index(store):
+    """The (process-wide) price index for a listings store from storage.open_store()."""
+    with _indexes_lock:
+        index = _indexes.get(id(store))
+        if index is None:
+            index = LogStorePrices(store) if isinstance(store, LogStore) else SqlitePrices(store)
+            _indexes[id(store)] = index
+        return index
+
+
+def suggest(index, brand, model, condition=""):
+    """
+    Price suggestion for a listing: the (brand, model, condition) group when
+    it has MIN_SALES sales, else every sale of the model. `basis` says which
+    was used (None when the model has never sold).
+    """
+    exact, whole = group_keys(brand, model, condition)
+    basis, stats = None, None
+    if exact[2]:
+        stats = index.summary(exact)
+        basis = "model_condition" if stats and stats["count"] >= MIN_SALES else None
+    if basis is None:
+        stats = index.summary(whole)
+        basis = "model" if stats else None
+    if stats is None:
+        return {"basis": None, "suggested_price": None, "low": None, "high": None, "sold": None}
+    pct = stats["percentiles"]
+    return {"basis": basis, "suggested_price": pct["p50"], "low": pct["p25"], "high": pct["p75"], "sold": stats}
@@ -0,0 +1,237 @@
+"""
+Weighted multi-spec scoring for comparephone.
+
+The catalog is kept as a float matrix (one row per phone, one column per
+spec in SPECS). Scoring a candidate set min-max normalizes every column
+across the candidates (flipped for specs where lower is better, 0.5 when
+all candidates are equal) and takes the weighted sum, all in NumPy. With
+two candidates this is exactly the pairwise /api/compare score.
+"""
+import copy
+
+import numpy as np
+
+from .catalog import CatalogSnapshot, PhoneCatalog
+from .columnar import as_table
+
+# Specs to consider, with their default weights (they sum to 1)
+SPECS = {
+    "rating": {"higher_is_better": True, "weight": 0.30, "label":"Rating (out of 5)"},
+    "price": {"higher_is_better": False, "weight": 0.25, "label":"Price (INR)"},
+    "ram_gb": {"higher_is_better": True, "weight": 0.15, "label":"RAM (GB)"},
+    "storage_gb": {"higher_is_better": True, "weight": 0.10, "label":"Storage (GB)"},
+    "battery_mah": {"higher_is_better": True, "weight": 0.12, "label":"Battery (mAh)"},
+    "camera_mp": {"higher_is_better": True, "weight": 0.08, "label":"Camera (MP)"}
+}
+SPEC_KEYS = tuple(SPECS)
+
+
+def parse_weights(raw):
+    """
+    Weight vector (in SPEC_KEYS order, summing to 1) from a dict or a
+    "rating:3,price:2" string; specs not mentioned get weight 0. None or
+    empty means the default SPECS weights. Raises ValueError on bad input.
+    """
+    if not raw:
+        return np.array([SPECS[k]["weight"] for k in SPEC_KEYS])
+    if isinstance(raw, str):
+        pairs = [part.split(":", 1) for part in raw.split(",") if part.strip()]
+        if any(len(p) != 2 for p in pairs):
+            raise ValueError("weights must look like rating:3,price:2")
+        raw = {k.strip(): v for k, v in pairs}
+    if not isinstance(raw, dict):
+        raise ValueError("weights must be an object of spec -> number")
+    unknown = [k for k in raw if k not in SPECS]
+    if unknown:
+        raise ValueError("unknown spec(s) in weights: " + ", ".join(unknown))
+    try:
+        w = np.array([float(raw.get(k) or 0) for k in SPEC_KEYS])
+    except (TypeError, ValueError):
+        raise ValueError("weights must be numbers")
+    if not np.all(np.isfinite(w)) or np.any(w < 0) or w.sum() <= 0:
+        raise ValueError("weights must be non-negative and not all zero")
+    return w / w.sum()
+
+
+def reason(phone, label, value, other):
+    return f"{phone['brand']} {phone['model']} has better {label} ({value} vs {other})."
+
+
+class RankEngine:
+    """Spec matrix of one catalog snapshot plus vectorized scoring over it."""
+
+    def __init__(self, phones):
+        self.phones = phones = as_table(phones)
+        self.matrix = np.column_stack([phones.numbers(k) for k in SPEC_KEYS]).reshape(len(phones), len(SPEC_KEYS))
+        self.higher = np.array([SPECS[k]["higher_is_better"] for k in SPEC_KEYS])
+
+    def score(self, positions, weights):
+        """
+        (normalized spec scores [n x specs], total scores [n]) for the
+        phones at `positions`, normalized across exactly those phones.
+        """
+        X = self.matrix[positions]
+        if not len(X):
+            return X, np.zeros(0)
+        mn = X.min(axis=0)
+        mx = X.max(axis=0)
+        span = mx - mn
+        flat = span == 0
+        safe = np.where(flat, 1.0, span)
+        norm = np.where(self.higher, (X - mn) / safe, (mx - X) / safe)
+        norm[:, flat] = 0.5
+        return norm, (norm * weights).sum(axis=1)
+
+    def top(self, positions, weights, k):
+        """
+        The best `k` of `positions`: [(position, total, spec scores)],
+        highest total first, ties in catalog order.
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        norm, total = self.score(positions, weights)
+        total = total.round(9)  # equal scores tie exactly, whatever the summation order
+        if k < len(total):
+            # everything scoring at least the k-th best, so ties at the cut stay in catalog order
+            kth = np.partition(total, len(total) - k)[len(total) - k]
+            keep = np.flatnonzero(total >= kth)
+        else:
+            keep = np.arange(len(total))
+        keep = keep[np.lexsort((positions[keep], -total[keep]))][:k]
+        return [(int(positions[j]), float(total[j]), norm[j]) for j in keep]
+
+    def compare(self, i, j, weights):
+        """The /api/compare result body for the phones at positions i and j."""
+        p1, p2 = self.phones[i], self.phones[j]
+        norm, total = self.score([i, j], weights)
+        per_spec = []
+        for c, key in enumerate(SPEC_KEYS):
+            s1, s2 = float(norm[0, c]), float(norm[1, c])
+            # decide winner for this spec
+            if abs(s1 - s2) < 1e-9:
+                winner = "tie"
+            elif s1 > s2:
+                winner = "left"
+            else:
+                winner = "right"
+            per_spec.append({
+                "spec": key,
+                "label": SPECS[key].get("label", key),
+                "left_value": float(self.matrix[i, c]),
+                "right_value": float(self.matrix[j, c]),
+                "left_score": round(s1, 3),
+                "right_score": round(s2, 3),
+                "winner": winner
+            })
+
+        score1 = round(float(total[0]) * 100, 2)
+        score2 = round(float(total[1]) * 100, 2)
+
+        # generate textual explanation
+        reasons = []
+        for ps in per_spec:
+            if ps["winner"] == "left":
+                reasons.append(reason(p1, ps["label"], ps["left_value"], ps["right_value"]))
+            elif ps["winner"] == "right":
+                reasons.append(reason(p2, ps["label"], ps["right_value"], ps["left_value"]))
+
+        # pick recommendation
+        if score1 == score2:
+            recommended = None
+            summary = "Both phones score equally based on the selected specs and weights."
+        elif score1 > score2:
+            recommended = {"id": p1["id"], "brand": p1["brand"], "model": p1["model"], "score": score1}
+            summary = f"Recommendation: {p1['brand']} {p1['model']} (score {score1} vs {score2}) because: " + " ".join(reasons[:3])
+        else:
+            recommended = {"id": p2["id"], "brand": p2["brand"], "model": p2["model"], "score": score2}
+            summary = f"Recommendation: {p2['brand']} {p2['model']} (score {score2} vs {score1}) because: " + " ".join(reasons[:3])
+
+        return {
+            "left": p1,
+            "right": p2,
+            "per_spec": per_spec,
+            "score_left": score1,
+            "score_right": score2,
+            "recommended": recommended,
+            "summary": summary,
+            "explanations": reasons
+        }
+
+    def rank(self, positions, weights, k):
+        """
+        Top-k body for /api/rank. Each result lists its per-spec scores and
+        the specs on which it beats the next phone in the ranking.
+        """
+        top = self.top(positions, weights, k)
+        results = []
+        for n, (i, total, norm) in enumerate(top):
+            p = self.phones[i]
+            per_spec = [{
+                "spec": key,
+                "label": SPECS[key]["label"],
+                "value": float(self.matrix[i, c]),
+                "score": round(float(norm[c]), 3),
+                "weight": round(float(weights[c]), 4),
+            } for c, key in enumerate(SPEC_KEYS)]
+            reasons = []
+            if n + 1 < len(top):
+                j, _, other = top[n + 1]
+                for c, key in enumerate(SPEC_KEYS):
+                    if norm[c] - other[c] > 1e-9:
+                        reasons.append(reason(p, SPECS[key]["label"], float(self.matrix[i, c]), float(self.matrix[j, c])))
+            results.append({"rank": n + 1, "phone": p, "score": round(total * 100, 2),
+                            "per_spec": per_spec, "explanations": reasons})
+        summary = None
+        if results:
+            best = results[0]
+            p = best["phone"]
+            summary = f"Recommendation: {p['brand']} {p['model']} (score {best['score']})"
+            if len(results) > 1:
+                runner = results[1]
+                summary += f" ahead of {runner['phone']['brand']} {runner['phone']['model']} ({runner['score']})"
+            if best["explanations"]:
+                summary += " because: " + " ".join(best["explanations"][:3])
+            else:
+                summary += "."
+        return {"results": results, "summary": summary}
+
+
+_FLIP = {"left": "right", "right": "left", "tie": "tie"}
+
+
+def swap_compare(body):
+    """A compare() body with the two phones' sides exchanged (scores are symmetric)."""
+    return {
+        **body,
+        "left": body["right"],
+        "right": body["left"],
+        "per_spec": [{
+            **ps,
+            "left_value": ps["right_value"], "right_value": ps["left_value"],
+            "left_score": ps["right_score"], "right_score": ps["left_score"],
+            "winner": _FLIP[ps["winner"]],
+        } for ps in body["per_spec"]],
+        "score_left": body["score_right"],
+        "score_right": body["score_left"],
+    }
+
+
+class RankedSnapshot(CatalogSnapshot):
+    """CatalogSnapshot that also carries the RankEngine for its phones."""
+
+    def __init__(self, phones, version):
+        super().__init__(phones, version)
+        self.engine = RankEngine(self.phones)
+
+    def with_values(self, phones, field, values, changed, version):
+        snap = super().with_values(phones, field, values, changed, version)
+        snap.engine = copy.copy(self.engine)
+        snap.engine.phones = snap.phones
+        if field in SPEC_KEYS:
+            snap.engine.matrix = self.engine.matrix.copy()
+            snap.engine.matrix[:, SPEC_KEYS.index(field)] = values
+        return snap
+
+
+class RankedCatalog(PhoneCatalog):
+    def build(self, records, version):
+        return RankedSnapshot(records, version)
@@ -0,0 +1,315 @@
+"""
+Review rating aggregates, and phone catalogs rated by them.
+
+For visible reviews with a 1-5 rating, the count, the rating sum and a
+1-5 histogram are kept per scope:
+
+    all         every review
+    model       per normalized phone model
+    city        per normalized city
+    model_city  per (model, city)
+
+They are maintained incrementally as reviews are posted or hidden, so a
+lookup never scans reviews. With the JSON backend RatingAggregates is a
+LogStore view (updated for every write, including other processes' log
+lines); with SQLite, triggers on the reviews table keep a `<table>_stats`
+table in step, visible to every process.
+
+LiveRatings gives phonefinder/comparephone catalog snapshots whose
+`rating` is the live review average (`rating_source=reviews`).
+"""
+import os, threading
+
+import numpy as np
+
+from .columnar import OverlayTable
+from .logstore import LogStore
+from .text import normalize
+
+SCOPES = ("all", "model", "city", "model_city")
+
+# Phones need at least this many visible reviews before the live average replaces their rating
+LIVE_MIN_REVIEWS = int(os.environ.get("SMARTSHOP_LIVE_RATING_MIN") or 1)
+
+
+def _cells(rec):
+    """(scope, model, city) keys a review counts towards."""
+    model, city = normalize(rec.get("model")), normalize(rec.get("city"))
+    return (("all", "", ""), ("model", model, ""), ("city", "", city), ("model_city", model, city))
+
+
+def _rating(rec):
+    """The review's rating if it counts (visible, 1..5), else None."""
+    if rec is None or rec.get("visible") is False:
+        return None
+    try:
+        r = int(rec.get("rating") or 0)
+    except (TypeError, ValueError):
+        return None
+    return r if 1 <= r <= 5 else None
+
+
+def count_sum(cell, min_rating=None):
+    """(count, rating sum) of a cell's reviews rated at least `min_rating`, from its histogram."""
+    if not cell:
+        return 0, 0
+    if not min_rating or min_rating <= 1:
+        return cell[0], cell[1]
+    ratings = range(min_rating, 6)
+    return sum(cell[2][r - 1] for r in ratings), sum(r * cell[2][r - 1] for r in ratings)
+
+
+def summary(cell):
+    """Public form of a (count, sum, histogram) cell."""
+    count, total, hist = cell or (0, 0, (0, 0, 0, 0, 0))
+    return {"count": count, "sum": total, "avg_rating": round(total / count, 2) if count else None,
+            "histogram": {str(r): hist[r - 1] for r in range(1, 6)}}
+
+
+class RatingAggregates:
+    """In-memory aggregates; attach to a LogStore with add_view()."""
+
+    def __init__(self):
+        self._cells = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def reset(self):
+        with self._lock:
+            self._cells = {}
+            self.version += 1
+
+    def _add(self, rec, rating, sign):
+        for key in _cells(rec):
+            count, total, hist = self._cells.get(key) or (0, 0, (0, 0, 0, 0, 0))
+            hist = list(hist)
+            hist[rating - 1] += sign
+            if count + sign:
+                self._cells[key] = (count + sign, total + sign * rating, tuple(hist))
+            else:
+                self._cells.pop(key, None)
+
+    def apply(self, key, old, new):
+        r_old, r_new = _rating(old), _rating(new)
+        if r_old is None and r_new is None:
+            return
+        with self._lock:
+            if r_old is not None:
+                self._add(old, r_old, -1)
+            if r_new is not None:
+                self._add(new, r_new, 1)
+            self.version += 1
+
+    def cell(self, scope, model="", city=""):
+        with self._lock:
+            return self._cells.get((scope, model, city))
+
+    def group(self, scope):
+        """{(model, city): cell} for every group in `scope`."""
+        with self._lock:
+            return {(m, c): cell for (s, m, c), cell in self._cells.items() if s == scope}
+
+
+class LogStoreRatings:
+    """RatingAggregates over a LogStore, caught up with the log before each read."""
+
+    def __init__(self, store):
+        self.store = store
+        self.agg = RatingAggregates()
+        store.add_view(self.agg)
+
+    def version(self):
+        self.store.refresh()
+        return self.agg.version
+
+    def cell(self, scope, model="", city=""):
+        self.store.refresh()
+        return self.agg.cell(scope, model, city)
+
+    def group(self, scope):
+        self.store.refresh()
+        return self.agg.group(scope)
+
+
+class SqliteRatings:
+    """Aggregates in a SQLite table kept up to date by triggers on the store's table."""
+
+    def __init__(self, store):
+        self.store = store
+        self.table = store.table
+        self.stats = f"{store.table}_stats"
+        c = store._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            fresh = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (self.stats,)).fetchone() is None
+            c.execute(f"CREATE TABLE IF NOT EXISTS {self.stats} (scope TEXT, model TEXT, city TEXT, "
+                      f"n INTEGER, total INTEGER, r1 INTEGER, r2 INTEGER, r3 INTEGER, r4 INTEGER, r5 INTEGER, "
+                      f"PRIMARY KEY (scope, model, city))")
+            for name, event, row, sign in (("ins", "INSERT", "NEW", 1), ("del", "DELETE", "OLD", -1),
+                                           ("upd_old", "UPDATE", "OLD", -1), ("upd_new", "UPDATE", "NEW", 1)):
+                c.execute(f"CREATE TRIGGER IF NOT EXISTS {self.stats}_{name} AFTER {event} ON {self.table} "
+                          f"WHEN {row}.visible = 1 AND {row}.rating BETWEEN 1 AND 5 "
+                          f"BEGIN {self._upserts(row, sign)} END")
+            if fresh:
+                self._backfill(c)
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+
+    def _upserts(self, row, sign):
+        keys = (("'all'", "''", "''"), ("'model'", f"{row}.model", "''"),
+                ("'city'", "''", f"{row}.city"), ("'model_city'", f"{row}.model", f"{row}.city"))
+        hist = ", ".join(f"{sign} * ({row}.rating = {r})" for r in range(1, 6))
+        sql = "".join(
+            f"INSERT INTO {self.stats} VALUES ({s}, {m}, {c}, {sign}, {sign} * {row}.rating, {hist}) "
+            f"ON CONFLICT (scope, model, city) DO UPDATE SET n = n + excluded.n, total = total + excluded.total, "
+            + ", ".join(f"r{r} = r{r} + excluded.r{r}" for r in range(1, 6)) + "; "
+            for s, m, c in keys)
+        # change counter, so readers can tell when derived data is stale
+        sql += f"INSERT INTO {self.stats} VALUES ('version', '', '', 1, 0, 0, 0, 0, 0, 0) " \
+               f"ON CONFLICT (scope, model, city) DO UPDATE SET n = n + 1;"
+        return sql
+
+    def _backfill(self, c):
+        hist = ", ".join(f"SUM(rating = {r})" for r in range(1, 6))
+        where = f"FROM {self.table} WHERE visible = 1 AND rating BETWEEN 1 AND 5"
+        c.execute(f"DELETE FROM {self.stats}")
+        for scope, m, ct, group in (("all", "''", "''", " GROUP BY 1"), ("model", "model", "''", " GROUP BY model"),
+                                    ("city", "''", "city", " GROUP BY city"),
+                                    ("model_city", "model", "city", " GROUP BY model, city")):
+            c.execute(f"INSERT INTO {self.stats} SELECT '{scope}', {m}, {ct}, COUNT(*), SUM(rating), {hist} "
+                      f"{where}{group} HAVING COUNT(*) > 0")
+
+    def version(self):
+        row = self.store._conn().execute(f"SELECT n FROM {self.stats} WHERE scope = 'version'").fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _cell(row):
+        return (row[0], row[1], tuple(row[2:])) if row and row[0] else None
+
+    def cell(self, scope, model="", city=""):
+        row = self.store._conn().execute(
+            f"SELECT n, total, r1, r2, r3, r4, r5 FROM {self.stats} WHERE scope = ? AND model = ? AND city = ?",
+            (scope, model, city)).fetchone()
+        return self._cell(row)
+
+    def group(self, scope):
+        rows = self.store._conn().execute(
+            f"SELECT model, city, n, total, r1, r2, r3, r4, r5 FROM {self.stats} WHERE scope = ? AND n > 0",
+            (scope,))
+        return {(r[0], r[1]): self._cell(r[2:]) for r in rows}
+
+
+_ratings = {}
+_ratings_lock = threading.Lock()
+
+
+def rating_stats(store):
+    """The (process-wide) aggregates for a reviews store from storage.open_store()."""
+    with _ratings_lock:
+        stats = _ratings.get(id(store))
+        if stats is None:
+            stats = LogStoreRatings(store) if isinstance(store, LogStore) else SqliteRatings(store)
+            _ratings[id(store)] = stats
+        return stats
+
+
+def lookup(stats, model="", city=""):
+    """summary() of the narrowest scope covering the given (normalized) model and city."""
+    scope = "model_city" if model and city else "model" if model else "city" if city else "all"
+    return summary(stats.cell(scope, model or "", city or ""))
+
+
+def rating_source(value):
+    """`rating_source` request value (default SMARTSHOP_RATING_SOURCE, else catalog)."""
+    source = normalize(value or os.environ.get("SMARTSHOP_RATING_SOURCE") or "catalog")
+    if source not in ("catalog", "reviews"):
+        raise ValueError("rating_source must be catalog or reviews")
+    return source
+
+
+class LiveRatings:
+    """
+    Snapshots of a phone catalog index (PhoneCatalog, RankedCatalog) with
+    `rating` replaced by the average of visible reviews, for phones with
+    at least LIVE_MIN_REVIEWS of them; such phones also get
+    `review_count`. Reviews match a phone by model, with or without the
+    brand.
+
+    A live snapshot shares the catalog snapshot's records and indexes: the
+    live ratings are an overlay (see columnar.OverlayTable), and when the
+    reviews change only the phones of models whose aggregates moved are
+    patched, along with the rating sort orders (CatalogSnapshot.with_values).
+    """
+
+    def __init__(self, catalog, reviews):
+        self.catalog = catalog
+        self.reviews = reviews
+        self._stats = None
+        self._key = None
+        self._snapshot = None
+        self._base = None      # catalog snapshot the overlay is over
+        self._models = None    # normalized model / "brand model" -> positions, for _base
+        self._cells = {}       # model aggregates the current snapshot reflects
+        self._lock = threading.Lock()
+
+    def stats(self):
+        if self._stats is None:
+            self._stats = rating_stats(self.reviews)
+        return self._stats
+
+    def get(self):
+        base = self.catalog.get()
+        stats = self.stats()
+        key = (base.version, stats.version())
+        if key != self._key:
+            with self._lock:
+                if key != self._key:
+                    self._snapshot = self._update(base, stats, key)
+                    self._key = key
+        return self._snapshot
+
+    @staticmethod
+    def _model_index(phones):
+        """Positions per normalized model and per normalized "brand model"."""
+        models, names = phones.factorize("model")
+        brands, makers = phones.factorize("brand")
+        index = {}
+
+        def group(codes, name):
+            order = np.argsort(codes, kind="stable")
+            values, starts = np.unique(codes[order], return_index=True)
+            for c, part in zip(values, np.split(order, starts[1:])):
+                index.setdefault(normalize(name(c)), []).append(part)
+
+        group(models, lambda c: names[c])
+        pairs = brands.astype(np.int64) * len(names) + models
+        group(pairs, lambda c: f"{makers[c // len(names)] or ''} {names[c % len(names)] or ''}")
+        return {name: np.concatenate(parts) for name, parts in index.items()}
+
+    def _update(self, base, stats, key):
+        cells = {m: cell for (m, _), cell in stats.group("model").items()}
+        if base is not self._base:
+            prev, self._base, self._models, old = base, base, self._model_index(base.phones), {}
+            rating = base.column("rating").copy()
+            count = np.zeros(len(base), dtype=np.int64)
+        else:
+            prev, old = self._snapshot, self._cells
+            rating = prev.phones.columns["rating"].copy()
+            count = prev.phones.columns["review_count"].copy()
+        moved = [m for m in cells.keys() | old.keys() if cells.get(m) != old.get(m)]
+        changed = np.unique(np.concatenate([self._models.get(m, ()) for m in moved] + [[]])).astype(np.intp)
+        phones = base.phones
+        for i in changed.tolist():
+            model = phones.value("model", i)
+            cell = cells.get(normalize(model)) or cells.get(normalize(f"{phones.value('brand', i) or ''} {model or ''}"))
+            if cell and cell[0] >= LIVE_MIN_REVIEWS:
+                rating[i], count[i] = round(cell[1] / cell[0], 2), cell[0]
+            else:
+                rating[i], count[i] = base.column("rating")[i], 0
+        self._cells = cells
+        table = OverlayTable(phones, {"rating": rating, "review_count": count}, count > 0)
+        return prev.with_values(table, "rating", rating, changed, "%s+r%s" % key)
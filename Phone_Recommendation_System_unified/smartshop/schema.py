@@ -0,0 +1,147 @@
+from itertools import islice
+
+from .paging import seek
+from .search import text_matches
+from .text import normalize
+
+
+def raw(v):
+    return "" if v is None else v
+
+
+def as_int(v):
+    try:
+        return int(v or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def as_float(v):
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def as_visible(v):
+    # records written before moderation existed have no flag: treat as visible
+    return 0 if v is False else 1
+
+
+class Schema:
+    """
+    Describes one record collection for the storage backends.
+      - columns:     queryable field -> function that normalizes the stored value
+                     (the same function is applied by the JSON store at query time
+                     and by the SQLite store when it writes the indexed column)
+      - text_fields: fields covered by the `q` text search
+      - indexes:     column tuples to create SQLite indexes on
+      - partitions:  columns the JSON store also buckets records by, so an
+                     equality filter on one only visits the matching records
+                     (e.g. visible reviews, however many are hidden)
+      - ranges:      columns the JSON store also keeps sorted, so a find()
+                     ordered by one reads a slice of it (bounded by its
+                     ge/le filters) instead of sorting every match
+    """
+
+    def __init__(self, table, columns, text_fields=(), indexes=(), key="id", partitions=(), ranges=()):
+        self.table = table
+        self.columns = columns
+        self.text_fields = tuple(text_fields)
+        self.indexes = tuple(indexes)
+        self.key = key
+        self.partitions = tuple(partitions)
+        self.ranges = tuple(ranges)
+
+    def value(self, rec, col):
+        return self.columns[col](rec.get(col))
+
+    def sort_key(self, rec, col):
+        # ties on the sort column are broken by id, so the order is total (keyset cursors)
+        return [self.value(rec, col), rec.get(self.key) or ""]
+
+
+SCHEMAS = {
+    "listings": Schema(
+        "listings",
+        columns={"status": raw, "type": raw, "city": normalize, "state": normalize, "posted_at": raw,
+                 "price": as_float, "sold_at": raw},
+        text_fields=("brand", "model", "description"),
+        indexes=[("status", "type", "posted_at"), ("city", "posted_at"), ("state", "posted_at"), ("posted_at",),
+                 ("status", "type", "price"), ("status", "price"), ("price",), ("sold_at",)],
+        ranges=("posted_at", "price"),
+    ),
+    "reviews": Schema(
+        "reviews",
+        columns={"model": normalize, "city": normalize, "rating": as_int, "created_at": raw, "visible": as_visible},
+        text_fields=("title", "body", "reviewer_name", "model"),
+        indexes=[("model", "created_at"), ("city", "created_at"), ("rating",), ("created_at",),
+                 ("visible", "model", "created_at"), ("visible", "city", "created_at"),
+                 ("visible", "rating", "created_at"), ("visible", "created_at")],
+        partitions=("visible",),
+    ),
+    "notifications": Schema(
+        "notifications",
+        columns={"phone_id": raw, "created_at": raw},
+        indexes=[("phone_id", "created_at", "id"), ("created_at",)],
+        partitions=("phone_id",),
+        ranges=("created_at",),
+    ),
+    # launch notification progress per (phone, event), see smartshop/fanout.py
+    "dispatches": Schema(
+        "dispatches",
+        columns={"phone_id": raw, "state": raw, "started_at": raw},
+        indexes=[("state",), ("started_at",)],
+    ),
+}
+
+
+def filter_records(schema, rows, eq=None, ge=None, text=None, order_by=None, desc=False,
+                   limit=None, after=None, offset=0, le=None):
+    """
+    In-Python version of the query the SQLite backend runs:
+    equality / lower-bound / upper-bound filters on schema columns, word-prefix `text`
+    search over schema.text_fields, a sort on (`order_by`, id), then the
+    page window: rows past the `after` sort key, `offset`, `limit`.
+    Empty filter values are ignored.
+    """
+    eq = {c: v for c, v in (eq or {}).items() if v not in (None, "")}
+    ge = {c: v for c, v in (ge or {}).items() if v not in (None, "")}
+    le = {c: v for c, v in (le or {}).items() if v not in (None, "")}
+    text = normalize(text)
+
+    def ok(rec):
+        for c, v in eq.items():
+            if schema.value(rec, c) != v:
+                return False
+        for c, v in ge.items():
+            if schema.value(rec, c) < v:
+                return False
+        for c, v in le.items():
+            if schema.value(rec, c) > v:
+                return False
+        if text and not text_matches(text, " ".join(str(rec.get(k, "")) for k in schema.text_fields)):
+            return False
+        return True
+
+    if not order_by and (offset or limit is not None):
+        # unsorted page: stop filtering once it is full
+        return list(islice((r for r in rows if ok(r)), offset, None if limit is None else offset + limit))
+    out = [r for r in rows if ok(r)]
+    if order_by:
+        key = lambda r: schema.sort_key(r, order_by)
+        out.sort(key=key, reverse=desc)
+        if after is not None:
+            out = out[seek(out, key, after, desc):]
+    if offset:
+        out = out[offset:]
+    if limit is not None:
+        out = out[:limit]
+    return out
+
+
+def summarize(schema, rows, col=None):
+    """(count, sum of `col`) over rows."""
+    if col is None:
+        return len(rows), 0
+    return len(rows), sum(schema.value(r, col) for r in rows)
@@ -0,0 +1,231 @@
+from bisect import bisect_left, insort
+import math, threading
+
+import numpy as np
+
+from .text import tokenize
+
+
+class SearchIndex:
+    """
+    Incrementally maintained inverted index for the `q` parameter.
+
+    Records are tokenized over `fields` (see smartshop.text.tokenize). Every
+    query word matches as a prefix ("gal" finds "galaxy"), all words must
+    match, and hits are ranked with BM25. add()/remove() update the
+    postings in place, so new reviews or listings are searchable without a
+    rebuild. Candidates come from the postings of the rarest query word,
+    so a search touches only documents that contain the query terms.
+    """
+
+    def __init__(self, fields, k1=1.2, b=0.75):
+        self.fields = tuple(fields)
+        self.k1 = k1
+        self.b = b
+        self._postings = {}   # term -> {doc_id: term frequency}
+        self._doc_terms = {}  # doc_id -> {term: tf}
+        self._doc_len = {}
+        self._total_len = 0
+        self._vocab = []      # sorted terms, for prefix lookups
+        self._seq = {}        # doc_id -> insertion number, breaks score ties
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def _terms(self, rec):
+        tf = {}
+        for k in self.fields:
+            for t in tokenize(str(rec.get(k, ""))):
+                tf[t] = tf.get(t, 0) + 1
+        return tf
+
+    def add(self, doc_id, rec):
+        """Index `rec` under `doc_id`, replacing any previous version."""
+        with self._lock:
+            self.remove(doc_id)
+            tf = self._terms(rec)
+            for t, n in tf.items():
+                post = self._postings.get(t)
+                if post is None:
+                    post = self._postings[t] = {}
+                    insort(self._vocab, t)
+                post[doc_id] = n
+            self._doc_terms[doc_id] = tf
+            self._seq.setdefault(doc_id, len(self._seq))
+            length = sum(tf.values())
+            self._doc_len[doc_id] = length
+            self._total_len += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            tf = self._doc_terms.pop(doc_id, None)
+            if tf is None:
+                return
+            for t in tf:
+                post = self._postings.get(t)
+                if post is not None:
+                    post.pop(doc_id, None)
+            self._total_len -= self._doc_len.pop(doc_id)
+
+    # view protocol used by LogStore.add_view()
+    def reset(self):
+        with self._lock:
+            self._postings, self._doc_terms, self._doc_len = {}, {}, {}
+            self._total_len = 0
+            self._vocab, self._seq = [], {}
+
+    def apply(self, doc_id, old, new):
+        if new is None:
+            self.remove(doc_id)
+        elif old is None or any(old.get(k) != new.get(k) for k in self.fields):
+            self.add(doc_id, new)
+
+    def _expand(self, word):
+        """Indexed terms starting with `word`."""
+        i = bisect_left(self._vocab, word)
+        out = []
+        while i < len(self._vocab) and self._vocab[i].startswith(word):
+            if self._postings[self._vocab[i]]:
+                out.append(self._vocab[i])
+            i += 1
+        return out
+
+    def search(self, q):
+        """[(doc_id, score)] for documents matching every word of `q`, best first."""
+        words = tokenize(q)
+        if not words:
+            return []
+        with self._lock:
+            n_docs = len(self._doc_len)
+            avg_len = (self._total_len / n_docs) if n_docs else 0.0
+            expanded = []
+            for w in words:
+                terms = self._expand(w)
+                if not terms:
+                    return []
+                expanded.append(terms)
+            # drive from the query word with the fewest postings
+            sizes = [sum(len(self._postings[t]) for t in terms) for terms in expanded]
+            order = sorted(range(len(words)), key=sizes.__getitem__)
+            candidates = set()
+            for t in expanded[order[0]]:
+                candidates.update(self._postings[t])
+            for i in order[1:]:
+                terms = expanded[i]
+                candidates = {d for d in candidates if any(d in self._postings[t] for t in terms)}
+                if not candidates:
+                    return []
+
+            scores = dict.fromkeys(candidates, 0.0)
+            for terms in expanded:
+                for t in terms:
+                    post = self._postings[t]
+                    df = len(post)
+                    idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+                    if len(post) <= len(candidates):
+                        hits = [(d, tf) for d, tf in post.items() if d in scores]
+                    else:
+                        hits = [(d, post[d]) for d in candidates if d in post]
+                    for d, tf in hits:
+                        norm = 1.0 - self.b + self.b * (self._doc_len[d] / avg_len if avg_len else 0.0)
+                        scores[d] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+            seq = self._seq
+            return sorted(scores.items(), key=lambda kv: (-kv[1], seq[kv[0]]))
+
+    def arrays(self):
+        """
+        Postings as arrays, for FrozenSearchIndex: (sorted terms, offsets,
+        docs, tfs, doc_len). Term i's documents are docs[offsets[i]:offsets[i+1]],
+        ascending; doc ids must be positions 0..n-1.
+        """
+        with self._lock:
+            terms = [t for t in self._vocab if self._postings[t]]
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            docs, tfs = [], []
+            for i, t in enumerate(terms):
+                post = sorted(self._postings[t].items())
+                docs.extend(d for d, _ in post)
+                tfs.extend(n for _, n in post)
+                offsets[i + 1] = len(docs)
+            doc_len = np.zeros(len(self._doc_len), dtype=np.int32)
+            for d, n in self._doc_len.items():
+                doc_len[d] = n
+            return terms, offsets, np.array(docs, dtype=np.int32), np.array(tfs, dtype=np.int32), doc_len
+
+
+class FrozenSearchIndex:
+    """
+    Read-only SearchIndex over postings arrays (see SearchIndex.arrays()),
+    e.g. memory-mapped from a columnar catalog snapshot. Same matching and
+    BM25 scores as the SearchIndex it was exported from, with no per-term
+    dicts to build at startup. `terms` is any sorted sequence of strings.
+    """
+
+    def __init__(self, terms, offsets, docs, tfs, doc_len, k1=1.2, b=0.75):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.total_len = int(doc_len.sum())
+        self.k1 = k1
+        self.b = b
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def _expand(self, word):
+        """Indexes of the terms starting with `word`."""
+        i = bisect_left(self.terms, word)
+        out = []
+        while i < len(self.terms) and self.terms[i].startswith(word):
+            out.append(i)
+            i += 1
+        return out
+
+    def _postings(self, t):
+        a, b = self.offsets[t], self.offsets[t + 1]
+        return self.docs[a:b], self.tfs[a:b]
+
+    def search(self, q):
+        """[(doc_id, score)] for documents matching every word of `q`, best first."""
+        words = tokenize(q)
+        if not words:
+            return []
+        n_docs = len(self.doc_len)
+        avg_len = (self.total_len / n_docs) if n_docs else 0.0
+        expanded = []
+        for w in words:
+            terms = self._expand(w)
+            if not terms:
+                return []
+            expanded.append(terms)
+        sizes = [sum(int(self.offsets[t + 1] - self.offsets[t]) for t in terms) for terms in expanded]
+        order = sorted(range(len(words)), key=sizes.__getitem__)
+        candidates = np.unique(np.concatenate([self._postings(t)[0] for t in expanded[order[0]]]))
+        for i in order[1:]:
+            docs = np.concatenate([self._postings(t)[0] for t in expanded[i]])
+            candidates = candidates[np.isin(candidates, docs)]
+            if not len(candidates):
+                return []
+
+        scores = np.zeros(len(candidates))
+        for terms in expanded:
+            for t in terms:
+                docs, tf = self._postings(t)
+                df = len(docs)
+                idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+                j = np.minimum(np.searchsorted(candidates, docs), len(candidates) - 1)
+                hit = candidates[j] == docs
+                d, tf = docs[hit], tf[hit].astype(float)
+                norm = 1.0 - self.b + self.b * (self.doc_len[d] / avg_len if avg_len else 0.0)
+                scores[j[hit]] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        ranked = np.lexsort((candidates, -scores))
+        return list(zip(candidates[ranked].tolist(), scores[ranked].tolist()))
+
+
+def text_matches(q, text):
+    """True if every word of `q` is a prefix of some word of `text` (un-indexed fallback)."""
+    words = tokenize(text)
+    return all(any(w.startswith(qw) for w in words) for qw in tokenize(q))
@@ -0,0 +1,98 @@
+from .filecache import JsonFileIndex
+from .geo import GeoGrid
+from .text import normalize
+
+
+class ShopSnapshot:
+    """
+    Inverted indexes over one version of shops.json (all map to shop positions):
+      - by_model: inventory model_id -> {positions}
+      - by_brand: normalized brand -> {positions}
+      - by_place: (state, city) -> {positions}, plus by_city / by_state for
+        queries that give only one of the two
+      - a GeoGrid over shop coordinates for near() (built on first use)
+    """
+
+    def __init__(self, shops, version):
+        self.shops = shops
+        self.version = version
+        self.by_model = {}
+        self.by_brand = {}
+        self.by_place = {}
+        self.by_city = {}
+        self.by_state = {}
+        for i, shop in enumerate(shops):
+            for mid in shop.get("inventory", []):
+                self.by_model.setdefault(mid, set()).add(i)
+            for b in shop.get("phone_brands", []):
+                self.by_brand.setdefault(normalize(b), set()).add(i)
+            city = normalize(shop.get("city"))
+            state = normalize(shop.get("state"))
+            self.by_place.setdefault((state, city), set()).add(i)
+            self.by_city.setdefault(city, set()).add(i)
+            self.by_state.setdefault(state, set()).add(i)
+        self._geo = None
+
+    def _matching(self, city="", state="", model_id=None, brand=""):
+        """Positions matching every given filter, or None when there are no filters."""
+        sets = []
+        if city and state:
+            sets.append(self.by_place.get((state, city), ()))
+        elif city:
+            sets.append(self.by_city.get(city, ()))
+        elif state:
+            sets.append(self.by_state.get(state, ()))
+        if model_id:
+            sets.append(self.by_model.get(model_id, ()))
+        elif brand:
+            sets.append(self.by_brand.get(brand, ()))
+
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return set(sets[0]).intersection(*sets[1:])
+
+    def query(self, city="", state="", model_id=None, brand=""):
+        """
+        Shops matching every given filter, in file order. `city`, `state` and
+        `brand` must already be normalized. As before, `brand` is only used
+        when no model_id is given.
+        """
+        hits = self._matching(city, state, model_id, brand)
+        if hits is None:
+            return list(self.shops)
+        return [self.shops[i] for i in sorted(hits)]
+
+    def locate(self, pincodes):
+        """
+        GeoGrid of shop positions: a shop's own lat/lon, else the centroid of
+        its pincode in `pincodes` (a PincodeTable snapshot); shops with
+        neither are left out.
+        """
+        geo = self._geo
+        if geo is None or geo[0] is not pincodes:
+            points = []
+            for shop in self.shops:
+                if shop.get("lat") is not None and shop.get("lon") is not None:
+                    points.append((float(shop["lat"]), float(shop["lon"])))
+                else:
+                    points.append(pincodes.get(str(shop.get("pincode") or "").strip()))
+            geo = self._geo = (pincodes, GeoGrid(points))
+        return geo[1]
+
+    def near(self, lat, lon, radius_km, pincodes, city="", state="", model_id=None, brand="", limit=None):
+        """
+        Shops within radius_km of (lat, lon) that match the query() filters,
+        nearest first, each with its `distance_km`.
+        """
+        hits = self.locate(pincodes).within(lat, lon, radius_km, self._matching(city, state, model_id, brand))
+        if limit is not None:
+            hits = hits[:limit]
+        return [{**self.shops[i], "distance_km": round(d, 2)} for d, i in hits]
+
+
+class ShopIndex(JsonFileIndex):
+    """shops.json indexed once per file version."""
+
+    def build(self, records, version):
+        return ShopSnapshot(records, version)
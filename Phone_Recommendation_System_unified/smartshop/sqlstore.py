@@ -0,0 +1,299 @@
+from pathlib import Path
+import json, os, sqlite3, threading
+
+from .logstore import Conflict, KeyExists, LogStore, matches
+from .metrics import timed
+from .schema import filter_records, summarize
+from .text import tokenize
+
+
+def fts_query(text):
+    """`q` as an FTS5 query: every word must match as a prefix."""
+    return " ".join('"%s"*' % t for t in tokenize(text))
+
+
+class SqliteStore:
+    """
+    Record store in a SQLite table (WAL mode). Each record is kept whole in
+    a JSON `doc` column; the schema's columns are copied out, normalized,
+    into indexed columns so find() filters and sorts inside SQLite. Text
+    search uses an FTS5 table over schema.text_fields when the SQLite
+    build has FTS5, and falls back to filtering in Python otherwise.
+
+    On first use an empty table is seeded from `seed` (the module's JSON
+    file, including anything still in its append log).
+    """
+
+    def __init__(self, db_path, schema, seed=None):
+        self.db_path = Path(db_path)
+        self.schema = schema
+        self.key = schema.key
+        self.table = schema.table
+        self.cols = list(schema.columns)
+        self.fts = bool(schema.text_fields)
+        self._local = threading.local()
+        self._init_db()
+        if seed is not None and self.count() == 0:
+            import_records(self, LogStore(seed, key=schema.key).all())
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid != os.getpid():
+            # inherited from the parent (gunicorn preload_app); never share across a fork
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        c = self._conn()
+        cols = "".join(", %s" % col for col in self.cols)
+        c.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                  f"(rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, doc TEXT NOT NULL{cols})")
+        self._add_columns(c)
+        # change counter per table, so readers can tell when cached results are stale
+        c.execute("CREATE TABLE IF NOT EXISTS smartshop_versions (tbl TEXT PRIMARY KEY, n INTEGER NOT NULL)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f"CREATE TRIGGER IF NOT EXISTS {self.table}_version_{event.lower()} AFTER {event} ON {self.table} "
+                      f"BEGIN INSERT INTO smartshop_versions VALUES ('{self.table}', 1) "
+                      f"ON CONFLICT (tbl) DO UPDATE SET n = n + 1; END")
+        for idx in self.schema.indexes:
+            name = f"{self.table}_{'_'.join(idx)}"
+            c.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {self.table} ({', '.join(idx)})")
+        if self.fts:
+            fields = ", ".join(self.schema.text_fields)
+            try:
+                c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table}_fts USING fts5({fields})")
+            except sqlite3.OperationalError:
+                self.fts = False  # SQLite built without FTS5
+
+    def _add_columns(self, c):
+        """Add schema columns that an older version of the table lacks, filled in from each doc."""
+        have = {row[1] for row in c.execute(f"PRAGMA table_info({self.table})")}
+        missing = [col for col in self.cols if col not in have]
+        if not missing:
+            return
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            have = {row[1] for row in c.execute(f"PRAGMA table_info({self.table})")}
+            missing = [col for col in self.cols if col not in have]  # another process may have won
+            for col in missing:
+                c.execute(f"ALTER TABLE {self.table} ADD COLUMN {col}")
+            sets = ", ".join("%s = ?" % col for col in missing)
+            for rowid, doc in c.execute(f"SELECT rowid, doc FROM {self.table}").fetchall():
+                rec = json.loads(doc)
+                c.execute(f"UPDATE {self.table} SET {sets} WHERE rowid = ?",
+                          [self.schema.value(rec, col) for col in missing] + [rowid])
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+
+    def _row_values(self, rec):
+        return [self.schema.value(rec, col) for col in self.cols]
+
+    def _write(self, c, rec, rowid=None):
+        doc = json.dumps(rec, ensure_ascii=False)
+        vals = self._row_values(rec)
+        if rowid is None:
+            cols = ", ".join(["id", "doc"] + self.cols)
+            marks = ", ".join("?" * (2 + len(self.cols)))
+            rowid = c.execute(f"INSERT INTO {self.table} ({cols}) VALUES ({marks})",
+                              [rec.get(self.key), doc] + vals).lastrowid
+        else:
+            sets = ", ".join(["doc = ?"] + ["%s = ?" % col for col in self.cols])
+            c.execute(f"UPDATE {self.table} SET {sets} WHERE rowid = ?", [doc] + vals + [rowid])
+            if self.fts:
+                c.execute(f"DELETE FROM {self.table}_fts WHERE rowid = ?", (rowid,))
+        if self.fts:
+            fields = self.schema.text_fields
+            c.execute(f"INSERT INTO {self.table}_fts (rowid, {', '.join(fields)}) "
+                      f"VALUES (?{', ?' * len(fields)})",
+                      [rowid] + [str(rec.get(k, "")) for k in fields])
+        return rowid
+
+    def count(self):
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def all(self):
+        rows = self._conn().execute(f"SELECT doc FROM {self.table} ORDER BY rowid")
+        return [json.loads(d) for (d,) in rows]
+
+    @timed("sqlite.get")
+    def get(self, key):
+        row = self._conn().execute(f"SELECT doc FROM {self.table} WHERE id = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def sort_key(self, rec, col):
+        return self.schema.sort_key(rec, col)
+
+    def version(self):
+        """A string that changes whenever the table does (in any process)."""
+        row = self._conn().execute("SELECT n FROM smartshop_versions WHERE tbl = ?", (self.table,)).fetchone()
+        return "%x" % (row[0] if row else 0)
+
+    def _where(self, eq, ge, text, le=None):
+        """(FROM source, [conditions], args, fts_match, py_text) for the filters."""
+        t = self.table
+        where, args = [], []
+        for col, v in (eq or {}).items():
+            if v not in (None, ""):
+                where.append(f"{t}.{col} = ?")
+                args.append(v)
+        for col, v in (ge or {}).items():
+            if v not in (None, ""):
+                where.append(f"{t}.{col} >= ?")
+                args.append(v)
+        for col, v in (le or {}).items():
+            if v not in (None, ""):
+                where.append(f"{t}.{col} <= ?")
+                args.append(v)
+        source, match, py_text = t, None, None
+        if text and self.fts:
+            match = fts_query(text)
+            if match:
+                # CROSS JOIN keeps the FTS index as the outer loop: left to itself SQLite may
+                # walk an equality index instead and re-run the MATCH for every row
+                source = f"{t}_fts CROSS JOIN {t} ON {t}.rowid = {t}_fts.rowid"
+                where.append(f"{t}_fts MATCH ?")
+                args.append(match)
+        elif text:
+            py_text = text
+        return source, where, args, match, py_text
+
+    @timed("sqlite.find")
+    def find(self, eq=None, ge=None, text=None, order_by=None, desc=False,
+             limit=None, after=None, offset=0, le=None):
+        """
+        Records matching equality (`eq`), lower-bound (`ge`) and upper-bound
+        (`le`) filters on schema columns plus the `text` search, sorted by (`order_by`, id).
+        With `text` and no `order_by`, results are ranked by FTS5 bm25().
+        `after` (a sort key from sort_key()), `offset` and `limit` select a
+        page inside SQLite. Empty filter values are ignored.
+        """
+        t = self.table
+        source, where, args, match, py_text = self._where(eq, ge, text, le)
+        order = f"{t}.rowid"
+        if match:
+            order = f"bm25({t}_fts), {t}.rowid"
+        if order_by:
+            op, direction = ("<", "DESC") if desc else (">", "ASC")
+            if after is not None:
+                where.append(f"({t}.{order_by} {op} ? OR ({t}.{order_by} = ? AND IFNULL({t}.id, '') {op} ?))")
+                args += [after[0], after[0], after[1]]
+            order = f"{t}.{order_by} {direction}, IFNULL({t}.id, '') {direction}"
+        sql = f"SELECT {t}.doc FROM {source}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY " + order
+        if py_text:
+            docs = [json.loads(d) for (d,) in self._conn().execute(sql, args)]
+            return filter_records(self.schema, docs, text=py_text, offset=offset, limit=limit)
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            args += [-1 if limit is None else limit, offset]
+        return [json.loads(d) for (d,) in self._conn().execute(sql, args)]
+
+    def stats(self, eq=None, ge=None, text=None, col=None, le=None):
+        """(number of matching records, sum of `col` over them), computed in SQLite."""
+        t = self.table
+        source, where, args, match, py_text = self._where(eq, ge, text, le)
+        if py_text:
+            return summarize(self.schema, self.find(eq=eq, ge=ge, le=le, text=text), col)
+        total = f"TOTAL({t}.{col})" if col else "0"
+        sql = f"SELECT COUNT(*), {total} FROM {source}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        n, s = self._conn().execute(sql, args).fetchone()
+        return n, (int(s) if float(s).is_integer() else s)
+
+    @timed("sqlite.insert")
+    def insert(self, rec):
+        """Add a new record; raises KeyExists if its key is taken (ids are never reused)."""
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            if rec.get(self.key) is not None and c.execute(
+                    f"SELECT 1 FROM {self.table} WHERE id = ?", (rec.get(self.key),)).fetchone():
+                raise KeyExists(rec.get(self.key))
+            self._write(c, rec)
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return rec
+
+    @timed("sqlite.update")
+    def update(self, key, fields, unless=None):
+        """Set `fields` on one record; returns the updated record or None if unknown. `unless` as in LogStore.update()."""
+        c = self._conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute(f"SELECT rowid, doc FROM {self.table} WHERE id = ?", (key,)).fetchone()
+            if row is None:
+                c.execute("ROLLBACK")
+                return None
+            old = json.loads(row[1])
+            if matches(old, unless):
+                raise Conflict(key)
+            rec = {**old, **fields}
+            self._write(c, rec, row[0])
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return rec
+
+    @timed("sqlite.update_many")
+    def update_many(self, keys, fields):
+        """Set `fields` on every known record in `keys` in one transaction; returns the updated records."""
+        c = self._conn()
+        out = []
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            for key in dict.fromkeys(keys):
+                row = c.execute(f"SELECT rowid, doc FROM {self.table} WHERE id = ?", (key,)).fetchone()
+                if row is not None:
+                    rec = {**json.loads(row[1]), **fields}
+                    self._write(c, rec, row[0])
+                    out.append(rec)
+            c.execute("COMMIT")
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        return out
+
+
+def import_records(store, records, replace=False):
+    """
+    Write `records` into a SqliteStore in one transaction. Records whose id
+    already exists are skipped unless `replace` is set (id-less records are
+    skipped when an identical one exists). Returns the number written.
+    """
+    c = store._conn()
+    n = 0
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        for rec in records:
+            rowid = None
+            key = rec.get(store.key)
+            if key is not None:
+                row = c.execute(f"SELECT rowid FROM {store.table} WHERE id = ?", (key,)).fetchone()
+                if row and not replace:
+                    continue
+                rowid = row[0] if row else None
+            elif c.execute(f"SELECT 1 FROM {store.table} WHERE id IS NULL AND doc = ?",
+                           (json.dumps(rec, ensure_ascii=False),)).fetchone():
+                continue  # legacy record without an id, already imported
+            store._write(c, rec, rowid)
+            n += 1
+        c.execute("COMMIT")
+    except BaseException:
+        c.execute("ROLLBACK")
+        raise
+    return n
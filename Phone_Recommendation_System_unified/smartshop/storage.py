@@ -0,0 +1,50 @@
+"""
+Backend selection for the modules' record collections (listings, reviews,
+notifications).
+
+    SMARTSHOP_STORAGE=json    (default) JSON snapshot + append log, see logstore.py
+    SMARTSHOP_STORAGE=sqlite  SQLite tables with indexes and FTS5, see sqlstore.py
+    SMARTSHOP_DB=<path>       SQLite file; defaults to smartshop.db next to the JSON file
+"""
+from pathlib import Path
+import os, threading
+
+from .logstore import LogStore
+from .schema import SCHEMAS
+
+
+def storage_backend():
+    return (os.environ.get("SMARTSHOP_STORAGE") or "json").strip().lower()
+
+
+def db_path_for(json_path):
+    return Path(os.environ.get("SMARTSHOP_DB") or Path(json_path).parent / "smartshop.db")
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(name, json_path):
+    """
+    Store for collection `name` (a key of SCHEMAS) using the configured
+    backend. Stores are shared per process, so modules mounted together in
+    gateway.py keep one in-memory view and one connection pool per file.
+    """
+    key = (name, Path(json_path).resolve(), storage_backend(), os.environ.get("SMARTSHOP_DB"))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = _open_store(name, json_path)
+    return store
+
+
+def _open_store(name, json_path):
+    schema = SCHEMAS[name]
+    backend = storage_backend()
+    if backend == "sqlite":
+        from .sqlstore import SqliteStore
+        return SqliteStore(db_path_for(json_path), schema, seed=json_path)
+    if backend != "json":
+        raise ValueError(f"unknown SMARTSHOP_STORAGE backend: {backend}")
+    return LogStore(json_path, schema=schema)
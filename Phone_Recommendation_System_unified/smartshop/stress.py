@@ -0,0 +1,209 @@
+"""
+Concurrent write stress test for the record stores.
+
+Client processes, each with several threads, hammer the mutating
+endpoints of a gateway: every iteration posts a review, posts a sell
+listing and marks it sold, and posts a launch reminder. Afterwards every
+id the server returned is read back through the list endpoints. The run
+fails (exit status 1) if an id was handed out twice, a write is missing,
+a sold listing is not sold or a request failed.
+
+    python -m smartshop.stress
+        starts gunicorn (SMARTSHOP_WORKERS workers) on a scratch copy of
+        the project, so the real data files are not touched
+    python -m smartshop.stress --storage sqlite
+        the same with SMARTSHOP_STORAGE=sqlite
+    python -m smartshop.stress --url http://127.0.0.1:8000
+        against a running gateway (this adds records to its data!)
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import argparse, json, os, random, shutil, socket, subprocess, sys, tempfile, time
+import urllib.error, urllib.request
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def call(base, method, path, body=None, timeout=60):
+    """(status, decoded JSON) of one request."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method,
+                                 headers={"Content-Type": "application/json"} if data else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def one_round(base, tag, n):
+    """One iteration of writes: ({kind: [ids]}, [errors], [latencies])."""
+    ids = {"reviews": [], "listings": [], "sold": [], "notifications": []}
+    errors, latencies = [], []
+
+    def post(path, body):
+        t = time.perf_counter()
+        try:
+            status, out = call(base, "POST", path, body)
+        except OSError as e:
+            status, out = None, None
+            errors.append(f"{path}: {e!r}")
+        latencies.append(time.perf_counter() - t)
+        if status is not None and (status != 200 or not out or out.get("status") != "ok"):
+            errors.append(f"{path}: HTTP {status}")
+            return None
+        return out
+
+    out = post("/reviews/api/reviews", {"reviewer_name": tag, "rating": n % 5 + 1, "body": f"stress {tag} {n}",
+                                        "model": "Stress Phone", "city": "Testville"})
+    if out:
+        ids["reviews"].append(out["review"]["id"])
+    out = post("/buyandsell/api/listings", {"type": "sell", "seller_name": tag, "contact_phone": "0", "brand": "Stress",
+                                            "model": "Phone", "condition": "Good", "price": 1000 + n,
+                                            "city": "Testville", "state": "Nowhere"})
+    if out:
+        lid = out["listing"]["id"]
+        ids["listings"].append(lid)
+        if post("/buyandsell/api/mark_sold", {"id": lid}):
+            ids["sold"].append(lid)
+    out = post("/upcomingphone/api/notify", {"phone_id": "STRESS", "name": tag, "contact": f"{tag}-{n}@example.com"})
+    if out:
+        ids["notifications"].append(out["entry"]["id"])
+    return ids, errors, latencies
+
+
+def client(base, tag, threads, iterations):
+    """Run `iterations` rounds on `threads` threads (in a client process); merged results."""
+    ids = {"reviews": [], "listings": [], "sold": [], "notifications": []}
+    errors, latencies = [], []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for r_ids, r_errors, r_lat in pool.map(lambda n: one_round(base, tag, n), range(iterations)):
+            for k, v in r_ids.items():
+                ids[k] += v
+            errors += r_errors
+            latencies += r_lat
+    return ids, errors, latencies
+
+
+def stored_ids(base, path):
+    status, out = call(base, "GET", path)
+    if status != 200:
+        raise RuntimeError(f"GET {path}: HTTP {status}")
+    return {r.get("id") for r in out["results"]}
+
+
+def verify(base, ids):
+    """Problems found reading back `ids` ({kind: [ids]}) from the server."""
+    problems = []
+    for kind, got in ids.items():
+        dups = len(got) - len(set(got))
+        if dups:
+            problems.append(f"{kind}: {dups} ids handed out twice")
+    checks = (("reviews", "/reviews/api/reviews?include_hidden=1&fields=id"),
+              ("listings", "/buyandsell/api/listings?status=sold&fields=id"),
+              ("sold", "/buyandsell/api/listings?status=sold&fields=id"),
+              ("notifications", "/upcomingphone/api/notifications?fields=id"))
+    for kind, path in checks:
+        missing = set(ids[kind]) - stored_ids(base, path)
+        if missing:
+            problems.append(f"{kind}: {len(missing)} of {len(set(ids[kind]))} missing, e.g. {sorted(missing)[:3]}")
+    return problems
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def copy_project(workdir):
+    """Copy the project (code and data, without virtualenvs, caches, databases or snapshots) to `workdir`."""
+    shutil.copytree(ROOT, workdir, ignore=shutil.ignore_patterns(
+        "venv", "__pycache__", "*.lock", "*.db", "*.db-*", "*.cols", "outbox.jsonl"))
+
+
+def start_server(workdir, workers, storage):
+    """Start the gateway from a scratch copy of the project; (process, base url)."""
+    copy_project(workdir)
+    return launch(workdir, workers, storage)
+
+
+def launch(workdir, workers, storage, timeout=60):
+    """Start the gateway of the project in `workdir` under gunicorn; (process, base url) once it answers."""
+    port = free_port()
+    env = {**os.environ, "SMARTSHOP_BIND": f"127.0.0.1:{port}", "SMARTSHOP_WORKERS": str(workers),
+           "SMARTSHOP_NOTIFY_INTERVAL": "0", "SMARTSHOP_STORAGE": storage}
+    env.pop("SMARTSHOP_DB", None)
+    try:
+        import gunicorn  # noqa: F401
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning", "gateway:app"]
+    except ImportError:
+        # e.g. Windows: one process with a thread per request
+        print("gunicorn is not installed: testing one threaded process", file=sys.stderr)
+        cmd = [sys.executable, "-c", f"from gateway import app; app.run(port={port}, threaded=True)"]
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if call(base, "GET", "/modules.json", timeout=2)[0] == 200:
+                return proc, base
+        except OSError:
+            time.sleep(0.2)
+        if proc.poll() is not None:
+            break
+    proc.kill()
+    raise RuntimeError("gateway did not start")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="gateway to test instead of a scratch server")
+    ap.add_argument("--storage", default="json", choices=("json", "sqlite"), help="backend of the scratch server")
+    ap.add_argument("--workers", type=int, default=4, help="gunicorn workers of the scratch server (default 4)")
+    ap.add_argument("--processes", type=int, default=4, help="client processes (default 4)")
+    ap.add_argument("--threads", type=int, default=8, help="threads per client process (default 8)")
+    ap.add_argument("--iterations", type=int, default=50, help="write rounds per client process (default 50)")
+    args = ap.parse_args(argv)
+
+    proc, tmp = None, None
+    base = (args.url or "").rstrip("/")
+    if not base:
+        tmp = tempfile.mkdtemp(prefix="smartshop-stress-")
+        proc, base = start_server(Path(tmp) / "project", args.workers, args.storage)
+    try:
+        started = time.perf_counter()
+        ids = {"reviews": [], "listings": [], "sold": [], "notifications": []}
+        errors, latencies = [], []
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            futures = [pool.submit(client, base, f"stress{os.getpid()}-{i}-{random.getrandbits(24):06x}",
+                                   args.threads, args.iterations) for i in range(args.processes)]
+            for f in futures:
+                c_ids, c_errors, c_lat = f.result()
+                for k, v in c_ids.items():
+                    ids[k] += v
+                errors += c_errors
+                latencies += c_lat
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0
+        print(f"{len(latencies)} writes from {args.processes} processes x {args.threads} threads in {elapsed:.1f}s "
+              f"({len(latencies) / elapsed:.0f}/s); latency p50 {pct(0.5):.1f} ms, p99 {pct(0.99):.1f} ms")
+        problems = [f"{len(errors)} failed requests, e.g. {errors[:3]}"] if errors else []
+        problems += verify(base, ids)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(30)
+            shutil.rmtree(tmp, ignore_errors=True)
+    for kind, got in ids.items():
+        print(f"  {kind}: {len(got)} written")
+    if problems:
+        print("FAILED:\n  " + "\n  ".join(problems))
+        return 1
+    print("OK: every write was read back, no id was handed out twice")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,12 @@
+import re
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def normalize(s):
+    return (s or "").strip().lower()
+
+
+def tokenize(s):
+    """Lowercased word tokens of `s` (letters/digits, split on everything else)."""
+    return _WORD.findall((s or "").lower())
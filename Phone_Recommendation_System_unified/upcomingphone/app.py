@@ -1,109 +1,241 @@
 
-from flask import Flask, jsonify, request, send_from_directory
+from bisect import bisect_left, bisect_right
+from flask import Blueprint, Flask, jsonify, request, send_from_directory
+from werkzeug.serving import is_running_from_reloader
 from pathlib import Path
-import json, datetime
+import datetime, sys
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 DATA_DIR = BASE_DIR / "data"
 PHONES_FILE = DATA_DIR / "upcoming_phones.json"
 NOTIFS_FILE = DATA_DIR / "notifications.json"
+DISPATCHES_FILE = DATA_DIR / "dispatches.json"
+sys.path.insert(0, str(BASE_DIR.parent))  # shared helpers live in ../smartshop
 
-app = Flask(__name__, static_folder=str(STATIC_DIR), static_url_path="")
+from smartshop.fanout import open_scheduler
+from smartshop.filecache import JsonFileIndex
+from smartshop.httpcache import cached_get
+from smartshop.ids import new_id
+from smartshop.metrics import instrument
+from smartshop.paging import find_page, page_args, paginate, project
+from smartshop.search import SearchIndex
+from smartshop.storage import open_store
+from smartshop.text import normalize
 
-def load_phones():
+bp = Blueprint("upcomingphone", __name__, static_folder=str(STATIC_DIR), static_url_path="")
+
+# JSON snapshot + append log by default, SQLite with SMARTSHOP_STORAGE=sqlite (see smartshop/storage.py)
+NOTIFS = open_store("notifications", NOTIFS_FILE)
+DISPATCHES = open_store("dispatches", DISPATCHES_FILE)
+
+# Calendar requests cover at most this many months
+MAX_MONTHS = 24
+
+# Launch events subscribers are notified of, in the order sent on the same day
+EVENTS = ("pre_order", "release")
+
+def parse_date(s):
+    """Day ordinal (date.toordinal()) of a YYYY-MM-DD string, or None if missing/invalid."""
     try:
-        with open(PHONES_FILE, "r", encoding="utf-8") as f:
-            phones = json.load(f)
-            # ensure release_date parsed to ISO date string
-            for p in phones:
-                p["release_date"] = p.get("release_date")
-            return phones
-    except FileNotFoundError:
-        return []
+        return datetime.datetime.strptime(s, "%Y-%m-%d").date().toordinal() if s else None
+    except (TypeError, ValueError):
+        return None
+
+class UpcomingSnapshot:
+    """
+    One version of upcoming_phones.json with its indexes:
+      - search: SearchIndex for `q`; pos: id -> position; brands: normalized brand per position
+      - release dates parsed once into day ordinals, with the dated phones
+        kept in both sort orders (soon: date ascending, latest: date
+        descending, ties in catalog order), so a date window is a bisect range
+      - launch events (pre_order_date, release_date) sorted by date, for the
+        notification scheduler
+    """
+
+    def __init__(self, phones, version):
+        self.phones = phones
+        self.version = version
+        self.search = SearchIndex(("brand", "model", "description", "notes"))
+        self.pos = {}
+        for i, p in enumerate(phones):
+            self.search.add(i, p)
+            self.pos.setdefault(p.get("id"), i)
+        self.brands = [normalize(p.get("brand")) for p in phones]
+        self.ords = [parse_date(p.get("release_date")) for p in phones]
+        self.undated = [i for i, o in enumerate(self.ords) if o is None]
+        soon = sorted((o, i) for i, o in enumerate(self.ords) if o is not None)
+        latest = sorted((-o, i) for o, i in soon)
+        self._orders = {
+            "soon": ([o for o, _ in soon], [i for _, i in soon]),
+            "latest": ([k for k, _ in latest], [i for _, i in latest]),
+        }
+        events = sorted((o, k, i) for i, p in enumerate(phones) for k, kind in enumerate(EVENTS)
+                        for o in [parse_date(p.get(f"{kind}_date"))] if o is not None)
+        self._event_ords = [o for o, _, _ in events]
+        self._events = [(i, EVENTS[k]) for _, k, i in events]
+
+    def events_between(self, lo, hi):
+        """[(phone, kind, "YYYY-MM-DD")] of launch events on day ordinals lo..hi, by date."""
+        a, b = bisect_left(self._event_ords, lo), bisect_right(self._event_ords, hi)
+        return [(self.phones[i], kind, datetime.date.fromordinal(o).isoformat())
+                for o, (i, kind) in zip(self._event_ords[a:b], self._events[a:b])]
+
+    def window(self, sort, lo=None, hi=None):
+        """Positions of phones released between day ordinals lo and hi (inclusive, optional), in `sort` order."""
+        keys, order = self._orders["soon" if sort == "soon" else "latest"]
+        if sort != "soon":
+            lo, hi = (-hi if hi is not None else None), (-lo if lo is not None else None)
+        a = bisect_left(keys, lo) if lo is not None else 0
+        b = bisect_right(keys, hi) if hi is not None else len(keys)
+        return order[a:b]
+
+    def days_until(self, i, today):
+        o = self.ords[i]
+        return o - today if o is not None else None
+
+    def item(self, i, today):
+        """The phone at position i as served, with `_days_until` from `today` (a day ordinal)."""
+        return {**self.phones[i], "_days_until": self.days_until(i, today)}
+
+    def filter(self, positions, q="", brand=""):
+        if q:
+            hits = {i for i, _ in self.search.search(q)}
+            positions = [i for i in positions if i in hits]
+        if brand:
+            positions = [i for i in positions if self.brands[i] == brand]
+        return positions
+
+class UpcomingCatalog(JsonFileIndex):
+    def build(self, records, version):
+        return UpcomingSnapshot(records, version)
+
+CATALOG = UpcomingCatalog.shared(PHONES_FILE)
+
+# Notifies subscribers when a phone's pre-order or release date arrives (see smartshop/fanout.py).
+# Not started on import: only processes that serve requests run it (gunicorn workers start it
+# in post_fork, see gunicorn.conf.py), never the preloading master, scripts or tools.
+LAUNCHES = open_scheduler(NOTIFS, DISPATCHES, lambda lo, hi: CATALOG.get().events_between(lo, hi), DATA_DIR)
+
+@bp.before_app_request
+def start_launches():
+    # any other server starts it with its first request; start() is a no-op once this process runs the thread
+    LAUNCHES.start()
+
+def load_phones():
+    return CATALOG.get().phones
 
 def read_notifications():
-    try:
-        with open(NOTIFS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+    return NOTIFS.all()
 
-def write_notifications(lst):
-    with open(NOTIFS_FILE, "w", encoding="utf-8") as f:
-        json.dump(lst, f, indent=2, ensure_ascii=False)
+def add_notification(entry):
+    return NOTIFS.insert(entry)
 
-@app.route("/")
+@bp.route("/")
 def index():
-    return app.send_static_file("index.html")
+    return bp.send_static_file("index.html")
+
+def dated_version():
+    # listings are relative to today (days window, _days_until)
+    return CATALOG.get().version, datetime.date.today().toordinal()
 
-@app.route("/api/upcoming", methods=["GET"])
+@bp.route("/api/upcoming", methods=["GET"])
+@cached_get(dated_version)
 def api_upcoming():
     """
     Query params:
-      - q: text search in model/brand/description
+      - q: text search in model/brand/description/notes (word prefixes)
       - brand: exact brand match (case-insensitive)
       - days: integer (show upcoming within next N days). default: 365
       - all: if "1", show all (past and future)
       - sort: "soon" or "latest" (soon = release_date ascending)
+      - limit, cursor, fields: pagination / projection (see smartshop/paging.py)
     """
-    phones = load_phones()
+    try:
+        page = page_args(request.args)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    snap = CATALOG.get()
     q = (request.args.get("q") or "").strip().lower()
-    brand = (request.args.get("brand") or "").strip().lower()
+    brand = normalize(request.args.get("brand"))
     days = request.args.get("days", type=int)
     show_all = request.args.get("all") == "1"
     sort = (request.args.get("sort") or "soon").strip().lower()
 
-    today = datetime.date.today()
+    today = datetime.date.today().toordinal()
 
-    results = []
-    for p in phones:
-        rd_str = p.get("release_date")
-        try:
-            rd = datetime.datetime.strptime(rd_str, "%Y-%m-%d").date() if rd_str else None
-        except Exception:
-            rd = None
-        # filters
-        if q:
-            txt = " ".join([str(p.get(k,"")).lower() for k in ("brand","model","description","notes")])
-            if q not in txt:
-                continue
-        if brand and p.get("brand","").strip().lower() != brand:
-            continue
-        if not show_all and rd:
-            if days is None:
-                days = 365
-            if rd < today or (rd - today).days > days:
-                continue
-        # compute days_until if rd present
-        days_until = None
-        if rd:
-            days_until = (rd - today).days
-        item = dict(p)
-        item["_days_until"] = days_until
-        results.append(item)
-
-    # sort
-    if sort == "soon":
-        results.sort(key=lambda x: (x["_days_until"] if x["_days_until"] is not None else 99999))
+    # phones without a (valid) release date are always listed: last for soon, first for latest
+    if show_all:
+        dated = snap.window(sort)
     else:
-        results.sort(key=lambda x: (x["_days_until"] if x["_days_until"] is not None else 99999), reverse=True)
+        dated = snap.window(sort, today, today + (365 if days is None else days))
+    positions = dated + snap.undated if sort == "soon" else snap.undated + dated
+    positions = snap.filter(positions, q=q, brand=brand)
+
+    # ties keep catalog order, which also gives cursors a total order
+    def order_key(i):
+        d = snap.days_until(i, today)
+        d = d if d is not None else 99999
+        return [d if sort == "soon" else -d, i]
+    try:
+        rows, next_cursor = paginate(positions, page, key=order_key)
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"invalid cursor"}), 400
+    rows = [snap.item(i, today) for i in rows]
+
+    return jsonify({"total": len(positions), "results": project(rows, page.fields), "next_cursor": next_cursor})
+
+@bp.route("/api/upcoming/calendar", methods=["GET"])
+@cached_get(dated_version)
+def api_calendar():
+    """
+    Upcoming phones bucketed by release month (phones without a release date are left out).
+    Query params:
+      - month: first month, YYYY-MM (default: the current month)
+      - months: number of consecutive months (default 1, at most 24)
+      - q, brand: same filters as /api/upcoming
+      - fields: projection of each phone
+    """
+    raw = (request.args.get("month") or "").strip()
+    try:
+        start = datetime.datetime.strptime(raw, "%Y-%m").date() if raw else datetime.date.today().replace(day=1)
+    except ValueError:
+        return jsonify({"status":"error","message":"month must look like 2025-10"}), 400
+    months = max(1, min(request.args.get("months", 1, type=int), MAX_MONTHS))
+    fields = [f.strip() for f in (request.args.get("fields") or "").split(",") if f.strip()] or None
+    snap = CATALOG.get()
+    q = (request.args.get("q") or "").strip().lower()
+    brand = normalize(request.args.get("brand"))
+    today = datetime.date.today().toordinal()
 
-    return jsonify({"total": len(results), "results": results})
+    buckets = []
+    year, month = start.year, start.month
+    for _ in range(months):
+        nxt = (year + month // 12, month % 12 + 1)
+        lo = datetime.date(year, month, 1).toordinal()
+        hi = datetime.date(*nxt, 1).toordinal() - 1 if nxt[0] <= datetime.MAXYEAR else datetime.date.max.toordinal()
+        positions = snap.filter(snap.window("soon", lo, hi), q=q, brand=brand)
+        buckets.append({"month": f"{year:04d}-{month:02d}", "total": len(positions),
+                        "results": project([snap.item(i, today) for i in positions], fields)})
+        year, month = nxt
+        if year > datetime.MAXYEAR:
+            break
+    return jsonify({"total": sum(b["total"] for b in buckets), "months": buckets})
 
-@app.route("/api/phone/<pid>", methods=["GET"])
+@bp.route("/api/phone/<pid>", methods=["GET"])
+@cached_get(lambda: CATALOG.get().version)
 def api_phone(pid):
-    phones = load_phones()
-    for p in phones:
-        if p.get("id") == pid:
-            return jsonify({"status":"ok","phone":p})
+    snap = CATALOG.get()
+    i = snap.pos.get(pid)
+    if i is not None:
+        return jsonify({"status":"ok","phone":snap.phones[i]})
     return jsonify({"status":"error","message":"not found"}), 404
 
-@app.route("/api/notify", methods=["POST"])
+@bp.route("/api/notify", methods=["POST"])
 def api_notify():
     """
     POST JSON or form: { "phone_id": "<id>", "name": "...", "contact": "...", "notes": "..." }
-    Stores notification request locally in data/notifications.json
+    Stores notification request locally (data/notifications.json + append log, or SQLite)
     """
     data = request.get_json(silent=True) or request.form.to_dict()
     phone_id = data.get("phone_id")
@@ -114,23 +246,69 @@ def api_notify():
     if not phone_id:
         return jsonify({"status":"error","message":"phone_id required"}), 400
 
-    notifs = read_notifications()
     entry = {
+        "id": new_id("N"),
         "phone_id": phone_id,
         "name": name,
         "contact": contact,
         "notes": notes,
         "created_at": datetime.datetime.utcnow().isoformat() + "Z"
     }
-    notifs.append(entry)
-    write_notifications(notifs)
+    add_notification(entry)
     return jsonify({"status":"ok","entry":entry})
 
-@app.route("/api/notifications", methods=["GET"])
+@bp.route("/api/notifications", methods=["GET"])
+@cached_get(lambda: NOTIFS.version())
 def api_notifications():
-    # admin helper to list saved notifications
-    notifs = read_notifications()
-    return jsonify({"total": len(notifs), "results": notifs})
+    """
+    Admin helper to list saved notifications, oldest first.
+    Query params: limit, cursor, fields (see smartshop/paging.py)
+    """
+    try:
+        page = page_args(request.args)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    try:
+        notifs, next_cursor = find_page(NOTIFS, page, order_by="created_at")
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"invalid cursor"}), 400
+    total = len(notifs) if page.limit is None else NOTIFS.stats()[0]
+    return jsonify({"total": total, "results": project(notifs, page.fields), "next_cursor": next_cursor})
+
+@bp.route("/api/notify/dispatches", methods=["GET"])
+def api_dispatches():
+    """
+    Admin helper: launch notification runs, newest first, with the scheduler settings.
+    Query params:
+      - state: running | done
+      - phone_id
+      - limit, cursor, fields (see smartshop/paging.py)
+    """
+    try:
+        page = page_args(request.args)
+    except ValueError as e:
+        return jsonify({"status":"error","message":str(e)}), 400
+    eq = {"state": request.args.get("state"), "phone_id": request.args.get("phone_id")}
+    try:
+        rows, next_cursor = find_page(DISPATCHES, page, eq=eq, order_by="started_at", desc=True)
+    except (TypeError, ValueError):
+        return jsonify({"status":"error","message":"invalid cursor"}), 400
+    total = len(rows) if page.limit is None else DISPATCHES.stats(eq=eq)[0]
+    return jsonify({"total": total, "results": project(rows, page.fields), "next_cursor": next_cursor,
+                    "scheduler": LAUNCHES.stats()})
+
+@bp.route("/api/notify/dispatch", methods=["POST"])
+def api_dispatch():
+    """Admin helper: look for due launch events now instead of at the next scheduler run."""
+    LAUNCHES.trigger()
+    return jsonify({"status":"ok","scheduler": LAUNCHES.stats()}), 202
+
+# Standalone server for this module; gateway.py mounts `bp` under /upcomingphone instead
+app = Flask(__name__, static_folder=None)
+app.register_blueprint(bp)
+instrument(app)
 
 if __name__ == "__main__":
+    if is_running_from_reloader():  # the serving child, not the debug reloader watching files
+        LAUNCHES.start()
     app.run(host="127.0.0.1", port=5004, debug=True)
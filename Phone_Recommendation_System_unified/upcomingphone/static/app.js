@@ -1,8 +1,11 @@
 
 const $ = s => document.querySelector(s);
+const PAGE_SIZE = 20;
+let nextCursor = null;
+let lastParams = {};
 
 async function fetchUpcoming(params={}){
-  const url = new URL(location.origin + "/api/upcoming");
+  const url = new URL("api/upcoming", location.href);
   Object.entries(params).forEach(([k,v])=>{ if (v !== undefined && v !== null && String(v).trim() !== "") url.searchParams.set(k, v); });
   const res = await fetch(url);
   return res.json();
@@ -42,7 +45,7 @@ function viewDetails(e){
   e.preventDefault();
   const id = e.currentTarget.getAttribute("data-id");
   // navigate to detail page? For simplicity, fetch phone and alert details
-  fetch(`/api/phone/${id}`).then(r=>r.json()).then(data=>{
+  fetch(`api/phone/${id}`).then(r=>r.json()).then(data=>{
     if (data.status === "ok") {
       const p = data.phone;
       alert(`${p.brand} ${p.model}\n\nRelease: ${p.release_date || "TBA"}\nPrice: ${p.price || "TBD"}\n\n${p.description || ""}\n\nNotes: ${p.notes || ""}`)
@@ -66,7 +69,7 @@ async function saveReminder(e){
   const form = new FormData(e.target);
   const payload = {};
   for (const [k,v] of form.entries()) payload[k]=v;
-  const res = await fetch("/api/notify", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify(payload) });
+  const res = await fetch("api/notify", { method: "POST", headers: {"Content-Type":"application/json"}, body: JSON.stringify(payload) });
   const data = await res.json();
   if (data.status === "ok") {
     alert("Reminder saved. We'll keep it on file (demo).");
@@ -75,14 +78,38 @@ async function saveReminder(e){
 }
 
 async function renderResults(params={}){
-  const data = await fetchUpcoming(params);
+  lastParams = params;
+  const data = await fetchUpcoming({ ...params, limit: PAGE_SIZE });
   $("#results").innerHTML = "";
   $("#count").textContent = `(${data.total})`;
   if (data.total === 0) {
     $("#results").innerHTML = `<div class="small">No upcoming phones found. Try widening the days range or clear filters.</div>`;
+    setNextCursor(null);
     return;
   }
   data.results.forEach(p => $("#results").appendChild(phoneCard(p)));
+  setNextCursor(data.next_cursor);
+}
+
+async function loadMoreResults(){
+  const data = await fetchUpcoming({ ...lastParams, limit: PAGE_SIZE, cursor: nextCursor });
+  data.results.forEach(p => $("#results").appendChild(phoneCard(p)));
+  setNextCursor(data.next_cursor);
+}
+
+function setNextCursor(cursor){
+  nextCursor = cursor;
+  let btn = $("#loadMore");
+  if (!btn) {
+    btn = document.createElement("button");
+    btn.id = "loadMore";
+    btn.type = "button";
+    btn.className = "btn";
+    btn.textContent = "Load more";
+    btn.addEventListener("click", loadMoreResults);
+    $("#results").after(btn);
+  }
+  btn.style.display = cursor ? "" : "none";
 }
 
 function populateBrands(phones){
@@ -99,7 +126,7 @@ document.addEventListener("DOMContentLoaded", async ()=>{
   const showAll = urlParams.get("all");
   const params = {};
   if (showAll === "1") params.all = "1";
-  const initial = await fetchUpcoming(params);
+  const initial = await fetchUpcoming({ ...params, fields: "brand" });
   populateBrands(initial.results);
   renderResults(params);
 